@@ -0,0 +1,38 @@
+import torch
+import argparse
+from models.Nets import Nets
+from models.Factory import build_model
+from utils.benchmark import compare_cpu_perf
+
+##########################################################################################################################################
+#                   Speedup of the CPU execution mode (cpu_perf option of train_model and compute_metrics)                              #
+#      Forward and train step times of the four nets in the default execution and with channels_last, bfloat16 autocast and threads     #
+##########################################################################################################################################
+
+
+if __name__ == "__main__":
+    
+    parser = argparse.ArgumentParser(description='Speedup of the cpu_perf execution mode')
+    parser.add_argument('--batch_size', type=int, default=100, help='Batch size of the timed passes (default 100)')
+    parser.add_argument('--n_iter', type=int, default=20, help='Number of timed passes (default 20)')
+    parser.add_argument('--no_channels_last', action='store_true', default=False, help='Keep the NCHW memory format (default False)')
+    parser.add_argument('--no_bf16', action='store_true', default=False, help='Run in float32 (default False)')
+    parser.add_argument('--intra_op_threads', type=int, default=None, help='Number of intra-op threads (default physical cores)')
+    parser.add_argument('--inter_op_threads', type=int, default=None, help='Number of inter-op threads (default 1)')
+    args, _ = parser.parse_known_args()
+    
+    cpu_perf = {'channels_last' : not args.no_channels_last, 'bf16' : not args.no_bf16}
+    # the threads of CPU_PERF_DEFAULT are kept unless given
+    cpu_perf.update({name : getattr(args, name) for name in ['intra_op_threads', 'inter_op_threads'] if getattr(args, name) is not None})
+    
+    torch.manual_seed(0)
+    input_ = torch.randn(args.batch_size, 2, 14, 14)
+    
+    print('{:>18} | {:>12} {:>14} {:>8} | {:>12} {:>14} {:>8}'.format('net', 'forward [ms]', 'cpu_perf [ms]', 'speedup',
+                                                                     'train [ms]', 'cpu_perf [ms]', 'speedup'))
+    for name in ['Net2c', 'LeNet_sharing', 'LeNet_sharing_aux', 'Google_Net'] :
+        model = build_model(getattr(Nets(), name))
+        times = compare_cpu_perf(model, input_, cpu_perf, args.n_iter)
+        print('{:>18} | {:>12.2f} {:>14.2f} {:>7.2f}x | {:>12.2f} {:>14.2f} {:>7.2f}x'.format(name, 
+              1e3 * times['forward'], 1e3 * times['forward cpu_perf'], times['forward speedup'],
+              1e3 * times['train step'], 1e3 * times['train step cpu_perf'], times['train step speedup']))
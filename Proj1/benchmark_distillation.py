@@ -0,0 +1,64 @@
+import torch
+import argparse
+from models.Nets import Nets
+from models.Factory import build_model
+from models.Basic import Net2C
+from utils.loader import PairSetMNIST, Training_set, Test_set, Training_set_split, Validation_set
+from utils.training import train_model
+from utils.distillation import train_distillation
+from utils.metrics import compute_metrics
+from utils.benchmark import time_forward
+from utils.compression import count_parameters
+
+##########################################################################################################################################
+#                   Knowledge distillation of Google_Net / LeNet_sharing_aux into a compact Net2C                                        #
+#      Test accuracy, parameters and latency of the teacher, of the student trained on the labels and of the distilled student         #
+##########################################################################################################################################
+
+
+if __name__ == "__main__":
+    
+    parser = argparse.ArgumentParser(description='Knowledge distillation into a compact Net2C')
+    parser.add_argument('--teacher', type=str, default='LeNet_sharing_aux', choices=['LeNet_sharing_aux', 'Google_Net'],
+                        help='Teacher network of the Nets registry (default LeNet_sharing_aux)')
+    parser.add_argument('--augmentation', action='store_true', default=False, 
+                        help='Train the teacher and the students with rotation, translation and channel swap (default False)')
+    parser.add_argument('--nb_hidden', type=int, default=32, help='Number of hidden units of the Net2C student (default 32)')
+    parser.add_argument('--n_epochs', type=int, default=25, help='Number of training epochs (default 25)')
+    parser.add_argument('--temperature', type=float, default=4, help='Temperature of the distillation (default 4)')
+    parser.add_argument('--kappa', type=float, default=0.9, help='Weight of the distillation loss (default 0.9)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the data and of the initialization (default 0)')
+    args, _ = parser.parse_known_args()
+    
+    device = torch.device('cpu')
+    Net = getattr(Nets(), args.teacher)
+    augmentation = args.augmentation
+    if args.teacher == 'LeNet_sharing_aux' and augmentation :
+        Net['learning rate'] = Net['learning rate augm']
+    
+    torch.manual_seed(args.seed)
+    data = PairSetMNIST()
+    train_data = Training_set(data)
+    test_data = Test_set(data)
+    train_data_split = Training_set_split(train_data, augmentation, augmentation, augmentation)
+    validation_data = Validation_set(train_data)
+    input_ = torch.randn(100, 2, 14, 14)
+    
+    teacher = build_model(Net, augmentation)
+    train_model(teacher, train_data_split, validation_data, device, n_epochs = args.n_epochs, eta = Net['learning rate'])
+    
+    # same initialization for the student trained on the labels and the distilled one
+    torch.manual_seed(args.seed)
+    student = Net2C(nb_hidden = args.nb_hidden, dropout_prob = 0)
+    distilled = Net2C(nb_hidden = args.nb_hidden, dropout_prob = 0)
+    distilled.load_state_dict(student.state_dict())
+    
+    train_model(student, train_data_split, validation_data, device, n_epochs = args.n_epochs)
+    train_distillation(distilled, teacher, train_data_split, validation_data, device, n_epochs = args.n_epochs, 
+                       temperature = args.temperature, kappa = args.kappa)
+    
+    print('{:>18} | {:>10} | {:>12} | {:>9}'.format('model', 'parameters', 'forward [ms]', 'test [%]'))
+    for name, model in [('teacher', teacher), ('student', student), ('distilled student', distilled)] :
+        model.eval()
+        _, acc = compute_metrics(model, test_data, device)
+        print('{:>18} | {:>10} | {:>12.2f} | {:>9.2f}'.format(name, count_parameters(model), 1e3 * time_forward(model, input_), acc))
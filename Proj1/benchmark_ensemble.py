@@ -0,0 +1,58 @@
+import time
+import torch
+import argparse
+from models.Nets import Nets
+from models.Factory import build_model
+from utils.loader import seeded_datasets
+from utils.training import train_model
+from utils.ensemble import train_ensemble
+
+##########################################################################################################################################
+#                   Speedup of the ensemble mode of evaluate_model (utils/ensemble.py)                                                   #
+#      Time of n_epochs of training of K seeds one after the other (train_model) and in lock-step as one vectorized model              #
+##########################################################################################################################################
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Speedup of the vectorized multi-seed training')
+    parser.add_argument('--seeds', type=int, default=10, help='Number of seeds trained together (default 10)')
+    parser.add_argument('--n_epochs', type=int, default=2, help='Number of timed epochs (default 2)')
+    parser.add_argument('--batch_size', type=int, default=100, help='Batch size of each seed (default 100)')
+    parser.add_argument('--threads', type=int, default=None, help='Number of intra-op threads (default torch)')
+    parser.add_argument('--nets', type=str, nargs='+', default=['Net2c', 'LeNet_sharing', 'LeNet_sharing_aux', 'Google_Net'],
+                        help='Nets of the <Nets> class to compare (default all four)')
+    args, _ = parser.parse_known_args()
+
+    if args.threads is not None :
+        torch.set_num_threads(args.threads)
+    device = torch.device('cpu')
+    seeds = list(range(1, args.seeds + 1))
+    datas = [seeded_datasets(seed) for seed in seeds]
+
+    print('{:d} intra-op threads'.format(torch.get_num_threads()))
+    print('{:>18} | {:>15} {:>14} {:>8}'.format('net', 'sequential [s]', 'ensemble [s]', 'speedup'))
+    for name in args.nets :
+        Net = getattr(Nets(), name)
+        models = []
+        for seed in seeds :
+            torch.manual_seed(seed)
+            models.append(build_model(Net))
+
+        start = time.perf_counter()
+        for model, (train_data, validation_data, _) in zip(models, datas) :
+            train_model(model, train_data, validation_data, device, args.batch_size, n_epochs = args.n_epochs,
+                        eta = Net['learning rate'])
+        sequential = time.perf_counter() - start
+
+        models = []
+        for seed in seeds :
+            torch.manual_seed(seed)
+            models.append(build_model(Net))
+
+        start = time.perf_counter()
+        train_ensemble(models, [data[0] for data in datas], [data[1] for data in datas], seeds, device, args.batch_size,
+                       n_epochs = args.n_epochs, eta = Net['learning rate'])
+        ensemble = time.perf_counter() - start
+
+        print('{:>18} | {:>15.2f} {:>14.2f} {:>7.2f}x'.format(name, sequential, ensemble, sequential / ensemble))
@@ -0,0 +1,51 @@
+import torch
+import argparse
+from models.Nets import Nets
+from models.Inception_Net import Google_Net
+from utils.benchmark import time_forward, count_flops_activations
+
+##########################################################################################################################################
+#                   Benchmark of the early spatial reduction layouts of Google_Net                                                       #
+#      Latency, FLOPs and activation memory of the shared trunk and optionally the accuracy over several seeds                        #
+##########################################################################################################################################
+
+# (reduction, reduction_size) layouts to compare
+layouts = [(None, 14), ('before', 7), ('inside', 7), ('inside', 4)]
+
+
+if __name__ == "__main__":
+    
+    parser = argparse.ArgumentParser(description='Benchmark of the early spatial reduction of Google_Net')
+    parser.add_argument('--batch_size', type=int, default=100, help='Batch size of the timed passes (default 100)')
+    parser.add_argument('--accuracy', action='store_true', default=False, 
+                        help='Also train every layout with evaluate_model and compare the test accuracies (default False)')
+    parser.add_argument('--seeds', type=int, default=3, help='Number of seeds for the accuracy comparison (default 3)')
+    parser.add_argument('--n_epochs', type=int, default=40, help='Number of epochs for the accuracy comparison (default 40)')
+    args, _ = parser.parse_known_args()
+    
+    torch.manual_seed(0)
+    input_ = torch.randn(args.batch_size, 1, 14, 14)
+    pairs = torch.randn(args.batch_size, 2, 14, 14)
+    
+    print('{:>8} {:>5} | {:>12} {:>14} | {:>14} {:>16}'.format('layout', 'size', 'trunk GFLOPs', 'activ. [MB]',
+                                                              'forward [ms]', 'train step [ms]'))
+    for reduction, reduction_size in layouts :
+        model = Google_Net(reduction = reduction, reduction_size = reduction_size)
+        model.eval()
+        flops, activations = count_flops_activations(model, input_, model.trunk)
+        forward = time_forward(model, pairs)
+        model.train()
+        train_step = time_forward(model, pairs, backward = True)
+        print('{:>8} {:>5} | {:>12.3f} {:>14.2f} | {:>14.2f} {:>16.2f}'.format(str(reduction or 'full'), reduction_size, flops / 1e9, 
+                                                                              activations / 2**20, 1e3 * forward, 1e3 * train_step))
+    
+    if args.accuracy :
+        from utils.Evaluate import evaluate_model
+        
+        seeds = list(range(1, args.seeds + 1))
+        for reduction, reduction_size in layouts :
+            Net = Nets().Google_Net
+            Net['reduction'], Net['reduction_size'] = reduction, reduction_size
+            _, _, test_accuracies = evaluate_model(Net, seeds, n_epochs = args.n_epochs, plot = False, statistics = False)
+            print('{:>8} {:>5} | Test accuracy : {:.2f}% +- {:.2f}'.format(str(reduction or 'full'), reduction_size, test_accuracies.mean(), 
+                                                                           test_accuracies.std()))
@@ -0,0 +1,34 @@
+import torch
+import argparse
+from models.Nets import Nets
+from models.Factory import build_model
+from utils.profiler import profile_model, print_profile, write_chrome_trace
+
+##########################################################################################################################################
+#                   Per-layer profile of a net of the <Nets> class : forward / backward time, FLOPs, parameters and activations         #
+#      Sorted table of the submodules and Chrome trace of one training step (chrome://tracing or https://ui.perfetto.dev)              #
+##########################################################################################################################################
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Per-layer forward and backward profile of a net')
+    parser.add_argument('--net', type=str, default='Google_Net', help='Net of the <Nets> class to profile (default Google_Net)')
+    parser.add_argument('--batch_size', type=int, default=100, help='Batch size of the profiled passes (default 100)')
+    parser.add_argument('--n_iter', type=int, default=5, help='Number of profiled passes (default 5)')
+    parser.add_argument('--sort', type=str, default='forward', help='forward, backward, flops, bytes or params (default forward)')
+    parser.add_argument('--leaves_only', action='store_true', default=False, help='Only list the layers, not the blocks (default False)')
+    parser.add_argument('--top', type=int, default=None, help='Number of listed submodules (default all)')
+    parser.add_argument('--inference', action='store_true', default=False, help='Profile the forward pass only in eval mode (default False)')
+    parser.add_argument('--trace', type=str, default='trace.json', help='Path of the Chrome trace (default trace.json)')
+    args, _ = parser.parse_known_args()
+
+    torch.manual_seed(0)
+    model = build_model(getattr(Nets(), args.net))
+    model.train(not args.inference)
+    pairs = torch.randn(args.batch_size, 2, 14, 14)
+
+    stats, trace = profile_model(model, pairs, n_iter = args.n_iter, backward = not args.inference)
+    print_profile(stats, args.sort, args.leaves_only, args.top)
+    write_chrome_trace(trace, args.trace)
+    print('\nChrome trace of the last pass written to {}'.format(args.trace))
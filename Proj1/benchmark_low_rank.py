@@ -0,0 +1,62 @@
+import torch
+import argparse
+from models.Nets import Nets
+from models.Factory import build_model
+from utils.loader import PairSetMNIST, Training_set, Test_set, Training_set_split, Validation_set
+from utils.training import train_model
+from utils.metrics import compute_metrics
+from utils.benchmark import time_forward
+from utils.compression import factorize_model, count_parameters
+
+##########################################################################################################################################
+#                   Low-rank factorization of the large linear layers : parameters, latency and accuracy trade-off                     #
+#      A trained net is factorized by truncated SVD at several ranks or energy thresholds and fine-tuned for a few epochs            #
+##########################################################################################################################################
+
+
+if __name__ == "__main__":
+    
+    parser = argparse.ArgumentParser(description='Low-rank factorization of the linear layers of a trained net')
+    parser.add_argument('--net', type=str, default='Google_Net', choices=['Net2c', 'LeNet_sharing', 'LeNet_sharing_aux', 'Google_Net'],
+                        help='Network of the Nets registry (default Google_Net)')
+    parser.add_argument('--layers', type=str, nargs='+', default=None, 
+                        help='Names of the linear layers to factorize (default auxiliary.fc1 for Google_Net, all the others)')
+    parser.add_argument('--ranks', type=int, nargs='+', default=[], help='Ranks of the truncated SVD')
+    parser.add_argument('--energies', type=float, nargs='+', default=[0.99, 0.95, 0.9], 
+                        help='Energy thresholds of the truncated SVD (default 0.99 0.95 0.9)')
+    parser.add_argument('--n_epochs', type=int, default=25, help='Number of training epochs of the dense net (default 25)')
+    parser.add_argument('--fine_tune', type=int, default=3, help='Number of fine-tuning epochs of the factorized nets (default 3)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the data and of the initialization (default 0)')
+    args, _ = parser.parse_known_args()
+    
+    device = torch.device('cpu')
+    Net = getattr(Nets(), args.net)
+    layers = args.layers if (args.layers is not None or args.net != 'Google_Net') else ['auxiliary.fc1']
+    
+    torch.manual_seed(args.seed)
+    data = PairSetMNIST()
+    train_data = Training_set(data)
+    test_data = Test_set(data)
+    train_data_split = Training_set_split(train_data, False, False, False)
+    validation_data = Validation_set(train_data)
+    input_ = torch.randn(100, 2, 14, 14)
+    
+    model = build_model(Net)
+    train_model(model, train_data_split, validation_data, device, n_epochs = args.n_epochs, eta = Net['learning rate'])
+    
+    def report(name, model) :
+        model.eval()
+        _, acc = compute_metrics(model, test_data, device)
+        print('{:>22} | {:>10} | {:>12.2f} | {:>9.2f}'.format(name, count_parameters(model), 1e3 * time_forward(model, input_), acc))
+    
+    print('{:>22} | {:>10} | {:>12} | {:>9}'.format('model', 'parameters', 'forward [ms]', 'test [%]'))
+    report('dense', model)
+    
+    # truncations of the SVD to compare
+    settings = [('rank', r, {'rank' : r}) for r in args.ranks] + [('energy', e, {'energy' : e}) for e in args.energies]
+    for kind, value, truncation in settings :
+        factorized, ranks = factorize_model(model, layers, **truncation)
+        report('{} {} {}'.format(kind, value, list(ranks.values())), factorized)
+        # short fine-tuning of the factorized net with a tenth of the learning rate
+        train_model(factorized, train_data_split, validation_data, device, n_epochs = args.fine_tune, eta = Net['learning rate'] / 10)
+        report('  + fine-tune', factorized)
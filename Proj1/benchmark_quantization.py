@@ -0,0 +1,47 @@
+import torch
+import argparse
+from models.Nets import Nets
+from models.Factory import build_model
+from utils.loader import PairSetMNIST, Training_set, Test_set, Training_set_split, Validation_set
+from utils.training import train_model
+from utils.quantization import quantize_model, compare_quantized
+
+##########################################################################################################################################
+#                   Int8 quantization of the trained nets : test accuracy, latency and size of the float and int8 models                #
+#      Static quantization of the convolutional trunks calibrated on the validation set, dynamic quantization of the linear layers     #
+##########################################################################################################################################
+
+
+if __name__ == "__main__":
+    
+    parser = argparse.ArgumentParser(description='Accuracy and latency of the int8 quantized nets')
+    parser.add_argument('--n_epochs', type=int, default=25, help='Number of training epochs (default 25)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the data and of the initialization (default 0)')
+    parser.add_argument('--n_batches', type=int, default=None, help='Number of calibration batches (default the whole validation set)')
+    parser.add_argument('--backend', type=str, default='x86', help='Quantized engine of torch (default x86)')
+    args, _ = parser.parse_known_args()
+    
+    device = torch.device('cpu')
+    
+    print('{:>18} | {:>9} {:>9} | {:>12} {:>12} | {:>10} {:>10}'.format('net', 'float [%]', 'int8 [%]', 'float [ms]', 'int8 [ms]',
+                                                                       'float [kB]', 'int8 [kB]'))
+    for name in ['Net2c', 'LeNet_sharing', 'LeNet_sharing_aux', 'Google_Net'] :
+        Net = getattr(Nets(), name)
+        
+        # same data and initialization for every net
+        torch.manual_seed(args.seed)
+        data = PairSetMNIST()
+        train_data = Training_set(data)
+        test_data = Test_set(data)
+        train_data_split = Training_set_split(train_data, False, False, False)
+        validation_data = Validation_set(train_data)
+        
+        model = build_model(Net)
+        train_model(model, train_data_split, validation_data, device, n_epochs = args.n_epochs, eta = Net['learning rate'])
+        
+        # calibration on the validation set, the test set is only used for the comparison
+        quantized = quantize_model(model, validation_data, n_batches = args.n_batches, backend = args.backend)
+        results = compare_quantized(model, quantized, test_data)
+        print('{:>18} | {:>9.2f} {:>9.2f} | {:>12.2f} {:>12.2f} | {:>10.1f} {:>10.1f}'.format(name,
+              results['float']['accuracy'], results['int8']['accuracy'], 1e3 * results['float']['forward'], 
+              1e3 * results['int8']['forward'], results['float']['size'] / 1024, results['int8']['size'] / 1024))
@@ -0,0 +1,28 @@
+import torch
+import argparse
+from models.Nets import Nets
+from models.Factory import build_model
+from utils.export import export_torchscript
+
+
+if __name__ == "__main__":
+    
+    # Export a trained model of the Nets registry as a frozen TorchScript artifact which can be run with runtime.py
+    parser = argparse.ArgumentParser(description='Export a trained Proj1 model to a frozen TorchScript file')
+    parser.add_argument('--net', type=str, required=True, choices=['Net2c', 'LeNet_sharing', 'LeNet_sharing_aux', 'Google_Net'],
+                        help='Network of the Nets registry')
+    parser.add_argument('--weights', type=str, required=True, help='state_dict of the trained model saved with torch.save')
+    parser.add_argument('--output', type=str, required=True, help='File of the TorchScript artifact')
+    parser.add_argument('--augmented', action='store_true', default=False, 
+                        help='Use the parameters tuned with data augmentation (default False)')
+    parser.add_argument('--no_fold', action='store_true', default=False, 
+                        help='Do not fold the batch norm into the convolutions (default False)')
+    args, _ = parser.parse_known_args()
+    
+    # construct the network with the parameters of the registry and load the trained weights
+    Net = getattr(Nets(), args.net)
+    model = build_model(Net, args.augmented)
+    model.load_state_dict(torch.load(args.weights, map_location='cpu'))
+    
+    export_torchscript(model, args.output, args.net, fold = not args.no_fold)
+    print('Exported {} to {}'.format(args.net, args.output))
@@ -44,7 +44,7 @@ class Net2C(nn.Module):
         #              -> Dropout used on the the nodes of the hidden layer 
         x = F.relu(F.max_pool2d(self.conv1(x), kernel_size = 3, stride = 1)) # Nx32x8x8
         x = F.relu(F.max_pool2d(self.conv2(x), kernel_size = 3, stride = 3)) # Nx64x2x2
-        x = F.relu(self.fc1(x.view(-1, 256))) # Nxnb_hidden
+        x = F.relu(self.fc1(x.reshape(-1, 256))) # Nxnb_hidden
         x = self.dropout(x) # Nxnb_hidden -> some element are put randomly to zero by dropout
         x = self.fc2(x) # Nx2
     
@@ -0,0 +1,43 @@
+import torch 
+from torch import nn 
+
+###########################################################################################################################################
+
+def build_model(Net, augmented = False):
+    
+    """
+    
+     General : Construct an initialized network from one of the dictionnaries of the <Nets> class
+     
+     Input :
+     
+         - Net : A network dictionnary from the <Nets> class
+         - augmented : if true use the parameters tuned with data augmentation (LeNet_sharing_aux) -> default False
+         
+     Output : an instance of the network class of Net['net'] with the parameters of the dictionnary
+     
+    """
+    
+    # construct the net type with default parameter 
+    if (Net['net_type'] == 'Net2c') :
+        model = Net['net'](nb_hidden = Net['hidden_layers'],dropout_prob = Net['drop_prob'])
+    if (Net['net_type'] == 'LeNet_sharing') :
+        model = Net['net'](nb_hidden = Net['hidden_layers'],dropout_ws = Net['drop_prob_ws'],dropout_comp = Net['drop_prob_comp'])
+    if (Net['net_type'] == 'LeNet_sharing_aux') :
+        # if no data augmentation construct with tuned parameters without data augmentation
+        # if data augmentation construct with tuned parameters with data augmentation
+        if not augmented :
+            model = Net['net'](nbhidden_aux = Net['hidden_layers_aux'],nbhidden_comp = Net['hidden_layers_comp'],
+                               drop_prob_aux =Net['drop_prob_aux'],drop_prob_comp = Net['drop_prob_comp'])
+        else :
+            model = Net['net'](nbhidden_aux = Net['hidden_layers_aux'],nbhidden_comp = Net['hidden_layers_comp'],
+                               drop_prob_aux =Net['drop_prob_aux_augm'],drop_prob_comp = Net['drop_prob_comp_augm'])       
+    if (Net['net_type'] == 'Google_Net') :
+        model = Net['net'](channels_1x1 = Net['channels_1x1'],
+                           channels_3x3 = Net['channels_3x3'],channels_5x5=Net['channels_5x5'],pool_channels = Net['pool_channels'],
+                           nhidden = Net['hidden_layers'], drop_prob_comp = Net['drop_prob_comp'],drop_prob_aux = Net['drop_prob_aux'],
+                           reduction = Net['reduction'], reduction_size = Net['reduction_size'])
+    
+    return model
+
+###########################################################################################################################################
@@ -5,7 +5,9 @@ from torch import nn
 from torch.nn import functional as F
 from torch import optim
 import torch.utils.data as dt
+import copy
 from torch.utils.data import Dataset, DataLoader
+from models.Layers import Split_BatchNorm2d, set_batch_norm_groups, stack_channels
 
 #####################################################################################################
 #                               Google_Net inspired network                                         #
@@ -25,7 +27,7 @@ class conv_block(nn.Module) :
     def __init__(self, in_channels,out_channels,kernel_size = 1,stride =1, padding = 0) :
         super(conv_block,self).__init__()
         self.conv = nn.Conv2d(in_channels,out_channels,kernel_size,stride ,padding)
-        self.bn = nn.BatchNorm2d(out_channels)
+        self.bn = Split_BatchNorm2d(out_channels)
     
     def forward(self,x) :
         x = self.bn(self.conv(x))
@@ -55,13 +57,19 @@ class Inception_block(nn.Module):
      Parameters : Not tuned in this project, only use default 64
       
       channels_1x1,channels_3x3,channels_5x5,pool_channels -> ouptut number of channels of each scales 
+      reduction_size : if not None, early spatial reduction -> the outputs of the 1x1 convolutions (and of the pooling scale) are 
+                       average pooled to reduction_size x reduction_size before the expensive factorized 3x3 and 5x5 convolutions 
+                       -> default None
       
     
     """
-    def __init__(self,in_channels,channels_1x1,channels_3x3,channels_5x5,pool_channels):
+    def __init__(self,in_channels,channels_1x1,channels_3x3,channels_5x5,pool_channels, reduction_size = None):
         
         super(Inception_block, self).__init__()
         
+        # early spatial reduction
+        self.reduction_size = reduction_size
+        
         # 1x1 convolution
         self.conv1x1 = conv_block(in_channels,channels_1x1, kernel_size = 1)
         
@@ -80,15 +88,33 @@ class Inception_block(nn.Module):
         # pooling layer 
         self.pool = nn.Sequential(nn.MaxPool2d(kernel_size=3, stride=1, padding=1),
                                   conv_block(in_channels, pool_channels, kernel_size=1))
-
+        
+    def reduce(self, x):
+        
+        # early spatial reduction : Nx64x14x14 -> Nx64xreduction_sizexreduction_size
+        if self.reduction_size is None :
+            return x
+        
+        return F.adaptive_avg_pool2d(x, self.reduction_size)
+        
+    @staticmethod
+    def tail(branch, x):
+        
+        # layers of a branch after its first convolution
+        for layer in list(branch)[1:] :
+            x = layer(x)
+        
+        return x
         
     def forward(self, x):
         
-        # compute the four filter of the inception block :  Nx64x14x14
-        scale1 = F.relu(self.conv1x1(x))
-        scale2 = F.relu(self.conv3x3(x))
-        scale3 = F.relu(self.conv5x5(x))
-        scale4 = F.relu(self.pool(x))
+        # compute the four filter of the inception block :  Nx64x14x14 (or reduced)
+        scale1 = F.relu(self.reduce(self.conv1x1(x)))
+        # the reduction is applied after the first (1x1) convolution of the branches, the layers are called one by one so that the 
+        # block stays symbolically traceable (torch.fx quantization), slicing the Sequential would create a new module
+        scale2 = F.relu(self.tail(self.conv3x3, self.reduce(self.conv3x3[0](x))))
+        scale3 = F.relu(self.tail(self.conv5x5, self.reduce(self.conv5x5[0](x))))
+        scale4 = F.relu(self.reduce(self.pool(x)))
         
         # concatenate layer for next result
         outputs = [scale1, scale2, scale3, scale4]
@@ -100,6 +126,93 @@ class Inception_block(nn.Module):
 
 ############################################################################################################################
 
+class Inception_block_merged(nn.Module):
+    """
+     General : Inception block equivalent to Inception_block where the three 1x1 convolutions applied on the input (the 1x1 scale 
+               and the heads of the 3x3 and 5x5 scales) are computed as a single wider 1x1 convolution 
+     
+      Input : Nx1x14x14
+      Output by default : Nx256x14x14 
+      
+      1x1 reduction : Nx1x14x14 -> Nx(64+64+64)x14x14 split afterwards in the three scales
+      -> one read of the input and one kernel instead of three, the batch norm acts per channel so the merged batch norm is 
+         equivalent to the three original ones in training and evaluation mode
+     
+     Parameters : same as Inception_block
+     
+     => from_inception_block builds it from the weights of a trained Inception_block
+    """
+    def __init__(self,in_channels,channels_1x1,channels_3x3,channels_5x5,pool_channels, reduction_size = None):
+        
+        super(Inception_block_merged, self).__init__()
+        
+        self.channels = [channels_1x1, channels_3x3, channels_5x5]
+        
+        # early spatial reduction
+        self.reduction_size = reduction_size
+        
+        # merged 1x1 convolutions of the 1x1, 3x3 and 5x5 scales
+        self.reduction = conv_block(in_channels, channels_1x1 + channels_3x3 + channels_5x5, kernel_size = 1)
+        
+        # 3x3 convolution factorized in 1x3 followed by 3x1
+        self.conv3x3 = nn.Sequential(conv_block(channels_3x3, channels_3x3, kernel_size = (1,3), padding = (0,1)),
+                                     conv_block(channels_3x3, channels_3x3, kernel_size = (3,1), padding = (1,0)))
+        
+        # 5x5 convolution factorized in two consecutive 3x3 implemented as above
+        self.conv5x5 = nn.Sequential(conv_block(channels_5x5, channels_5x5, kernel_size = (1,3),padding =(0,1)),
+                                     conv_block(channels_5x5, channels_5x5, kernel_size = (3,1), padding = (1,0)),
+                                     conv_block(channels_5x5,channels_5x5, kernel_size = (1,3),padding=(0,1)),
+                                     conv_block(channels_5x5, channels_5x5, kernel_size = (3,1),padding = (1,0)))
+        
+        # pooling layer 
+        self.pool = nn.Sequential(nn.MaxPool2d(kernel_size=3, stride=1, padding=1),
+                                  conv_block(in_channels, pool_channels, kernel_size=1))
+        
+    @classmethod
+    def from_inception_block(cls, block):
+        
+        # build the merged block from the weights and batch norm statistics of an Inception_block
+        heads = [block.conv1x1, block.conv3x3[0], block.conv5x5[0]]
+        merged = cls(heads[0].conv.in_channels, heads[0].conv.out_channels, heads[1].conv.out_channels, heads[2].conv.out_channels,
+                     block.pool[1].conv.out_channels, block.reduction_size).to(heads[0].conv.weight.device)
+        
+        with torch.no_grad() :
+            for name in ['weight', 'bias'] :
+                getattr(merged.reduction.conv, name).copy_(torch.cat([getattr(head.conv, name) for head in heads], 0))
+            for name in ['weight', 'bias', 'running_mean', 'running_var'] :
+                getattr(merged.reduction.bn, name).copy_(torch.cat([getattr(head.bn, name) for head in heads], 0))
+            merged.reduction.bn.num_batches_tracked.copy_(heads[0].bn.num_batches_tracked)
+        merged.reduction.bn.groups = heads[0].bn.groups
+        
+        # the other layers are kept as they are
+        merged.conv3x3 = copy.deepcopy(nn.Sequential(*list(block.conv3x3)[1:]))
+        merged.conv5x5 = copy.deepcopy(nn.Sequential(*list(block.conv5x5)[1:]))
+        merged.pool = copy.deepcopy(block.pool)
+        merged.train(block.training)
+        
+        return merged
+    
+    # early spatial reduction as in Inception_block
+    reduce = Inception_block.reduce
+        
+    def forward(self, x):
+        
+        # merged 1x1 convolutions split in the three scales :  Nx64x14x14 each (or reduced)
+        scale1, reduced3x3, reduced5x5 = self.reduce(self.reduction(x)).split(self.channels, 1)
+        
+        # compute the four filter of the inception block :  Nx64x14x14 (or reduced)
+        scale1 = F.relu(scale1)
+        scale2 = F.relu(self.conv3x3(reduced3x3))
+        scale3 = F.relu(self.conv5x5(reduced5x5))
+        scale4 = F.relu(self.reduce(self.pool(x)))
+        
+        # concatenate layer for next result -> Nx256x14x14
+        filters_cat = torch.cat([scale1, scale2, scale3, scale4],1)
+        
+        return filters_cat
+
+############################################################################################################################
+
 class Auxiliary_loss (nn.Module) :
     """
     General : CNN which output is used for digit recognition 0-9 -> auxiliary loss
@@ -131,7 +244,7 @@ class Auxiliary_loss (nn.Module) :
   
         x = F.adaptive_avg_pool2d(x, (4, 4)) #N x 256 x 14 x 14
         x = self.conv(x) # N x 128 x 4 x 4
-        x = x.view(-1,2048) # N x 2048
+        x = x.reshape(-1,2048) # N x 2048
         x = self.dropout(x) # N x 2048 -> some element are put randomly to zero by dropout
         x = F.relu(self.fc1(x)) # N x 1024
         x = self.dropout(x) # N x 1024 -> some element are put randomly to zero by dropout
@@ -159,15 +272,39 @@ class Google_Net (nn.Module) :
          2) nhidden : number of nodes of the second FC layers
          3) drop_prob_comp : dropout rate of the dropout module used in the FC layers for binary classification
          4) drop_prob_aux : dropout rate of Auxiliary CNN
+         5) fused : if true stack the two channels in a single 2N batch and run the inception block and the auxiliary CNN once
+                    -> default False
+         6) bn_split : in fused mode, normalize the two halves of the batch separately -> same batch norm statistics as running the 
+                       shared CNN twice -> default True
+         7) merged : if true use Inception_block_merged (single 1x1 reduction convolution) -> default False
+         8) reduction : early spatial reduction of the inception block -> default None (full 14x14 resolution)
+             - 'before' : average pool the Nx1x14x14 input to reduction_size before the inception block
+             - 'inside' : average pool the outputs of the 1x1 convolutions to reduction_size before the factorized 3x3 and 5x5 
+                          convolutions of the inception block
+         9) reduction_size : spatial size after the early reduction -> default 7 (4x less activations and FLOPs in the inception 
+                             block, 4 -> about 12x less)
+        
+     => merge_reductions converts a trained model to the merged inception block
         
     """
     
     def __init__(self,channels_1x1 = 64,channels_3x3 = 64,channels_5x5 =64,pool_channels = 64,nhidden = 60,
-                 drop_prob_comp = 0,drop_prob_aux = 0.7):
+                 drop_prob_comp = 0,drop_prob_aux = 0.7, fused = False, bn_split = True, merged = False, reduction = None,
+                 reduction_size = 7):
         super(Google_Net, self).__init__()
         
+        assert reduction in [None, 'before', 'inside'], "reduction should be None, 'before' or 'inside'"
+        
+        # early spatial reduction
+        self.reduction = reduction
+        self.reduction_size = reduction_size
+        block_reduction = reduction_size if reduction == 'inside' else None
+        
         # inception block
-        self.inception = Inception_block(1,channels_1x1,channels_3x3,channels_5x5,pool_channels)
+        if merged :
+            self.inception = Inception_block_merged(1,channels_1x1,channels_3x3,channels_5x5,pool_channels, block_reduction)
+        else :
+            self.inception = Inception_block(1,channels_1x1,channels_3x3,channels_5x5,pool_channels, block_reduction)
         
         # Auxiliary CNN
         self.auxiliary = Auxiliary_loss(256,drop_prob_aux)
@@ -180,28 +317,58 @@ class Google_Net (nn.Module) :
         # dropout
         self.dropout_comp = nn.Dropout(drop_prob_comp)
         
-    def forward(self, input_):
+        # fused siamese forward
+        self.fused = fused
+        if fused and bn_split :
+            set_batch_norm_groups(self, 2)
+        
+    def merge_reductions(self):
         
-        # split the 2-channel input into two 1*14*14 images
-        x = input_[:, 0, :, :].view(-1, 1, 14, 14)
-        y = input_[:, 1, :, :].view(-1, 1, 14, 14)
+        # copy of the model with the 1x1 reduction convolutions of the inception block merged -> numerically equivalent
+        merged = copy.deepcopy(self)
+        if isinstance(self.inception, Inception_block) :
+            merged.inception = Inception_block_merged.from_inception_block(self.inception)
         
-        # inception blocks
-        x = self.inception(x) #Nx256x14x14
-        y = self.inception(y) #Nx256x14x14
+        return merged
         
+    def trunk(self, x):
         
-        # auxiliary loss 
+        # inception block and auxiliary CNN : Nx1x14x14 -> Nx10
+        if self.reduction == 'before' :
+            x = F.adaptive_avg_pool2d(x, self.reduction_size) #Nx1xreduction_sizexreduction_size
+        x = self.inception(x) #Nx256x14x14 (or reduced)
         x = self.auxiliary(x) #Nx10
-        y = self.auxiliary(y) #Nx10
         
-        # concatenate layers  
-        z = torch.cat([x, y], 1) #Nx20
+        return x
+    
+    def head(self, z):
         
+        # FC layers for binary classification : Nx20 -> Nx2
         z = F.relu(self.fc1(z)) # Nxnhidden
         z = F.relu(self.fc2(z)) # Nx100
         z = self.dropout_comp(z) #Nx100 -> some element are put randomly to zero by dropout
         z = self.fc3(z) # Nx2
         
+        return z
+        
+    def forward(self, input_):
+        
+        if self.fused :
+            # inception block and auxiliary CNN on the two images stacked in a 2Nx1x14x14 batch
+            x, y = self.trunk(stack_channels(input_)).chunk(2, 0) # Nx10, Nx10
+        else :
+            # split the 2-channel input into two 1*14*14 images
+            x = input_[:, 0, :, :].view(-1, 1, 14, 14)
+            y = input_[:, 1, :, :].view(-1, 1, 14, 14)
+            
+            # inception blocks and auxiliary loss
+            x = self.trunk(x) #Nx10
+            y = self.trunk(y) #Nx10
+        
+        # concatenate layers  
+        z = torch.cat([x, y], 1) #Nx20
+        
+        z = self.head(z) # Nx2
+        
         
         return x,y,z
\ No newline at end of file
@@ -0,0 +1,52 @@
+import torch 
+from torch import nn 
+from torch.nn import functional as F
+
+###################################################################
+#            Layers shared by the weight sharing models           #
+###################################################################
+
+class Split_BatchNorm2d(nn.BatchNorm2d):
+    """
+    General : BatchNorm2d which can normalize a batch made of several stacked sub-batches independently
+    
+        In the fused siamese forward the two images of the pairs are stacked in a single 2N batch and go through the shared CNN 
+        at once. With groups = 2 the batch statistics of each half (first digits and second digits) are computed separately and the 
+        running statistics are updated twice, exactly as when the shared CNN is applied twice on N images.
+        
+        Same parameters and state_dict as nn.BatchNorm2d, in evaluation mode the running statistics are used and groups has no effect
+        
+    Parameters :
+        1) num_features : number of channels
+        2) groups : number of sub-batches normalized independently in training mode -> default 1 (plain BatchNorm2d)
+    """
+    
+    def __init__(self, num_features, groups = 1, **kwargs):
+        super(Split_BatchNorm2d, self).__init__(num_features, **kwargs)
+        self.groups = groups
+        
+    def forward(self, x):
+        
+        if self.training and self.groups > 1 :
+            return torch.cat([super(Split_BatchNorm2d, self).forward(x_) for x_ in x.chunk(self.groups, 0)], 0)
+        
+        return super(Split_BatchNorm2d, self).forward(x)
+    
+###################################################################
+
+def set_batch_norm_groups(model, groups):
+    """
+    Set the number of independently normalized sub-batches of all the Split_BatchNorm2d of a model
+    """
+    for module in model.modules():
+        if isinstance(module, Split_BatchNorm2d):
+            module.groups = groups
+            
+def stack_channels(input_):
+    """
+    Stack the two channels of the pairs in a single batch for the fused siamese forward
+    
+        Input : Nx2x14x14
+        Output : 2Nx1x14x14 -> the N first digits followed by the N second digits
+    """
+    return input_.transpose(0, 1).reshape(-1, 1, input_.size(2), input_.size(3))
@@ -3,6 +3,7 @@ from torch import nn
 from torch.nn import functional as F
 from torch import optim
 from torch.utils.data import Dataset, DataLoader
+from models.Layers import Split_BatchNorm2d, set_batch_norm_groups, stack_channels
 
 ###################################################################
 #                    Le_Net inspired network                      #
@@ -33,16 +34,23 @@ class LeNet_sharing_aux(nn.Module):
         2) nb_hidden_comp : number of nodes of the second layer of the FC layers
         3) drop_prob_aux : dropout rate of the dropout module used in the CNN
         4) drop_prob_comp : dropout rate on the  elements of the last layer of the FC layers 
+        5) fused : if true stack the two channels in a single 2N batch and run the shared CNN once -> default False
+        6) bn_split : in fused mode, normalize the two halves of the batch separately -> same batch norm statistics as running the 
+                      shared CNN twice -> default True
     
     """
-    def __init__(self,nbhidden_aux = 200,nbhidden_comp=60,drop_prob_aux = 0.2,drop_prob_comp = 0):
+    
+    # layers of the comparison head -> trained alone on the cached trunk features by utils/head_sweep.py
+    head_layers = ('fc3', 'fc4', 'fc5')
+    
+    def __init__(self,nbhidden_aux = 200,nbhidden_comp=60,drop_prob_aux = 0.2,drop_prob_comp = 0, fused = False, bn_split = True):
         super(LeNet_sharing_aux, self).__init__()
         
         # convolutional layers of the shared CNN with batch norm
         self.conv1 = nn.Conv2d(1, 32, kernel_size=3)
-        self.bn1 = nn.BatchNorm2d(32)
+        self.bn1 = Split_BatchNorm2d(32)
         self.conv2 = nn.Conv2d(32, 64, kernel_size=3)
-        self.bn2 = nn.BatchNorm2d(64)
+        self.bn2 = Split_BatchNorm2d(64)
         
         # FC layers of the shared CNN
         self.fc1 = nn.Linear(256, nbhidden_aux)
@@ -57,38 +65,54 @@ class LeNet_sharing_aux(nn.Module):
         self.fc4 = nn.Linear(nbhidden_comp, 100)
         self.fc5 = nn.Linear(100, 2)
         
-    def forward(self, input_):    
+        # fused siamese forward
+        self.fused = fused
+        if fused and bn_split :
+            set_batch_norm_groups(self, 2)
         
-        # split the 2-channel input into two 14*14 images
-        x = input_[:, 0, :, :].view(-1, 1, 14, 14)
-        y = input_[:, 1, :, :].view(-1, 1, 14, 14)
+    def trunk(self, x):
         
-        # forward pass for the first image 
+        # shared CNN : Nx1x14x14 -> Nx10
         x = F.relu(F.max_pool2d(self.bn1(self.conv1(x)), kernel_size=2, stride=2)) # Nx32x6x6
         x = F.relu(F.max_pool2d(self.bn2(self.conv2(x)), kernel_size=2, stride=2)) # Nx64x2x2
         x = self.dropout_aux(x) # Nx64x2x2 -> some element are put randomly to zero by dropout
-        x = F.relu(self.fc1(x.view(-1, 256))) # Nxnb_hidden_aux
+        x = F.relu(self.fc1(x.reshape(-1, 256))) # Nxnb_hidden_aux
         x = self.dropout_aux(x) # Nxnb_hidden_aux -> some element are put randomly to zero by dropout
         x = self.fc2(x) # Nx10
         
-        # forward pass for the second image 
-        y = F.relu(F.max_pool2d(self.bn1(self.conv1(y)), kernel_size=2, stride=2)) # Nx32x6x6
-        y = F.relu(F.max_pool2d(self.bn2(self.conv2(y)), kernel_size=2, stride=2)) # Nx64x2x2
-        y = self.dropout_aux(y) # Nx64x2x2 -> some element are put randomly to zero by dropout
-        y = F.relu(self.fc1(y.view(-1, 256))) # Nxnb_hidden_aux
-        y = self.dropout_aux(y) # Nxnb_hidden_aux -> some element are put randomly to zero by dropout
-        y = self.fc2(y) # Nx10
-        
-        # concatenate layers  
-        z = torch.cat([x, y], 1) #Nx20
+        return x
+    
+    def head(self, z):
         
-        # FC layer for binary classification 
+        # FC layer for binary classification : Nx20 -> Nx2
         z = F.relu(self.fc3(z)) # Nx20
         z = self.dropout_comp(z)  # Nx20 -> some element are put randomly to zero by dropout
         z = F.relu(self.fc4(z))  # Nxnbhidden_comp
         z = self.dropout_comp(z)  # Nxnbhidden_comp -> some element are put randomly to zero by dropout
         z = self.fc5(z) #Nx2
         
+        return z
+        
+    def forward(self, input_):    
+        
+        if self.fused :
+            # forward pass for the two images stacked in a 2Nx1x14x14 batch
+            x, y = self.trunk(stack_channels(input_)).chunk(2, 0) # Nx10, Nx10
+        else :
+            # split the 2-channel input into two 14*14 images
+            x = input_[:, 0, :, :].view(-1, 1, 14, 14)
+            y = input_[:, 1, :, :].view(-1, 1, 14, 14)
+            
+            # forward pass for the first and the second image 
+            x = self.trunk(x) # Nx10
+            y = self.trunk(y) # Nx10
+        
+        # concatenate layers  
+        z = torch.cat([x, y], 1) #Nx20
+        
+        # FC layer for binary classification 
+        z = self.head(z) #Nx2
+        
         return x, y, z
     
 ###################################################################
@@ -117,16 +141,23 @@ class LeNet_sharing(nn.Module):
         1) nb_hidden : number of nodes of the last layer of the CNN's FC layers
         2) dropout_ws : dropout rate of the dropout module used in the CNN
         3) dropout_comp : dropout rate on the  elements of the last layer of the FC layers
+        4) fused : if true stack the two channels in a single 2N batch and run the shared CNN once -> default False
+        5) bn_split : in fused mode, normalize the two halves of the batch separately -> same batch norm statistics as running the 
+                      shared CNN twice -> default True
     
     """
-    def __init__(self, nb_hidden = 100, dropout_ws = 0,dropout_comp = 0):
+    
+    # layers of the comparison head -> trained alone on the cached trunk features by utils/head_sweep.py
+    head_layers = ('fc3', 'fc4')
+    
+    def __init__(self, nb_hidden = 100, dropout_ws = 0,dropout_comp = 0, fused = False, bn_split = True):
         super(LeNet_sharing, self).__init__()
         
         # convolutional layers of the shared CNN with batch norm
         self.conv1 = nn.Conv2d(1, 32, kernel_size=3)
-        self.bn1 = nn.BatchNorm2d(32)
+        self.bn1 = Split_BatchNorm2d(32)
         self.conv2 = nn.Conv2d(32, 64, kernel_size=3)
-        self.bn2 = nn.BatchNorm2d(64)
+        self.bn2 = Split_BatchNorm2d(64)
         # FC layers of the shared CNN
         self.fc1 = nn.Linear(256, nb_hidden)
         self.fc2 = nn.Linear(nb_hidden, 10)
@@ -139,34 +170,50 @@ class LeNet_sharing(nn.Module):
         self.dropout_ws = nn.Dropout(dropout_ws)
         self.dropout_comp = nn.Dropout(dropout_comp)
         
-    def forward(self, input_):        
+        # fused siamese forward
+        self.fused = fused
+        if fused and bn_split :
+            set_batch_norm_groups(self, 2)
         
-        # split the 2-channel input into two 14*14 images
-        x = input_[:, 0, :, :].view(-1, 1, 14, 14)
-        y = input_[:, 1, :, :].view(-1, 1, 14, 14)
+    def trunk(self, x):
         
-        # forward pass for the first image 
+        # shared CNN : Nx1x14x14 -> Nx10
         x = F.relu(F.max_pool2d(self.bn1(self.conv1(x)), kernel_size=2, stride=2)) # Nx32x6x6
         x = F.relu(F.max_pool2d(self.bn2(self.conv2(x)), kernel_size=2, stride=2)) # Nx64x2x2
         x = self.dropout_ws(x) # Nx64x2x2 -> some element are put randomly to zero by dropout
-        x = F.relu(self.fc1(x.view(-1, 256))) # Nxnb_hidden
+        x = F.relu(self.fc1(x.reshape(-1, 256))) # Nxnb_hidden
         x = self.dropout_ws(x) # Nxnb_hidden -> some element are put randomly to zero by dropout
         x = self.fc2(x) # Nx10
         
-        # forward pass for the second image
-        y = F.relu(F.max_pool2d(self.bn1(self.conv1(y)), kernel_size=2, stride=2)) # Nx32x6x6
-        y = F.relu(F.max_pool2d(self.bn2(self.conv2(y)), kernel_size=2, stride=2)) # Nx64x2x2
-        y = self.dropout_ws(y) # Nx64x2x2 -> some element are put randomly to zero by dropout
-        y = F.relu(self.fc1(y.view(-1, 256))) # Nxnb_hidden
-        y = self.dropout_ws(y) # Nxnb_hidden -> some element are put randomly to zero by dropout
-        y = self.fc2(y) # Nx10
+        return x
+    
+    def head(self, z):
+        
+        # FC layer for binary classification : Nx20 -> Nx2
+        z = F.relu(self.fc3(z)) #Nx100
+        z = self.dropout_comp(z) # Nx100 -> some element are put randomly to zero by dropout
+        z = F.relu(self.fc4(z)) #Nx2
+        
+        return z
+        
+    def forward(self, input_):        
+        
+        if self.fused :
+            # forward pass for the two images stacked in a 2Nx1x14x14 batch
+            x, y = self.trunk(stack_channels(input_)).chunk(2, 0) # Nx10, Nx10
+        else :
+            # split the 2-channel input into two 14*14 images
+            x = input_[:, 0, :, :].view(-1, 1, 14, 14)
+            y = input_[:, 1, :, :].view(-1, 1, 14, 14)
+            
+            # forward pass for the first and the second image 
+            x = self.trunk(x) # Nx10
+            y = self.trunk(y) # Nx10
         
         # concatenate layers 
         z = torch.cat([x, y], 1) # Nx20
         
         # FC layer for binary classification 
-        z = F.relu(self.fc3(z)) #Nx100
-        z = self.dropout_comp(z) # Nx100 -> some element are put randomly to zero by dropout
-        z = F.relu(self.fc4(z)) #Nx2
+        z = self.head(z) #Nx2
         
         return  z
\ No newline at end of file
@@ -9,6 +9,8 @@ from models.Inception_Net import Google_Net
 from models.Basic import Net2C
 from models.Le_Net import LeNet_sharing_aux,LeNet_sharing
 from utils.grid_search import grid_search_basic,grid_search_ws,grid_search_aux
+from utils.successive_halving import tune, grid_configs
+from utils.head_sweep import sweep_head
 
 ###########################################################################################################################################
 
@@ -63,6 +65,29 @@ class Nets () :
           -> rest of parameters are default values used in the grid search
           -> differentiate if the model was tuned with data augmentation or not
           
+       => n_workers, threads_per_worker : run the trials of the grid search over a pool of processes (see run_trials in grid_search.py)
+       => cache_dir : directory of the on-disk cache of the trial results, the trials already run are skipped (see run_trials)
+       => patience, min_delta, monitor : early stopping of each trial with the weights of its best epoch restored (see training.py)
+       => telemetry : path of the JSON-lines log of the per-epoch time, throughput and memory of the trials, summarized at the end of the
+          search (see utils/telemetry.py)
+       => search : 'grid' (grid search, default), 'halving' (successive halving) or 'hyperband' on the same lists of parameters 
+          (see utils/successive_halving.py) -> the configurations start on min_epochs epochs and min_seeds seeds and only the top 
+          1/reduction_factor are promoted to larger budgets up to n_epochs and all the seeds, returns the rungs of the search
+          -> the first bracket of hyperband starts with the whole grid on min_epochs, the next ones with fewer configurations drawn 
+             from the grid on larger first budgets
+          
+      4) Tune_head_LeNet_sharing_aux : a function called to tune the parameters of the comparison head (fc3-fc5) of the LeNet_sharing_aux 
+         model in two stages (see utils/head_sweep.py) -> the whole model is trained once per seed with the current parameters of the 
+         dictionnary and every configuration of the head is trained on the cached digit logits of the frozen trunk
+          
+          - lrs : learning rate list of value of the head
+          - drop_prob_comp : dropout rate list of value of the FC layers of binary classification  to tune
+          - hidden_layers_comp : hidden layers list of value of the FC layers of binary classification to tune
+          - seeds : list of seed value, one trunk is trained per seed
+          - trunk_epochs : number of epochs of the training of the whole model -> n_epochs is the one of the heads
+          -> only drop_prob_comp (drop_prob_comp_augm with data augmentation) and hidden_layers_comp are saved, the learning rate of 
+             the head alone is not the one of the whole model
+          
        => In each case change the value in the dictionnary of the model that has been tuned by the optimals for the current instance
        => To save them -> change thevalue in the constructor by the optimal value which has been printed at the end of the grid search
        
@@ -81,41 +106,77 @@ class Nets () :
                                   'drop_prob_comp': 0.1,'drop_prob_aux_augm':0.3,'drop_prob_comp_augm': 0.1}
         self.Google_Net = {'net_type' : 'Google_Net', 'net' : Google_Net, 'learning rate' : 0.001,'channels_1x1' : 64,
                            'channels_3x3' : 64,'channels_5x5' : 64,'pool_channels' : 64,'hidden_layers':200,
-                           'drop_prob_comp':0,'drop_prob_aux': 0.7}
+                           'drop_prob_comp':0,'drop_prob_aux': 0.7,'reduction': None,'reduction_size': 7}
     # tuning function
     def Tune_Net2c(self,lrs,drop_prob, hidden_layers,seeds,mini_batch_size=100, optimizer = optim.Adam,criterion = nn.CrossEntropyLoss(),
-                   n_epochs=40, lambda_l2 = 0,alpha = 0.5, beta = 0.5, rotate =False,translate=False,swap_channel = False, GPU=False) :
+                   n_epochs=40, lambda_l2 = 0,alpha = 0.5, beta = 0.5, rotate =False,translate=False,swap_channel = False, GPU=False,
+                   n_workers=1, threads_per_worker=None, cache_dir=None, search='grid', min_epochs=5, min_seeds=2, 
+                   reduction_factor=3, patience=None, min_delta=0, monitor='loss', telemetry=None) :
         
-        # Call the grid search function
-        train_results, test_losses, test_accuracies,opt_lr, opt_prob, opt_hidden_layer = grid_search_basic(lrs,drop_prob, hidden_layers, seeds,mini_batch_size, optimizer ,criterion , n_epochs, lambda_l2 ,alpha,beta, rotate ,translate,swap_channel , GPU)
+        # Call the grid search function or the successive halving tuner
+        if search == 'grid' :
+            train_results, test_losses, test_accuracies,opt_lr, opt_prob, opt_hidden_layer = grid_search_basic(lrs,drop_prob, hidden_layers, seeds,mini_batch_size, optimizer ,criterion , n_epochs, lambda_l2 ,alpha,beta, rotate ,translate,swap_channel , GPU, n_workers, threads_per_worker, cache_dir, patience, min_delta, monitor, telemetry)
+        else :
+            # successive halving / hyperband on the same grid -> returns the rungs of the search instead of the grid tensors
+            configs = grid_configs(lrs, dropout_prob = drop_prob, nb_hidden = hidden_layers)
+            best, rungs = tune(Net2C, configs, seeds, search, mini_batch_size, optimizer, criterion, 
+                               n_epochs, min_epochs, min_seeds, reduction_factor, lambda_l2, alpha, beta, rotate, translate, swap_channel, 
+                               GPU, n_workers, threads_per_worker, cache_dir, patience, min_delta, monitor, telemetry)
+            opt_lr, opt_prob, opt_hidden_layer = best['lr'], best['dropout_prob'], best['nb_hidden']
         
         # save the optimal value in the dictionnary for the current instance
         self.Net2c['learning rate'] = opt_lr
         self.Net2c['drop_prob'] = opt_prob
         self.Net2c['hidden_layers'] = opt_hidden_layer
         
-        return train_results, test_losses, test_accuracies
+        if search == 'grid' :
+            return train_results, test_losses, test_accuracies
+        
+        return rungs
     
     def Tune_LeNet_sharing (self,lrs,drop_prob_ws, drop_prob_comp,seeds,mini_batch_size=100, optimizer = optim.Adam,
                             criterion = nn.CrossEntropyLoss(),n_epochs=40, lambda_l2 = 0,alpha = 0.5, beta = 0.5, 
-                            rotate =False,translate=False, swap_channel = False, GPU=False):
+                            rotate =False,translate=False, swap_channel = False, GPU=False, n_workers=1, threads_per_worker=None,
+                            cache_dir=None, search='grid', min_epochs=5, min_seeds=2, reduction_factor=3,
+                            patience=None, min_delta=0, monitor='loss', telemetry=None):
         
-        # Call the grid search function
-        train_results, test_losses, test_accuracies,opt_lr, opt_prob_ws, opt_prob_comp = grid_search_ws(lrs,drop_prob_ws, drop_prob_comp, seeds, mini_batch_size, optimizer ,criterion , n_epochs, lambda_l2 ,alpha, beta, rotate ,translate, swap_channel , GPU)
+        # Call the grid search function or the successive halving tuner
+        if search == 'grid' :
+            train_results, test_losses, test_accuracies,opt_lr, opt_prob_ws, opt_prob_comp = grid_search_ws(lrs,drop_prob_ws, drop_prob_comp, seeds, mini_batch_size, optimizer ,criterion , n_epochs, lambda_l2 ,alpha, beta, rotate ,translate, swap_channel , GPU, n_workers, threads_per_worker, cache_dir, patience, min_delta, monitor, telemetry)
+        else :
+            # successive halving / hyperband on the same grid -> returns the rungs of the search instead of the grid tensors
+            configs = grid_configs(lrs, dropout_ws = drop_prob_ws, dropout_comp = drop_prob_comp)
+            best, rungs = tune(LeNet_sharing, configs, seeds, search, mini_batch_size, optimizer, criterion, 
+                               n_epochs, min_epochs, min_seeds, reduction_factor, lambda_l2, alpha, beta, rotate, translate, swap_channel, 
+                               GPU, n_workers, threads_per_worker, cache_dir, patience, min_delta, monitor, telemetry)
+            opt_lr, opt_prob_ws, opt_prob_comp = best['lr'], best['dropout_ws'], best['dropout_comp']
         
         # save the optimal value in the dictionnary for the current instance
         self.LeNet_sharing['learning rate'] = opt_lr
-        self.LeNet_sharing['drop_prob_aux'] = opt_prob_ws
+        self.LeNet_sharing['drop_prob_ws'] = opt_prob_ws
         self.LeNet_sharing['drop_prob_comp'] = opt_prob_comp
         
-        return train_results, test_losses, test_accuracies
+        if search == 'grid' :
+            return train_results, test_losses, test_accuracies
+        
+        return rungs
     
     def Tune_LeNet_sharing_aux (self,lrs,drop_prob_aux, drop_prob_comp,seeds,mini_batch_size=100, optimizer = optim.Adam,
                                 criterion = nn.CrossEntropyLoss(),n_epochs=40, lambda_l2 = 0, alpha = 0.5, beta = 0.5,  
-                                rotate =False,translate=False, swap_channel = False, GPU=False):
+                                rotate =False,translate=False, swap_channel = False, GPU=False, n_workers=1, threads_per_worker=None,
+                                cache_dir=None, search='grid', min_epochs=5, min_seeds=2, reduction_factor=3,
+                                patience=None, min_delta=0, monitor='loss', telemetry=None):
         
-        # Call the grid search function
-        train_results, test_losses, test_accuracies,opt_lr, opt_prob_aux, opt_prob_comp = grid_search_aux(lrs,drop_prob_aux, drop_prob_comp, seeds, mini_batch_size, optimizer,criterion,n_epochs,lambda_l2 , alpha, beta,rotate,translate, swap_channel, GPU)
+        # Call the grid search function or the successive halving tuner
+        if search == 'grid' :
+            train_results, test_losses, test_accuracies,opt_lr, opt_prob_aux, opt_prob_comp = grid_search_aux(lrs,drop_prob_aux, drop_prob_comp, seeds, mini_batch_size, optimizer,criterion,n_epochs,lambda_l2 , alpha, beta,rotate,translate, swap_channel, GPU, n_workers, threads_per_worker, cache_dir, patience, min_delta, monitor, telemetry)
+        else :
+            # successive halving / hyperband on the same grid -> returns the rungs of the search instead of the grid tensors
+            configs = grid_configs(lrs, drop_prob_aux = drop_prob_aux, drop_prob_comp = drop_prob_comp)
+            best, rungs = tune(LeNet_sharing_aux, configs, seeds, search, mini_batch_size, optimizer, criterion, 
+                               n_epochs, min_epochs, min_seeds, reduction_factor, lambda_l2, alpha, beta, rotate, translate, swap_channel, 
+                               GPU, n_workers, threads_per_worker, cache_dir, patience, min_delta, monitor, telemetry)
+            opt_lr, opt_prob_aux, opt_prob_comp = best['lr'], best['drop_prob_aux'], best['drop_prob_comp']
         
         # save the optimal value in the dictionnary for the current instance
         if (rotate == True or translate == True or swap_channel == True) :
@@ -128,6 +189,28 @@ class Nets () :
             self.LeNet_sharing_aux['drop_prob_aux'] = opt_prob_aux
             self.LeNet_sharing_aux['drop_prob_comp'] = opt_prob_comp
         
-        return train_results, test_losses, test_accuracies
+        if search == 'grid' :
+            return train_results, test_losses, test_accuracies
+        
+        return rungs
+    
+    def Tune_head_LeNet_sharing_aux (self,lrs,drop_prob_comp, hidden_layers_comp,seeds,mini_batch_size=100, optimizer = optim.Adam,
+                                     criterion = nn.CrossEntropyLoss(),n_epochs=40, trunk_epochs=40, lambda_l2 = 0, alpha = 0.5, 
+                                     beta = 0.5, rotate =False,translate=False, swap_channel = False, GPU=False):
+        
+        # the dropout of the head is read from drop_prob_comp_augm by build_model when data augmentation is used
+        augmented = (rotate == True or translate == True or swap_channel == True)
+        drop_key = 'drop_prob_comp_augm' if augmented else 'drop_prob_comp'
+        
+        # sweep the head configurations on the cached features of the trunk
+        configs = grid_configs(lrs, **{drop_key : drop_prob_comp, 'hidden_layers_comp' : hidden_layers_comp})
+        best, results = sweep_head(self.LeNet_sharing_aux, configs, seeds, mini_batch_size, optimizer, criterion, n_epochs, 
+                                   trunk_epochs, lambda_l2, alpha, beta, rotate, translate, swap_channel, GPU)
+        
+        # save the optimal value in the dictionnary for the current instance
+        self.LeNet_sharing_aux[drop_key] = best[drop_key]
+        self.LeNet_sharing_aux['hidden_layers_comp'] = best['hidden_layers_comp']
+        
+        return results
 
 ###########################################################################################################################################
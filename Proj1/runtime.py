@@ -0,0 +1,70 @@
+import torch
+
+##########################################################################################################################################
+#                              Lightweight runtime for the frozen TorchScript models                                                   #
+#        Only depends on torch -> no import of models/, utils/, torchvision or matplotlib in the scoring processes                     #
+##########################################################################################################################################
+
+class Frozen_model :
+    
+    """
+    
+     General : Load and run a model exported with utils/export.py (export.py command)
+     
+     Input :
+     
+         - path : file of the TorchScript artifact
+         - n_threads : number of threads used by torch, None to keep the default -> default None
+         - optimize : if true optimize the frozen graph for inference on this machine (torch.jit.optimize_for_inference) -> default True
+         
+     Functions :
+     
+         1) __call__ : Nx2 binary output of the model for a Nx2x14x14 input
+         2) predict : N predicted targets (1 if the first digit is lesser or equal to the second)
+         3) predict_classes : Nx2 predicted classes of the two digits (auxiliary models only)
+     
+    """
+    
+    # constructor
+    def __init__(self, path, n_threads = None, optimize = True) :
+        
+        if n_threads is not None :
+            torch.set_num_threads(n_threads)
+        
+        extra_files = {'net_type' : '', 'outputs' : ''}
+        self.module = torch.jit.load(path, map_location = 'cpu', _extra_files = extra_files)
+        if optimize :
+            self.module = torch.jit.optimize_for_inference(self.module)
+        self.net_type = extra_files['net_type'].decode() if isinstance(extra_files['net_type'], bytes) else extra_files['net_type']
+        outputs = extra_files['outputs'].decode() if isinstance(extra_files['outputs'], bytes) else extra_files['outputs']
+        self.aux = (outputs == 'aux')
+    
+    def forward(self, input_) :
+        
+        with torch.no_grad() :
+            return self.module(input_)
+        
+    def __call__(self, input_) :
+        
+        output = self.forward(input_)
+        
+        return output[2] if self.aux else output
+    
+    def predict(self, input_) :
+        
+        return self(input_).argmax(1)
+    
+    def predict_classes(self, input_) :
+        
+        assert self.aux, "only the models with auxiliary loss predict the classes of the digits"
+        x, y, _ = self.forward(input_)
+        
+        return torch.stack([x.argmax(1), y.argmax(1)], 1)
+
+##########################################################################################################################################
+
+def load(path, n_threads = None, optimize = True) :
+    
+    """ Load a frozen TorchScript model exported by export.py """
+    
+    return Frozen_model(path, n_threads, optimize)
@@ -2,6 +2,7 @@ import torch
 import matplotlib.pyplot as plt
 import sys
 import random
+import os
 import numpy as np
 sys.path.append('..')
 from torch import nn 
@@ -9,16 +10,21 @@ from torch.nn import functional as F
 from torch import optim
 import torch.utils.data as dt
 from torch.utils.data import Dataset, DataLoader
-from utils.loader import load,PairSetMNIST,Training_set,Test_set, Training_set_split,Validation_set
+from utils.loader import PairSetMNIST,Training_set,Test_set, Training_set_split,Validation_set, clear_dataset_cache
 from utils.plot import learning_curve, boxplot
 from utils.metrics import accuracy, compute_nb_errors, compute_metrics
-from utils.training import train_model
+from utils.training import train_model, pad_history
+from models.Factory import build_model
+from utils.cache import trial_key, load_result, save_result
+from utils.ensemble import train_ensemble
+from utils.telemetry import Telemetry_log, new_run_id, summarize, print_summary
 import torch.cuda as cuda
  
 
 def validate_model(Net,seed, mini_batch_size=100, optimizer = optim.Adam, criterion = nn.CrossEntropyLoss(), n_epochs=40, 
                    eta=1e-3, lambda_l2 = 0, alpha=0.5, beta=0.5, plot=True,rotate = False,translate=False,
-                   swap_channel = False,GPU=False): 
+                   swap_channel = False,GPU=False, eval_every=1, exact_train_metrics=False, cpu_perf=False, patience=None, 
+                   min_delta=0, monitor='loss'): 
 
     """ 
     
@@ -36,6 +42,7 @@ def validate_model(Net,seed, mini_batch_size=100, optimizer = optim.Adam, criter
          -> mini_batch_size,optimizer, criterion, n_epochs, eta, lambda_2, alpha, beta see training.py
          - plot : if true plot the learning curve evolution over the epochs -> default true
          -> rotate,translate and swap_channels -> data augmentation see loader.py 
+         -> eval_every, exact_train_metrics, cpu_perf, patience, min_delta, monitor see training.py
      
      Output : printed loss and accuracy of the network after training on the test set and learning curve if plot true
      
@@ -56,27 +63,11 @@ def validate_model(Net,seed, mini_batch_size=100, optimizer = optim.Adam, criter
     validation_data= Validation_set(train_data)
     
     
-    # construct the net type with default parameter 
-    if (Net['net_type'] == 'Net2c') :
-        model = Net['net'](nb_hidden = Net['hidden_layers'],dropout_prob = Net['drop_prob'])
-    if (Net['net_type'] == 'LeNet_sharing') :
-        model = Net['net'](nb_hidden = Net['hidden_layers'],dropout_ws = Net['drop_prob_ws'],dropout_comp = Net['drop_prob_comp'])
-    if (Net['net_type'] == 'LeNet_sharing_aux') :
-        # check if any data augmentation has been called
-        # if none construct with tuned parameters without data augmentation
-        # if yes construct with tuned parameters with data augmentation
-        if ( rotate == False and translate == False and swap_channel == False) :
-            model = Net['net'](nbhidden_aux = Net['hidden_layers_aux'],nbhidden_comp = Net['hidden_layers_comp'],
-                               drop_prob_aux =Net['drop_prob_aux'],drop_prob_comp = Net['drop_prob_comp'])
-        else :
-            Net['learning rate'] = Net['learning rate augm']
-            model = Net['net'](nbhidden_aux = Net['hidden_layers_aux'],nbhidden_comp = Net['hidden_layers_comp'],
-                               drop_prob_aux =Net['drop_prob_aux_augm'],drop_prob_comp = Net['drop_prob_comp_augm'])       
-    if (Net['net_type'] == 'Google_Net') :
-        model = Net['net'](channels_1x1 = Net['channels_1x1'],
-                           channels_3x3 = Net['channels_3x3'],channels_5x5=Net['channels_5x5'],pool_channels = Net['pool_channels'],
-                           nhidden = Net['hidden_layers'], drop_prob_comp = Net['drop_prob_comp'],drop_prob_aux = Net['drop_prob_aux'])
-        
+    # construct the net type with default parameter -> parameters and learning rate tuned with data augmentation if any is used
+    augmented = (rotate == True or translate == True or swap_channel == True)
+    if (Net['net_type'] == 'LeNet_sharing_aux' and augmented) :
+        Net['learning rate'] = Net['learning rate augm']
+    model = build_model(Net, augmented)
 
     if GPU and cuda.is_available():
         device = torch.device('cuda')
@@ -89,14 +80,15 @@ def validate_model(Net,seed, mini_batch_size=100, optimizer = optim.Adam, criter
     # train the model on the train set and validate at each epoch    
     train_losses, train_acc, valid_losses, valid_acc = train_model(model, train_data_split, validation_data, device, mini_batch_size,
                                                                    optimizer,criterion,n_epochs, Net['learning rate'],lambda_l2,
-                                                                   alpha, beta)
+                                                                   alpha, beta, eval_every, exact_train_metrics, cpu_perf,
+                                                                   patience, min_delta, monitor)
     
     if plot:
         
         learning_curve(train_losses, train_acc, valid_losses, valid_acc)
     
     # loss and accuracy of the network on the test
-    test_loss, test_accuracy = compute_metrics(model, test_data, device)
+    test_loss, test_accuracy = compute_metrics(model, test_data, device, cpu_perf=cpu_perf)
     
     print('\nTest Set | Loss: {:.4f} | Accuracy: {:.2f}%\n'.format(test_loss, test_accuracy))
     
@@ -107,7 +99,9 @@ def validate_model(Net,seed, mini_batch_size=100, optimizer = optim.Adam, criter
 
 def evaluate_model(Net, seeds, mini_batch_size=100, optimizer = optim.Adam, criterion = nn.CrossEntropyLoss(), n_epochs=40, eta = 1e-3,
                    lambda_l2 = 0, alpha=0.5, beta=0.5, plot=True,statistics = True ,rotate = False,translate=False,swap_channel = False,
-                   GPU=False): 
+                   GPU=False, eval_every=1, exact_train_metrics=False, cpu_perf=False, cache_dir=None, ensemble=False, 
+                   patience=None, min_delta=0, monitor='loss', checkpoint_dir=None, checkpoint_every=1, 
+                   telemetry=None): 
     
     """ 
     General : 10 rounds of network training / validation with statistics
@@ -131,6 +125,24 @@ def evaluate_model(Net, seeds, mini_batch_size=100, optimizer = optim.Adam, crit
          - statistics : if true display the boxplot of the train accuracies, validations and test and print the mean and standard deviation 
                         statistics
          -> rotate,translate and swap_channels -> data augmentation see loader.py 
+         -> eval_every, exact_train_metrics, cpu_perf see training.py
+         - cache_dir : directory of the on-disk cache of the results of each seed (see utils/cache.py and run_trials in grid_search.py),
+                       the seeds already run with the same network dictionnary and parameters are not trained again, None to disable
+                       it -> default None
+         - ensemble : if true train the networks of all the seeds in lock-step as one vectorized model (see utils/ensemble.py), each 
+                      seed keeps its own data and initialization and draws its data order, augmentation and dropout masks from its
+                      own generators -> the results of a seed do not depend on the other seeds but differ from the sequential 
+                      training, the train metrics are the running ones -> default False
+         -> patience, min_delta, monitor -> early stopping see training.py, the results of a seed stopped early repeat the metrics of its
+            best epoch up to n_epochs (pad_history), not available in ensemble mode
+         - checkpoint_dir : directory of the checkpoints of the run, None to disable them -> default None
+                            -> the training of each seed is checkpointed every checkpoint_every epochs (see train_model) and the 
+                               result of each finished seed is stored as in the cache (utils/cache.py), a run restarted with the same 
+                               arguments skips the finished seeds and resumes the interrupted one from its last checkpoint
+                            -> not available in ensemble mode
+         - telemetry : path of the JSON-lines log of the per-epoch telemetry of the trainings (time of the phases, data loading versus 
+                       compute, samples per second, peak RSS, see utils/telemetry.py), summarized per seed at the end, not recorded 
+                       in ensemble mode, None to disable it -> default None
      
      Output : 
      
@@ -143,13 +155,57 @@ def evaluate_model(Net, seeds, mini_batch_size=100, optimizer = optim.Adam, crit
          
     """
     
+    assert not (ensemble and patience is not None), "early stopping is not available in ensemble mode"
+    assert not (ensemble and checkpoint_dir is not None), "checkpoints are not available in ensemble mode"
+    assert not (ensemble and exact_train_metrics), "exact train metrics are not available in ensemble mode"
+    assert not (ensemble and cpu_perf), "cpu_perf is not available in ensemble mode"
+    
     # tensor initialization to store the metrics
     train_results = torch.empty(len(seeds), 4, n_epochs)
-    test_losses = []
-    test_accuracies = []
+    test_losses = [None] * len(seeds)
+    test_accuracies = [None] * len(seeds)
+    
+    # seeds trained together in ensemble mode
+    pending = []
+    
+    # identifier of the records of this evaluation in the telemetry log
+    search = new_run_id()
+    
+    if GPU and cuda.is_available():
+        device = torch.device('cuda')
+    else:
+        device = torch.device('cpu')
+    
+    # construct the net type with default parameter -> parameters and learning rate tuned with data augmentation if any is used
+    augmented = (rotate == True or translate == True or swap_channel == True)
+    if (Net['net_type'] == 'LeNet_sharing_aux' and augmented) :
+        Net['learning rate'] = Net['learning rate augm']
     
     for n, seed in enumerate(seeds):
         
+        # result of the seed if it is in the cache or finished in the checkpoints of the run
+        stores = [directory for directory in [cache_dir, checkpoint_dir] if directory is not None]
+        if stores :
+            description = {'Net' : {name : value for name, value in Net.items() if name != 'net'}, 'seed' : seed, 
+                           'mini_batch_size' : mini_batch_size, 'optimizer' : optimizer, 'criterion' : criterion, 'n_epochs' : n_epochs,
+                           'lambda_l2' : lambda_l2, 'alpha' : alpha, 'beta' : beta, 'rotate' : rotate, 'translate' : translate, 
+                           'swap_channel' : swap_channel, 'GPU' : GPU, 'eval_every' : eval_every, 
+                           'exact_train_metrics' : exact_train_metrics, 'cpu_perf' : cpu_perf}
+            if patience is not None :
+                description['early_stopping'] = {'patience' : patience, 'min_delta' : min_delta, 'monitor' : monitor}
+            if ensemble :
+                description['ensemble'] = True
+            key = trial_key(description)
+        else :
+            description, key = None, None
+        cached = next((result for result in (load_result(directory, key) for directory in stores) if result is not None), None)
+        if cached is not None :
+            train_results[n,], test_losses[n], test_accuracies[n] = cached
+            if plot:
+                learning_curve(*train_results[n,].tolist())
+            print('Seed {:d} | Test Loss: {:.4f} | Test Accuracy: {:.2f}% (cached)\n'.format(n, test_losses[n], test_accuracies[n]))
+            continue
+        
         # set the pytorch seed
         torch.manual_seed(seed)
         torch.cuda.manual_seed(seed) 
@@ -164,47 +220,45 @@ def evaluate_model(Net, seeds, mini_batch_size=100, optimizer = optim.Adam, crit
         train_data_split =Training_set_split(train_data,rotate,translate,swap_channel)
         validation_data= Validation_set(train_data)
         
-        # construct the net type with default parameter 
-        if (Net['net_type'] == 'Net2c') :
-            model = Net['net'](nb_hidden = Net['hidden_layers'],dropout_prob = Net['drop_prob'])
-        if (Net['net_type'] == 'LeNet_sharing') :
-            model = Net['net'](nb_hidden = Net['hidden_layers'],dropout_ws = Net['drop_prob_ws'],dropout_comp = Net['drop_prob_comp'])
-        if (Net['net_type'] == 'LeNet_sharing_aux') :
-            # check if any data augmentation has been called
-            # if none construct with tuned parameters without data augmentation
-            # if yes construct with tuned parameters with data augmentation
-            if (  rotate == False and translate == False and swap_channel == False) :
-                model = Net['net'](nbhidden_aux = Net['hidden_layers_aux'],nbhidden_comp = Net['hidden_layers_comp'],
-                                   drop_prob_aux =Net['drop_prob_aux'],drop_prob_comp = Net['drop_prob_comp'])
-            else :
-                Net['learning rate'] = Net['learning rate augm']
-                model = Net['net'](nbhidden_aux = Net['hidden_layers_aux'],nbhidden_comp = Net['hidden_layers_comp'],
-                                   drop_prob_aux =Net['drop_prob_aux_augm'],drop_prob_comp = Net['drop_prob_comp_augm'])       
-        if (Net['net_type'] == 'Google_Net') :
-            model = Net['net'](channels_1x1 = Net['channels_1x1'],
-                               channels_3x3 = Net['channels_3x3'],channels_5x5=Net['channels_5x5'],pool_channels = Net['pool_channels'],
-                               nhidden = Net['hidden_layers'], drop_prob_comp = Net['drop_prob_comp'],drop_prob_aux = Net['drop_prob_aux'])
-         
-
-        if GPU and cuda.is_available():
-            device = torch.device('cuda')
-        else:
-            device = torch.device('cpu')
-
-
+        # construct the net type with the parameters of its dictionnary
+        model = build_model(Net, augmented)
         model = model.to(device)
         
+        if ensemble :
+            pending.append((n, key, description, model, train_data_split, validation_data, test_data))
+            continue
+        
+        # telemetry of the training of the seed
+        log = None
+        if telemetry is not None :
+            log = Telemetry_log(telemetry, search = search, net_type = Net['net_type'], seed = seed, eta = Net['learning rate'], 
+                                parameters = {name : value for name, value in Net.items() if name not in ['net', 'net_type']}, 
+                                n_epochs = n_epochs, mini_batch_size = mini_batch_size, rotate = rotate, translate = translate, 
+                                swap_channel = swap_channel)
+        
+        # checkpoint of the training of the seed -> resumed if the run was interrupted
+        checkpoint = os.path.join(checkpoint_dir, key + '.ckpt') if checkpoint_dir is not None else None
+        
         # train the model on the train set and validate at each epoch 
         train_losses, train_acc, valid_losses, valid_acc = train_model(model, train_data_split, validation_data, device, mini_batch_size,
                                                                        optimizer,criterion,n_epochs, Net['learning rate'],lambda_l2,
-                                                                       alpha, beta)
-        # store the training and validation accuracies and losses during the training 
-        train_results[n,] = torch.tensor([train_losses, train_acc, valid_losses, valid_acc])
+                                                                       alpha, beta, eval_every, exact_train_metrics, cpu_perf,
+                                                                       patience, min_delta, monitor, checkpoint, checkpoint_every, 
+                                                                       log)
+        # store the training and validation accuracies and losses during the training -> a training stopped early repeats the 
+        # metrics of its best epoch up to n_epochs
+        train_results[n,] = torch.tensor(pad_history([train_losses, train_acc, valid_losses, valid_acc], n_epochs, monitor, 
+                                                     min_delta, eval_every))
         # compute the loss and accuracy of the model on the test set
-        test_loss, test_acc = compute_metrics(model, test_data, device)
+        test_loss, test_acc = compute_metrics(model, test_data, device, cpu_perf=cpu_perf)
         # store the test metrics in the list
-        test_losses.append(test_loss)
-        test_accuracies.append(test_acc)
+        test_losses[n] = test_loss
+        test_accuracies[n] = test_acc
+        for directory in stores :
+            save_result(directory, key, (train_results[n,].clone(), test_loss, test_acc), description)
+        # the seed is finished -> its training checkpoint is not needed anymore
+        if checkpoint is not None :
+            os.remove(checkpoint)
         
         # learning curve
         if plot:
@@ -212,9 +266,30 @@ def evaluate_model(Net, seeds, mini_batch_size=100, optimizer = optim.Adam, crit
         
         print('Seed {:d} | Test Loss: {:.4f} | Test Accuracy: {:.2f}%\n'.format(n, test_loss, test_acc))
     
+    # ensemble mode -> train the networks of the seeds which are not in the cache together
+    if pending :
+        histories = train_ensemble([p[3] for p in pending], [p[4] for p in pending], [p[5] for p in pending], 
+                                   [seeds[p[0]] for p in pending], device, mini_batch_size,
+                                   optimizer, criterion, n_epochs, Net['learning rate'], lambda_l2, alpha, beta, eval_every)
+        for (n, key, description, model, _, _, test_data), history in zip(pending, histories) :
+            train_results[n,] = history
+            test_losses[n], test_accuracies[n] = compute_metrics(model, test_data, device)
+            if cache_dir is not None :
+                save_result(cache_dir, key, (history.clone(), test_losses[n], test_accuracies[n]), description)
+            if plot:
+                learning_curve(*history.tolist())
+            print('Seed {:d} | Test Loss: {:.4f} | Test Accuracy: {:.2f}%\n'.format(n, test_losses[n], test_accuracies[n]))
+    
+    # time spent per seed
+    if telemetry is not None :
+        print_summary(summarize(telemetry, search, by = ('net_type', 'seed')))
+    
+    # the datasets cached by the searches run before in this process are not needed anymore
+    clear_dataset_cache()
+    
     # store the train, validation and test accuracies in a tensor for the boxplot
     data = torch.stack([train_results[:,1,(n_epochs-1)], train_results[:,3,(n_epochs-1)] , torch.tensor(test_accuracies)])
-    data = data.view(1,3,10)
+    data = data.view(1,3,len(seeds))
     # boxplot
     if statistics :
         Title = " Models accuracies"
@@ -0,0 +1,134 @@
+import torch 
+import time
+import copy
+from torch import nn 
+from utils.performance import setup_cpu_perf, to_cpu_perf, autocast
+
+##############################################################################################################
+
+def time_forward(model, input_, n_iter = 20, n_warmup = 3, backward = False):
+    
+    """
+    Return the mean time in seconds of a forward pass (and backward pass if backward is true) of a model on an input
+    
+    Input :
+        
+        - model : an instance of a neural network class
+        - input_ : input batch of the model
+        - n_iter : number of timed passes -> default 20
+        - n_warmup : number of passes before timing -> default 3
+        - backward : if true time forward + backward of the sum of the outputs -> default False
+        
+    Output : mean time per pass in seconds
+    """
+    
+    def step() :
+        if backward :
+            output = model(input_)
+            output = output if isinstance(output, tuple) else (output,)
+            sum(o.sum() for o in output).backward()
+        else :
+            with torch.no_grad() :
+                model(input_)
+    
+    for _ in range(n_warmup) :
+        step()
+    if input_.is_cuda :
+        torch.cuda.synchronize()
+        
+    start = time.perf_counter()
+    for _ in range(n_iter) :
+        step()
+    if input_.is_cuda :
+        torch.cuda.synchronize()
+        
+    return (time.perf_counter() - start) / n_iter
+
+##############################################################################################################
+
+def layer_flops(module, input_, output):
+    
+    """
+    Return the number of floating point operations (2 x multiply-accumulate) of a Conv2d or Linear layer, 0 for other modules
+    """
+    if isinstance(module, nn.Conv2d) :
+        kernel = module.kernel_size[0] * module.kernel_size[1] * module.in_channels // module.groups
+        return 2 * output.numel() * kernel
+    if isinstance(module, nn.Linear) :
+        return 2 * output.numel() * module.in_features
+    
+    return 0
+
+##############################################################################################################
+
+def count_flops_activations(model, input_, forward = None):
+    
+    """
+    Count the FLOPs of the convolutional and linear layers and the memory of the activations of a forward pass
+    
+    Input :
+        
+        - model : an instance of a neural network class
+        - input_ : input batch of the model
+        - forward : function of the model to call on the input (e.g. model.trunk) -> default the forward of the model
+        
+    Output :
+    
+        - number of floating point operations of the Conv2d and Linear layers
+        - bytes of the outputs of all the leaf modules (activations kept for the backward pass in training)
+    """
+    counts = {'flops' : 0, 'bytes' : 0}
+    
+    def hook(module, inputs, output) :
+        counts['flops'] += layer_flops(module, inputs[0], output)
+        if torch.is_tensor(output) :
+            counts['bytes'] += output.numel() * output.element_size()
+    
+    handles = [m.register_forward_hook(hook) for m in model.modules() if len(list(m.children())) == 0]
+    with torch.no_grad() :
+        (model if forward is None else forward)(input_)
+    for handle in handles :
+        handle.remove()
+    
+    return counts['flops'], counts['bytes']
+
+
+##############################################################################################################
+
+def compare_cpu_perf(model, input_, cpu_perf = True, n_iter = 20):
+    
+    """
+    Compare the forward and train step (forward + backward) times of a model on CPU in the default execution and in the cpu_perf 
+    execution mode of train_model (channels_last, bfloat16 autocast, threads)
+    
+        The default execution is timed first since the threads set by cpu_perf are global to the process
+    
+    Input :
+        
+        - model : an instance of a neural network class
+        - input_ : input batch of the model
+        - cpu_perf : True or a dictionnary of settings (see utils/performance.py) -> default True
+        - n_iter : number of timed passes -> default 20
+        
+    Output : dictionnary of the forward and train step times in seconds (default and cpu_perf) and of the speedups
+    """
+    times = {}
+    model = copy.deepcopy(model)
+    for mode, train in [('forward', False), ('train step', True)] :
+        model.train(train)
+        times[mode] = time_forward(model, input_, n_iter, backward = train)
+    
+    model_perf = copy.deepcopy(model)
+    perf = setup_cpu_perf(model_perf, cpu_perf)
+    input_perf = to_cpu_perf(input_, perf)
+    
+    def forward(x) :
+        with autocast(perf) :
+            return model_perf(x)
+    
+    for mode, train in [('forward', False), ('train step', True)] :
+        model_perf.train(train)
+        times[mode + ' cpu_perf'] = time_forward(forward, input_perf, n_iter, backward = train)
+        times[mode + ' speedup'] = times[mode] / times[mode + ' cpu_perf']
+    
+    return times
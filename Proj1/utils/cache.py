@@ -0,0 +1,101 @@
+import os
+import json
+import inspect
+import hashlib
+import torch
+
+##############################################################################################################
+#                 On-disk cache of the results of the trials of grid_search.py and Evaluate.py                #
+##############################################################################################################
+
+# version of the results stored in the cache -> increase it when a change of the code changes the results of the same trial, the
+# results stored with another version are not used anymore
+CACHE_VERSION = 1
+
+##############################################################################################################
+
+def describe(value):
+
+    """
+    JSON description of the values of a trial which are not JSON types
+
+        Classes and functions are described by their qualified name and tensors by their values. Instances (e.g. a criterion
+        CrossEntropyLoss(weight = w, label_smoothing = 0.1)) are described by their type, their repr if it is not the default one,
+        their public attributes and the state of a module (buffers and parameters) -> two configurations never share a key.
+        An instance without any of them cannot be told apart from another one -> TypeError, the trial is not cached
+    """
+    if isinstance(value, type) or inspect.isfunction(value) or inspect.isbuiltin(value) :
+        return '{}.{}'.format(value.__module__, value.__qualname__)
+    if torch.is_tensor(value) :
+        return value.tolist()
+
+    description = {'type' : '{}.{}'.format(type(value).__module__, type(value).__qualname__)}
+    if type(value).__repr__ is not object.__repr__ :
+        description['repr'] = repr(value)
+    if hasattr(value, '__dict__') :
+        description['attributes'] = {name : item for name, item in vars(value).items() if not name.startswith('_')}
+    if isinstance(value, torch.nn.Module) :
+        description['state'] = value.state_dict()
+    if len(description) == 1 :
+        raise TypeError('cannot describe the configuration of {} for the cache'.format(description['type']))
+
+    return description
+
+##############################################################################################################
+
+def trial_key(description):
+
+    """
+    Return the stable hash of a trial (model type, parameters, seed, augmentation flags, epochs, ...)
+
+    Input : description -> dictionnary of everything that determines the result of the trial
+
+    Output : sha256 hex digest of the JSON of the description with sorted keys and of CACHE_VERSION -> same key in every process
+             and run
+    """
+    text = json.dumps({'version' : CACHE_VERSION, 'trial' : description}, sort_keys = True, default = describe)
+
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+##############################################################################################################
+
+def result_path(cache_dir, key):
+
+    return os.path.join(cache_dir, key[:2], key + '.pt')
+
+##############################################################################################################
+
+def load_result(cache_dir, key):
+
+    """
+    Return the cached result of a trial or None if the trial has not been run
+
+    Output : (history, test_loss, test_acc) -> history is the (4,n_epochs) train loss, train accuracy, validation loss and
+             validation accuracy of the trial
+    """
+    path = result_path(cache_dir, key)
+    if not os.path.exists(path) :
+        return None
+
+    result = torch.load(path)
+
+    return result['history'], result['test_loss'], result['test_acc']
+
+##############################################################################################################
+
+def save_result(cache_dir, key, result, description = None):
+
+    """
+    Store the result (history, test_loss, test_acc) of a trial with its description
+
+        The file is written to a temporary file and renamed so that a run killed while writing never leaves a partial result,
+        concurrent searches writing the same trial store the same result
+    """
+    path = result_path(cache_dir, key)
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+
+    history, test_loss, test_acc = result
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    torch.save({'history' : history, 'test_loss' : test_loss, 'test_acc' : test_acc,
+                'description' : json.dumps(description, sort_keys = True, default = describe)}, tmp)
+    os.replace(tmp, path)
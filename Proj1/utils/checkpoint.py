@@ -0,0 +1,122 @@
+import os
+import queue
+import random
+import threading
+import numpy as np
+import torch
+
+##############################################################################################################
+#              Crash-safe checkpoints of train_model and of the seed loop of evaluate_model                 #
+##############################################################################################################
+
+def snapshot(value):
+
+    """ Copy of a (nested) state with every tensor cloned to the CPU -> training can go on while the copy is written """
+
+    if torch.is_tensor(value) :
+        return value.detach().to('cpu', copy = True)
+    if isinstance(value, dict) :
+        return {name : snapshot(item) for name, item in value.items()}
+    if isinstance(value, (list, tuple)) :
+        return type(value)(snapshot(item) for item in value)
+
+    return value
+
+##############################################################################################################
+
+def rng_state():
+
+    """ States of the random generators used by the training (torch, cuda, random, numpy) """
+
+    return {'torch' : torch.get_rng_state(), 'cuda' : torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+            'random' : random.getstate(), 'numpy' : np.random.get_state()}
+
+##############################################################################################################
+
+def set_rng_state(state):
+
+    """ Restore the states of the random generators saved by rng_state """
+
+    torch.set_rng_state(state['torch'])
+    if state['cuda'] is not None and torch.cuda.is_available() :
+        torch.cuda.set_rng_state_all(state['cuda'])
+    random.setstate(state['random'])
+    np.random.set_state(state['numpy'])
+
+##############################################################################################################
+
+def atomic_save(state, path):
+
+    """ Write a state to a temporary file and rename it -> a crash while writing never leaves a partial checkpoint """
+
+    directory = os.path.dirname(path)
+    if directory :
+        os.makedirs(directory, exist_ok = True)
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    torch.save(state, tmp)
+    os.replace(tmp, path)
+
+##############################################################################################################
+
+def load_checkpoint(path):
+
+    """ Return the checkpoint stored at path or None if there is none """
+
+    if path is None or not os.path.exists(path) :
+        return None
+
+    return torch.load(path, weights_only = False)
+
+##############################################################################################################
+
+class Checkpoint_writer :
+    """
+    Background thread writing checkpoints with atomic_save
+
+        save only takes a CPU snapshot of the state and returns, the file is written by the thread -> the training never waits
+        for the disk. If a new checkpoint of the same path is queued before the previous one is written, only the latest is kept.
+
+    Functions :
+
+        1) save : queue a snapshot of a state to write at path
+        2) close : wait until every queued checkpoint is written and stop the thread, re-raise an error of the thread
+    """
+
+    # constructor
+    def __init__(self) :
+
+        self.queue = queue.Queue()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.error = None
+        self.thread = threading.Thread(target = self._run, daemon = True)
+        self.thread.start()
+
+    def _run(self) :
+
+        while True :
+            path = self.queue.get()
+            if path is None :
+                return
+            with self.lock :
+                state = self.pending.pop(path, None)
+            if state is not None :
+                try :
+                    atomic_save(state, path)
+                except Exception as error :
+                    self.error = error
+
+    def save(self, state, path) :
+
+        with self.lock :
+            queued = path in self.pending
+            self.pending[path] = snapshot(state)
+        if not queued :
+            self.queue.put(path)
+
+    def close(self) :
+
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None :
+            raise self.error
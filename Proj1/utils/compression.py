@@ -0,0 +1,112 @@
+import torch
+import copy
+from torch import nn
+
+##############################################################################################################
+
+def select_rank(singular_values, rank = None, energy = None):
+
+    """
+    Return the rank of a truncated SVD
+
+    Input :
+
+        - singular_values : singular values of the weight matrix in decreasing order
+        - rank : rank to keep, has priority over energy -> default None
+        - energy : fraction (0-1) of the squared singular values (Frobenius norm of the weight) to keep -> default None
+
+    Output : the smallest rank keeping the energy or rank clipped to the number of singular values
+    """
+    assert rank is not None or energy is not None, "a rank or an energy threshold should be given"
+
+    if rank is not None :
+        return max(1, min(rank, singular_values.numel()))
+
+    cumulated = singular_values.pow(2).cumsum(0) / singular_values.pow(2).sum()
+
+    return int((cumulated < energy).sum().item()) + 1 if energy < 1 else singular_values.numel()
+
+##############################################################################################################
+
+def factorize_linear(linear, rank = None, energy = None):
+
+    """
+    Return the truncated SVD factorization of a linear layer as two consecutive linear layers
+
+        W (out x in) ~ U_r S_r V_r^T -> first layer : sqrt(S_r) V_r^T (rank x in, no bias)
+                                     -> second layer : U_r sqrt(S_r) (out x rank) with the bias of the layer
+
+        -> rank x (in + out) parameters instead of in x out
+
+    Input :
+
+        - linear : nn.Linear to factorize
+        - rank / energy : truncation of the SVD, see select_rank
+
+    Output : nn.Sequential of the two linear layers
+    """
+    weight = linear.weight.detach()
+    U, S, Vh = torch.linalg.svd(weight.double(), full_matrices = False)
+    r = select_rank(S, rank, energy)
+    root = S[:r].sqrt()
+
+    first = nn.Linear(linear.in_features, r, bias = False).to(weight.device)
+    second = nn.Linear(r, linear.out_features, bias = linear.bias is not None).to(weight.device)
+    with torch.no_grad() :
+        first.weight.copy_(root.unsqueeze(1) * Vh[:r])
+        second.weight.copy_(U[:, :r] * root.unsqueeze(0))
+        if linear.bias is not None :
+            second.bias.copy_(linear.bias.detach())
+
+    return nn.Sequential(first, second)
+
+##############################################################################################################
+
+def factorize_model(model, layers = None, rank = None, energy = None):
+
+    """
+     General : Return a copy of a model where nn.Linear layers are replaced by their truncated SVD factorization (factorize_linear)
+
+         Only the layers whose factorization has less parameters than the dense weight are replaced, e.g. auxiliary.fc1 of
+         Google_Net (2048x1024) which holds most of its parameters and runs twice per pair
+         -> the factorized model should be fine-tuned with train_model for a few epochs to recover the accuracy
+
+     Input :
+
+         - model : a trained model, it is not modified
+         - layers : names of the nn.Linear layers to factorize (e.g. ['auxiliary.fc1']), None for all of them -> default None
+         - rank / energy : truncation of the SVD, see select_rank
+
+     Output :
+
+         - the factorized copy of the model
+         - dictionnary {layer name : rank} of the replaced layers
+    """
+    factorized = copy.deepcopy(model)
+    linears = {name : module for name, module in factorized.named_modules() if isinstance(module, nn.Linear)}
+    if layers is None :
+        layers = list(linears)
+    else :
+        assert all(name in linears for name in layers), "layers should be names of nn.Linear of the model"
+
+    ranks = {}
+    for name in layers :
+        linear = linears[name]
+        low_rank = factorize_linear(linear, rank, energy)
+        r = low_rank[0].out_features
+        # keep the dense layer if the factorization does not reduce the number of parameters
+        if r * (linear.in_features + linear.out_features) >= linear.in_features * linear.out_features :
+            continue
+        parent_name, _, child_name = name.rpartition('.')
+        setattr(factorized.get_submodule(parent_name), child_name, low_rank)
+        ranks[name] = r
+
+    return factorized, ranks
+
+##############################################################################################################
+
+def count_parameters(model):
+
+    """ Return the number of parameters of a model """
+
+    return sum(p.numel() for p in model.parameters())
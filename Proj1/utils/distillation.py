@@ -0,0 +1,188 @@
+import copy
+import torch
+from torch import nn
+from torch.nn import functional as F
+from torch import optim
+from utils.metrics import compute_metrics
+from utils.loader import Batch_iterator, gather_pairs
+
+##############################################################################################################
+
+def cache_teacher_logits(teacher, train_data, device, mini_batch_size = 1000):
+
+    """
+    Compute once the outputs of a trained teacher on the pairs of a training set so that it does not run at every epoch
+
+    Input :
+
+        - teacher : a trained model, evaluated in evaluation mode
+        - train_data : Training_set_split -> the logits are computed on the pairs without augmentation
+        - mini_batch_size : batch size of the teacher passes -> default 1000
+
+    Output :
+
+        - Nx2 binary logits of the teacher on the nb_pairs pairs of train_data
+        - Nx2x10 digit logits of the two channels if the teacher has auxiliary outputs (LeNet_sharing_aux, Google_Net), None otherwise
+    """
+    teacher.eval()
+    binary, digits = [], []
+
+    with torch.no_grad() :
+        for b in range(0, train_data.nb_pairs, mini_batch_size) :
+            input_ = gather_pairs(train_data.train_images, train_data.train_pairs[b:b + mini_batch_size], train_data.train_mean,
+                                  train_data.train_std)
+            output = teacher(input_.to(device))
+            if isinstance(output, tuple) :
+                x, y, output = output
+                digits.append(torch.stack([x, y], 1).cpu())
+            binary.append(output.cpu())
+
+    return torch.cat(binary, 0), (torch.cat(digits, 0) if digits else None)
+
+##############################################################################################################
+
+def comparison_logits(x, y):
+
+    """
+    Binary logits (log probabilities) of the target (first digit lesser or equal to the second) given the digit logits of the two channels
+
+        P(d1 <= d2) = sum_i P(d1 = i) P(d2 >= i)
+    """
+    p1 = F.softmax(x, 1)
+    tail2 = F.softmax(y, 1).flip(1).cumsum(1).flip(1) # P(d2 >= i)
+    p_le = (p1 * tail2).sum(1).clamp(1e-6, 1 - 1e-6)
+
+    return torch.stack([torch.log1p(-p_le), torch.log(p_le)], 1)
+
+##############################################################################################################
+
+def distillation_loss(student_logits, teacher_logits, temperature):
+
+    """
+    KL divergence between the softened outputs of the teacher and of the student, scaled by temperature^2 so that its gradients keep
+    the same magnitude as the cross entropy when the temperature changes
+    """
+    return F.kl_div(F.log_softmax(student_logits / temperature, 1), F.softmax(teacher_logits / temperature, 1),
+                    reduction = 'batchmean') * temperature ** 2
+
+##############################################################################################################
+
+def teacher_targets(binary, digits, swapped):
+
+    """
+    Teacher logits of an augmented batch from the logits cached on the original pairs
+
+        Rotation and translation keep the digits, the teacher logits of the original pair are used. When the channels are swapped
+        (mask returned by the augmentation, see Training_set_split with_swap) the digit logits are exchanged and the binary logits
+        are recomputed from the exchanged digits (comparison_logits), or flipped if the teacher has no auxiliary outputs
+    """
+    if not swapped.any() :
+        return binary, digits
+
+    binary = binary.clone()
+    if digits is None :
+        binary[swapped] = binary[swapped].flip(1)
+    else :
+        digits = digits.clone()
+        digits[swapped] = digits[swapped].flip(1)
+        binary[swapped] = comparison_logits(digits[swapped, 0], digits[swapped, 1])
+
+    return binary, digits
+
+##############################################################################################################
+
+def train_distillation(student, teacher, train_data, validation_data, device, mini_batch_size=100, optimizer = optim.Adam,
+                       criterion = nn.CrossEntropyLoss(), n_epochs=40, eta=1e-3,lambda_l2=0, alpha=0.5, beta=0.5, temperature=4,
+                       kappa=0.9, eval_every=1):
+
+    """
+    Train a (small) student network on the softened outputs of a trained teacher and record train/validation history
+
+        The teacher logits are computed once on the training set (cache_teacher_logits). The loss of the student is
+            (1 - kappa) x the loss of train_model on the labels + kappa x the distillation loss on the teacher logits
+        where the distillation loss is alpha x KL of the binary outputs + beta x KL of the two digit outputs if both the teacher and
+        the student have auxiliary outputs. A student without auxiliary outputs (e.g. Net2C with a small nb_hidden) only learns the
+        binary output, which the teacher derives from its digit logits when the channels of a pair are swapped by the augmentation.
+
+    Input :
+
+        - student : Neural network class to train
+        - teacher : trained neural network class, not modified
+        - temperature : temperature of the softmax of the teacher and student outputs in the distillation loss -> default 4
+        - kappa : weight of the distillation loss in the overall loss -> default 0.9
+        -> train_data, validation_data, mini_batch_size, optimizer, criterion, n_epochs, eta, lambda_l2, alpha, beta, eval_every
+           see training.py
+
+    Output : same as train_model -> lists of the train losses, train accuracy, validation losses and validation accuracy
+    """
+    # Accuracy and loss history of the train and validation data
+    train_acc = []
+    train_losses = []
+    valid_acc = []
+    valid_losses = []
+
+    # teacher logits on the training pairs, computed once
+    binary_cache, digits_cache = cache_teacher_logits(teacher, train_data, device)
+    binary_cache, digits_cache = binary_cache.to(device), (digits_cache.to(device) if digits_cache is not None else None)
+
+    optimizer = optimizer(student.parameters(), lr = eta, weight_decay = lambda_l2)
+    # view of the training set which also returns the swap mask of the augmentation, the data itself is shared
+    swap_data = copy.copy(train_data)
+    swap_data.with_swap = True
+    train_loader = Batch_iterator(swap_data, mini_batch_size, shuffle=True, pin_memory=(device.type == 'cuda'), with_indices=True)
+
+    for e in range(n_epochs):
+        epoch_loss = 0
+        epoch_errors = 0
+        student.train(True)
+        for i, data in enumerate(train_loader, 0):
+
+            input_, target_, classes_, swapped, index = data
+
+            input_ = input_.to(device, non_blocking=True)
+            target_ = target_.to(device, non_blocking=True)
+            classes_ = classes_.to(device, non_blocking=True)
+            swapped = swapped.to(device, non_blocking=True)
+            index = index.to(device) % train_data.nb_pairs
+
+            # teacher logits of the batch from the cache
+            binary, digits = teacher_targets(binary_cache[index], digits_cache[index] if digits_cache is not None else None,
+                                             swapped)
+
+            output = student(input_)
+            # auxiliary outputs of the student
+            if isinstance(output, tuple) :
+                class_1, class_2, out = output
+                hard_loss = alpha * criterion(out, target_) + beta * (criterion(class_1, classes_[:,0]) + criterion(class_2, classes_[:,1]))
+                soft_loss = alpha * distillation_loss(out, binary, temperature)
+                if digits is not None :
+                    soft_loss = soft_loss + beta * (distillation_loss(class_1, digits[:,0], temperature) +
+                                                    distillation_loss(class_2, digits[:,1], temperature))
+            else :
+                out = output
+                hard_loss = criterion(out, target_)
+                soft_loss = distillation_loss(out, binary, temperature)
+
+            net_loss = (1 - kappa) * hard_loss + kappa * soft_loss
+
+            # loss of the binary output and number of errors on the batch
+            epoch_loss += criterion(out, target_).detach()
+            epoch_errors += (out.detach().argmax(1) != target_).sum()
+
+            optimizer.zero_grad()
+            net_loss.backward()
+            optimizer.step()
+
+        # evaluate the validation set every eval_every epochs and at the last epoch
+        evaluate = ((e + 1) % eval_every == 0) or (e == n_epochs - 1)
+
+        train_losses.append(epoch_loss.item() / train_data.len)
+        train_acc.append(100 * (1 - epoch_errors.item() / train_data.len))
+        if evaluate :
+            val_loss, val_acc = compute_metrics(student, validation_data, device)
+        else :
+            val_loss, val_acc = float('nan'), float('nan')
+        valid_acc.append(val_acc)
+        valid_losses.append(val_loss)
+
+    return train_losses, train_acc, valid_losses, valid_acc
@@ -4,6 +4,8 @@ from torchvision import datasets
 
 import argparse
 import os
+import warnings
+import numpy as np
 
 ######################################################################
 
@@ -34,7 +36,8 @@ parser.add_argument('--data_dir',
 parser.add_argument('-f', '--file',
                     help='quick hack for jupyter')
 
-args = parser.parse_args()
+# ignore the arguments of the scripts importing this file
+args, _ = parser.parse_known_args()
 
 if args.seed >= 0:
     torch.manual_seed(args.seed)
@@ -115,24 +118,38 @@ def load_data(cifar = None, one_hot_labels = False, normalize = False, flatten =
 
 ######################################################################
 
-def mnist_to_pairs(nb, input_, target):
-    input_ = torch.functional.F.avg_pool2d(input_, kernel_size = 2)
-    a = torch.randperm(input_.size(0))
-    a = a[:2 * nb].view(nb, 2)
-    input_ = torch.cat((input_[a[:, 0]], input_[a[:, 1]]), 1)
+def pooled_to_pair_indices(nb, input_, target):
+    if 2 * nb <= input_.size(0):
+        a = torch.randperm(input_.size(0))
+        a = a[:2 * nb].view(nb, 2)
+    else:
+        # more pairs than disjoint images, sample among all the N^2 combinations
+        a = torch.randint(input_.size(0), (nb, 2))
     classes = target[a]
     target = (classes[:, 0] <= classes[:, 1]).long()
+    return a, target, classes
+
+def pooled_to_pairs(nb, input_, target):
+    a, target, classes = pooled_to_pair_indices(nb, input_, target)
+    input_ = torch.cat((input_[a[:, 0]], input_[a[:, 1]]), 1)
     return input_, target, classes
 
+def mnist_to_pairs(nb, input_, target):
+    input_ = torch.functional.F.avg_pool2d(input_, kernel_size = 2)
+    return pooled_to_pairs(nb, input_, target)
+
 ######################################################################
 
-def generate_pair_sets(nb):
+def get_data_dir():
     if args.data_dir is not None:
-        data_dir = args.data_dir
-    else:
-        data_dir = os.environ.get('PYTORCH_DATA_DIR')
-        if data_dir is None:
-            data_dir = './data'
+        return args.data_dir
+    data_dir = os.environ.get('PYTORCH_DATA_DIR')
+    if data_dir is None:
+        data_dir = './data'
+    return data_dir
+
+def generate_pair_sets(nb):
+    data_dir = get_data_dir()
 
     train_set = datasets.MNIST(data_dir + '/mnist/', train = True, download = True)
     train_input = train_set.data.view(-1, 1, 28, 28).float()
@@ -146,3 +163,77 @@ def generate_pair_sets(nb):
            mnist_to_pairs(nb, test_input, test_target)
 
 ######################################################################
+
+# One-time preprocessing of MNIST into memory-mapped 14x14 arrays, so
+# that generating pairs neither re-reads the raw files nor re-pools the
+# 60k + 10k images at every call.
+
+PAIR_CACHE_FILES = ('train_input', 'train_target', 'test_input', 'test_target')
+
+def pair_cache_dir(data_dir = None):
+    if data_dir is None:
+        data_dir = get_data_dir()
+    return os.path.join(data_dir, 'mnist', 'pairs_cache')
+
+def _save_array(path, array):
+    # write to a temporary file first so that an interrupted preparation
+    # never leaves a truncated array behind
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+def prepare_pair_cache(data_dir = None):
+    if data_dir is None:
+        data_dir = get_data_dir()
+    cache_dir = pair_cache_dir(data_dir)
+    os.makedirs(cache_dir, exist_ok = True)
+
+    train_set = datasets.MNIST(data_dir + '/mnist/', train = True, download = True)
+    train_input = train_set.data.view(-1, 1, 28, 28).float()
+    train_input = torch.functional.F.avg_pool2d(train_input, kernel_size = 2)
+
+    test_set = datasets.MNIST(data_dir + '/mnist/', train = False, download = True)
+    test_input = test_set.data.view(-1, 1, 28, 28).float()
+    test_input = torch.functional.F.avg_pool2d(test_input, kernel_size = 2)
+
+    # normalize both sets with the statistics of the full training set
+    mu, std = train_input.mean(), train_input.std()
+    train_input.sub_(mu).div_(std)
+    test_input.sub_(mu).div_(std)
+
+    arrays = (train_input, train_set.targets, test_input, test_set.targets)
+    for name, array in zip(PAIR_CACHE_FILES, arrays):
+        _save_array(os.path.join(cache_dir, name + '.npy'), array.numpy())
+
+    return cache_dir
+
+def load_pair_cache(data_dir = None):
+    cache_dir = pair_cache_dir(data_dir)
+    paths = [os.path.join(cache_dir, name + '.npy') for name in PAIR_CACHE_FILES]
+    if not all(os.path.exists(path) for path in paths):
+        print('* Preparing the MNIST pair cache in ' + cache_dir)
+        prepare_pair_cache(data_dir)
+
+    arrays = []
+    with warnings.catch_warnings():
+        # the arrays are mapped read-only, torch warns about non-writable memory
+        warnings.simplefilter('ignore', UserWarning)
+        for path in paths:
+            arrays.append(torch.from_numpy(np.load(path, mmap_mode = 'r')))
+
+    return tuple(arrays)
+
+def generate_cached_pair_sets(nb, data_dir = None):
+    train_input, train_target, test_input, test_target = load_pair_cache(data_dir)
+
+    return pooled_to_pairs(nb, train_input, train_target) + \
+           pooled_to_pairs(nb, test_input, test_target)
+
+def generate_cached_pair_indices(nb, data_dir = None):
+    train_input, train_target, test_input, test_target = load_pair_cache(data_dir)
+
+    return (train_input,) + pooled_to_pair_indices(nb, train_input, train_target) + \
+           (test_input,) + pooled_to_pair_indices(nb, test_input, test_target)
+
+######################################################################
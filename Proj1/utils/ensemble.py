@@ -0,0 +1,303 @@
+import torch
+import copy
+from torch import nn
+from torch import optim
+from torch.func import functional_call, stack_module_state, vmap
+from utils.loader import Batch_iterator
+
+##############################################################################################################
+
+def member_generators(seed, device):
+
+    """
+    Random generators of one copy of an Ensemble, seeded from its seed only
+
+    Output : generator of the data (order of the samples and augmentation, on the CPU) and generator of the dropout noise (on device)
+    """
+    data = torch.Generator().manual_seed(seed)
+    dropout = torch.Generator(device = device).manual_seed(int(torch.randint(2 ** 62, (1,), generator = data)))
+
+    return data, dropout
+
+##############################################################################################################
+
+class Noise_supply :
+    """
+    Uniform noise of the dropout layers of the vectorized forward of an Ensemble
+
+        Each copy draws one vector of uniform noise per forward from its own generator, the Member_dropout layers take their noise from
+        it in the order of their calls. A forward of the architecture on the meta device records the sizes of these calls.
+    """
+
+    # constructor
+    def __init__(self) :
+
+        self.noise = None
+        self.offset = 0
+        self.sizes = None
+
+    def start(self, noise) :
+
+        self.noise, self.offset = noise, 0
+
+    def record(self) :
+
+        self.noise, self.sizes = None, []
+
+    def take(self, x) :
+
+        if self.noise is None :
+            self.sizes.append(x.numel())
+            return torch.ones_like(x)
+        u = self.noise[self.offset:self.offset + x.numel()].view(x.shape)
+        self.offset += x.numel()
+
+        return u
+
+##############################################################################################################
+
+class Member_dropout(nn.Module) :
+    """
+    Dropout (as nn.Dropout) whose mask comes from the noise of the copy (Noise_supply) instead of the global generator
+    """
+
+    # constructor
+    def __init__(self, p, supply) :
+
+        super().__init__()
+        self.p = p
+        self.supply = supply
+
+    def forward(self, x) :
+
+        if not self.training :
+            return x
+        keep = self.supply.take(x) >= self.p
+
+        return x * keep / (1 - self.p) if self.p < 1 else x * 0
+
+##############################################################################################################
+
+class Ensemble :
+    """
+    K independently initialized copies of a network trained in lock-step as one batched model
+
+        The parameters and buffers of the copies are stacked along a new first dimension (torch.func.stack_module_state) and the
+        forward of the network is vectorized over the copies with torch.func.vmap -> one call runs the K copies on their own K
+        minibatches with their own batch norm statistics. The dropout layers are replaced by Member_dropout whose masks come from the
+        dropout generator of each copy (member_generators), the vectorized forward uses no global randomness (randomness = 'error')
+
+    Input :
+
+        - models : list of K models of the same architecture (e.g. built with build_model after torch.manual_seed(seed))
+        - generators : list of the K dropout generators of the copies
+
+    Functions :
+
+        1) __call__ : outputs of the K copies for a KxNx2x14x14 input -> KxNx2 (and the KxNx10 digit outputs for the auxiliary nets)
+        2) train / eval : training or evaluation mode of the copies
+        3) parameters : stacked parameters to optimize -> elementwise optimizers (Adam, SGD) update each copy as if alone
+        4) unstack : copy the trained parameters and buffers back into the K models
+    """
+
+    # constructor
+    def __init__(self, models, generators) :
+
+        self.models = models
+        self.generators = generators
+        self.params, self.buffers = stack_module_state(models)
+        # stateless copy of the architecture used by functional_call
+        self.base = copy.deepcopy(models[0]).to('meta')
+        self.supply = Noise_supply()
+        for module in list(self.base.modules()) :
+            for name, child in list(module.named_children()) :
+                if isinstance(child, nn.Dropout) :
+                    setattr(module, name, Member_dropout(child.p, self.supply))
+        # size of the noise of a copy per (input shape, training mode)
+        self.noise_sizes = {}
+        self.forward = vmap(self._forward, in_dims = (0, 0, 0, 0), randomness = 'error')
+
+    def _forward(self, params, buffers, noise, input_) :
+
+        self.supply.start(noise)
+
+        return functional_call(self.base, (params, buffers), (input_,))
+
+    def noise_size(self, input_) :
+
+        key = (tuple(input_.shape[1:]), self.base.training)
+        if key not in self.noise_sizes :
+            self.supply.record()
+            with torch.no_grad() :
+                self.base(torch.empty(input_.shape[1:], device = 'meta'))
+            self.noise_sizes[key] = sum(self.supply.sizes)
+
+        return self.noise_sizes[key]
+
+    def __call__(self, input_) :
+
+        size = self.noise_size(input_)
+        noise = torch.stack([torch.rand(size, generator = generator, device = input_.device) for generator in self.generators])
+
+        return self.forward(self.params, self.buffers, noise, input_)
+
+    def train(self, mode = True) :
+
+        self.base.train(mode)
+
+    def eval(self) :
+
+        self.base.train(False)
+
+    def parameters(self) :
+
+        return list(self.params.values())
+
+    def unstack(self) :
+
+        with torch.no_grad() :
+            for k, model in enumerate(self.models) :
+                for name, value in list(model.named_parameters()) + list(model.named_buffers()) :
+                    value.copy_((self.params if name in self.params else self.buffers)[name][k])
+
+        return self.models
+
+##############################################################################################################
+
+def stack_batches(loaders) :
+
+    """ Iterate in lock-step over the batch iterators of the copies and stack their batches -> KxN inputs, targets and classes """
+
+    for batches in zip(*loaders) :
+        yield tuple(torch.stack(tensors) for tensors in zip(*batches))
+
+##############################################################################################################
+
+def member_losses(criterion, output, target_) :
+
+    """
+    Loss of each copy in one call of the criterion on the flattened KxN outputs -> K losses (mean over the N samples of each copy)
+
+        The criterion is copied with reduction = 'none' and the per-sample losses are averaged per copy
+    """
+    K, N = target_.shape
+    per_sample = copy.copy(criterion)
+    per_sample.reduction = 'none'
+
+    return per_sample(output.reshape(K * N, -1), target_.reshape(K * N)).view(K, N).mean(1)
+
+##############################################################################################################
+
+def ensemble_losses(output, target_, classes_, criterion, alpha, beta) :
+
+    """
+    Loss of each copy as in train_model -> K overall losses and K losses of the binary output
+    """
+    if isinstance(output, tuple) :
+        class_1, class_2, out = output
+        out_losses = member_losses(criterion, out, target_)
+        losses = alpha * out_losses + beta * (member_losses(criterion, class_1, classes_[:,:,0]) +
+                                              member_losses(criterion, class_2, classes_[:,:,1]))
+    else :
+        out_losses = member_losses(criterion, output, target_)
+        losses = out_losses
+
+    return losses, out_losses
+
+##############################################################################################################
+
+def compute_ensemble_metrics(ensemble, datas, device, mini_batch_size=100, criterion = nn.CrossEntropyLoss()):
+
+    """
+    Loss and accuracy of each copy on its own data as in compute_metrics
+
+    Output : two tensors of size K -> loss and accuracy (%) of each copy
+    """
+    ensemble.eval()
+    K = len(datas)
+    test_loss = torch.zeros(K, device = device)
+    nb_errors = torch.zeros(K, device = device)
+
+    with torch.no_grad() :
+        loaders = [Batch_iterator(data, mini_batch_size, shuffle=False) for data in datas]
+        for input_, target_, classes_ in stack_batches(loaders) :
+            output = ensemble(input_.to(device))
+            output = output[2] if isinstance(output, tuple) else output
+            target_ = target_.to(device)
+            test_loss += member_losses(criterion, output, target_)
+            nb_errors += (output.argmax(2) != target_).sum(1)
+
+    lengths = torch.tensor([data.len for data in datas], dtype = torch.float, device = device)
+
+    return (test_loss / lengths).cpu(), (100 * (1 - nb_errors / lengths)).cpu()
+
+##############################################################################################################
+
+def train_ensemble(models, train_datas, validation_datas, seeds, device, mini_batch_size=100, optimizer = optim.Adam,
+                   criterion = nn.CrossEntropyLoss(), n_epochs=40, eta=1e-3, lambda_l2=0, alpha=0.5, beta=0.5, eval_every=1):
+
+    """
+    Train K copies of a network in lock-step as one vectorized model (Ensemble) and record their train/validation history
+
+        Copy k is trained on train_datas[k] and validated on validation_datas[k] -> same procedure as K calls of train_model (the
+        train metrics are the running ones of the optimization pass), the sum of the K losses is minimized and the gradient of each
+        copy only depends on its own loss. The order of the samples, the augmentation and the dropout masks of copy k are drawn from
+        generators seeded by seeds[k] only (member_generators) -> they do not depend on the seeds trained with it and the history of
+        a seed only changes by floating point rounding with the number of copies (batched kernels)
+
+    Input :
+
+        - models : list of K initialized models of the same architecture, updated with the trained weights at the end
+        - train_datas, validation_datas : lists of the K training and validation sets (same sizes)
+        - seeds : list of the K seeds of the random generators of the copies
+        -> device, mini_batch_size, optimizer, criterion, n_epochs, eta, lambda_l2, alpha, beta, eval_every see training.py
+
+    Output : A (Kx4xn_epochs) tensor -> train loss, train accuracy, validation loss, validation accuracy of each copy at each epoch,
+             nan for the validation at the epochs which are not evaluated
+    """
+    K = len(models)
+    assert len(set(data.len for data in train_datas)) == 1, "the training sets of the copies should have the same size"
+    assert getattr(criterion, 'weight', None) is None, "the losses of the copies are averaged per sample -> no class weights"
+    train_results = torch.full((K, 4, n_epochs), float('nan'))
+
+    generators = [member_generators(seed, device) for seed in seeds]
+    ensemble = Ensemble([model.to(device) for model in models], [dropout for _, dropout in generators])
+    optimizer = optimizer(ensemble.parameters(), lr = eta, weight_decay = lambda_l2)
+    loaders = []
+    for data, (generator, _) in zip(train_datas, generators) :
+        # view of the training set augmented with the generator of the copy, the data itself is shared
+        data = copy.copy(data)
+        data.generator = generator
+        loaders.append(Batch_iterator(data, mini_batch_size, shuffle=True, pin_memory=(device.type == 'cuda'), generator=generator))
+
+    for e in range(n_epochs):
+        epoch_loss = torch.zeros(K, device = device)
+        epoch_errors = torch.zeros(K, device = device)
+        ensemble.train()
+        for input_, target_, classes_ in stack_batches(loaders) :
+
+            input_ = input_.to(device, non_blocking=True)
+            target_ = target_.to(device, non_blocking=True)
+            classes_ = classes_.to(device, non_blocking=True)
+
+            output = ensemble(input_)
+            losses, out_losses = ensemble_losses(output, target_, classes_, criterion, alpha, beta)
+            out = output[2] if isinstance(output, tuple) else output
+
+            epoch_loss += out_losses.detach()
+            epoch_errors += (out.detach().argmax(2) != target_).sum(1)
+
+            optimizer.zero_grad()
+            losses.sum().backward()
+            optimizer.step()
+
+        train_results[:, 0, e] = (epoch_loss / train_datas[0].len).cpu()
+        train_results[:, 1, e] = (100 * (1 - epoch_errors / train_datas[0].len)).cpu()
+
+        # evaluate the validation sets every eval_every epochs and at the last epoch
+        if ((e + 1) % eval_every == 0) or (e == n_epochs - 1) :
+            train_results[:, 2, e], train_results[:, 3, e] = compute_ensemble_metrics(ensemble, validation_datas, device)
+
+    ensemble.unstack()
+
+    return train_results
@@ -0,0 +1,97 @@
+import torch 
+import copy
+from torch import nn 
+
+##############################################################################################################
+
+def fold_conv_bn(conv, bn):
+    """ 
+    Return a convolution equivalent to conv followed by bn in evaluation mode
+    
+    The batch norm running statistics are folded in the weights and bias of the convolution :
+        
+        w' = w * gamma / sqrt(var + eps)
+        b' = (b - mean) * gamma / sqrt(var + eps) + beta
+    """
+    scale = bn.weight.detach() / torch.sqrt(bn.running_var + bn.eps) # out_channels
+    bias = conv.bias.detach() if conv.bias is not None else torch.zeros_like(bn.running_mean)
+    
+    folded = nn.Conv2d(conv.in_channels, conv.out_channels, conv.kernel_size, conv.stride, conv.padding, conv.dilation, conv.groups,
+                       bias = True, padding_mode = conv.padding_mode).to(conv.weight.device)
+    with torch.no_grad() :
+        folded.weight.copy_(conv.weight * scale.view(-1, 1, 1, 1))
+        folded.bias.copy_((bias - bn.running_mean) * scale + bn.bias.detach())
+    
+    return folded
+
+##############################################################################################################
+
+def fold_batch_norm(model):
+    """
+     General : Export an inference-only copy of a model with the batch norm folded into the preceding convolutions
+     
+         The batch norm are applied right after the convolution with the same suffix in the models of this project :
+             - conv_block (Inception_Net.py) : conv -> bn
+             - LeNet_sharing, LeNet_sharing_aux : conv1 -> bn1, conv2 -> bn2
+         -> the convolution weights and bias are replaced by the folded ones and the batch norm by an identity, which removes a 
+            full memory pass per convolution
+            
+     Input : 
+     
+         - model : a trained model, it is not modified
+         
+     Output : a copy of the model in evaluation mode whose outputs match the evaluation mode of the model within floating point 
+              tolerance -> only valid for inference
+    """
+    folded = copy.deepcopy(model).eval()
+    
+    for module in folded.modules() :
+        for name, child in list(module.named_children()) :
+            if not (isinstance(child, nn.BatchNorm2d) and name.startswith('bn')) :
+                continue
+            conv = getattr(module, 'conv' + name[2:], None)
+            if isinstance(conv, nn.Conv2d) and child.track_running_stats :
+                setattr(module, 'conv' + name[2:], fold_conv_bn(conv, child))
+                setattr(module, name, nn.Identity())
+    
+    return folded
+
+##############################################################################################################
+
+def export_torchscript(model, path, net_type, fold = True, batch_size = 100):
+    """
+     General : Export a trained model as a frozen and optimized TorchScript artifact
+     
+         1) batch norm folded into the convolutions (fold_batch_norm) if fold is true
+         2) model traced in evaluation mode on a batch of Nx2x14x14 pairs
+         3) frozen (parameters inlined as constants) by torch.jit
+         4) saved with the net type and the kind of output as extra files
+         
+         -> the artifact is loaded by runtime.py with torch only, without the models/ and utils/ packages,
+            which optimizes it for inference on the local machine (the optimized graph is not serializable)
+            
+     Input : 
+     
+         - model : a trained model of the <Nets> registry (Net2c, LeNet_sharing, LeNet_sharing_aux, Google_Net)
+         - path : file where the artifact is saved
+         - net_type : name of the network in the <Nets> registry
+         - fold : if true fold the batch norm before tracing -> default True
+         - batch_size : batch size of the example input used for tracing, the artifact accepts any batch size -> default 100
+         
+     Output : the frozen TorchScript module
+    """
+    model = fold_batch_norm(model) if fold else copy.deepcopy(model).eval()
+    model = model.cpu()
+    
+    example = torch.randn(batch_size, 2, 14, 14)
+    with torch.no_grad() :
+        outputs = model(example)
+        traced = torch.jit.trace(model, example)
+    
+    frozen = torch.jit.freeze(traced)
+    
+    # auxiliary models output the two digit classes before the binary output
+    extra_files = {'net_type' : net_type, 'outputs' : 'aux' if isinstance(outputs, tuple) else 'binary'}
+    torch.jit.save(frozen, path, _extra_files = extra_files)
+    
+    return frozen
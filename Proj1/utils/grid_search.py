@@ -3,24 +3,243 @@ import matplotlib.pyplot as plt
 import sys
 import numpy as np
 import random
+import os
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
 sys.path.append('..')
 from torch import nn 
 from torch.nn import functional as F
 from torch import optim
 import torch.utils.data as dt
 from torch.utils.data import Dataset, DataLoader
-from utils.loader import load,PairSetMNIST,Training_set,Test_set, Training_set_split,Validation_set
+from utils.loader import PairSetMNIST,Training_set,Test_set, Training_set_split,Validation_set
+import utils.loader as loader
+from utils.loader import seeded_datasets, share_datasets, clear_dataset_cache
 from utils.plot import learning_curve, boxplot
 from utils.metrics import accuracy, compute_nb_errors, compute_metrics
-from utils.training import train_model
+from utils.training import train_model, pad_history
+from utils.cache import trial_key, load_result, save_result
+from utils.telemetry import Telemetry_log, new_run_id, summarize, print_summary
 import torch.cuda as cuda
 from models.Inception_Net import Google_Net
 from models.Basic import Net2C
 from models.Le_Net import LeNet_sharing_aux,LeNet_sharing
 
 
+def make_trial(net, parameters, seed, eta, label, mini_batch_size=100, optimizer = optim.Adam, criterion = nn.CrossEntropyLoss(),
+               n_epochs=40, lambda_l2 = 0, alpha=0.5, beta=0.5, rotate = False, translate=False, swap_channel = False, GPU=False,
+               patience=None, min_delta=0, monitor='loss', telemetry=None):
+    
+    """
+    
+     General : Dictionnary describing one trial of a grid search -> one training/validation/test run of a network for one parameter 
+               combination and one seed, run by run_trial
+               
+     Input : 
+         
+         - net : network class (Net2C, LeNet_sharing, LeNet_sharing_aux)
+         - parameters : dictionnary of the parameters of the constructor of net
+         - seed : seed of the data and of the initialization
+         - eta : learning rate
+         - label : description of the trial printed when it starts
+         -> mini_batch_size,optimizer, criterion, n_epochs, lambda_2, alpha, beta see training.py
+         -> rotate,translate and swap_channels -> data augmentation see loader.py 
+         -> patience, min_delta, monitor -> early stopping see training.py, only stored when patience is given so that the trials 
+            without early stopping keep their cache key
+         - telemetry : dictionnary {'path' : path of the JSON-lines log, 'search' : identifier of the search} of the per-epoch telemetry
+                       of the trial (see utils/telemetry.py), not part of the cache key -> default None
+         
+     Output : the trial dictionnary (picklable -> can be sent to a worker process)
+    """
+    trial = {'net' : net, 'parameters' : parameters, 'seed' : seed, 'eta' : eta, 'label' : label, 'mini_batch_size' : mini_batch_size,
+             'optimizer' : optimizer, 'criterion' : criterion, 'n_epochs' : n_epochs, 'lambda_l2' : lambda_l2, 'alpha' : alpha, 
+             'beta' : beta, 'rotate' : rotate, 'translate' : translate, 'swap_channel' : swap_channel, 'GPU' : GPU}
+    if patience is not None :
+        trial['early_stopping'] = {'patience' : patience, 'min_delta' : min_delta, 'monitor' : monitor}
+    if telemetry is not None :
+        trial['telemetry'] = telemetry
+    
+    return trial
+
+###########################################################################################################################################
+
+def run_trial(trial):
+    
+    """
+    
+     General : Run one trial of a grid search -> seed, create the data and the network, train it and compute the test metrics
+     
+               The seeds are set at the start of the trial so that its result does not depend on the trials run before it (in the same 
+               process or not)
+               
+     Input : trial -> dictionnary from make_trial
+     
+     Output :
+         
+         - history : A (4,n_epochs) tensor -> train loss ,train accuracy, validation loss, validation accuracy at each epoch
+         - test_loss : loss on the test set
+         - test_acc : accuracy on the test set
+    """
+    print(trial['label'])
+    
+    # set the pytorch seeds
+    torch.manual_seed(trial['seed'])
+    torch.cuda.manual_seed(trial['seed'])
+    
+    # datasets of the seed -> built at the first trial of the seed and shared with the next ones, the random states are restored as
+    # if they had been built again
+    train_data_split, validation_data, test_data = seeded_datasets(trial['seed'], trial['rotate'], trial['translate'], 
+                                                                   trial['swap_channel'])
+
+    # create the network
+    model = trial['net'](**trial['parameters'])
+
+    if trial['GPU'] and cuda.is_available():
+        device = torch.device('cuda')
+    else:
+        device = torch.device('cpu')
+
+    model =model.to(device)
+
+    # per-epoch telemetry of the trial identified by its search, network, seed and parameters
+    log = None
+    if 'telemetry' in trial :
+        log = Telemetry_log(trial['telemetry']['path'], search = trial['telemetry']['search'], net_type = trial['net'].__name__, 
+                            seed = trial['seed'], eta = trial['eta'], parameters = trial['parameters'], n_epochs = trial['n_epochs'],
+                            mini_batch_size = trial['mini_batch_size'], rotate = trial['rotate'], translate = trial['translate'], 
+                            swap_channel = trial['swap_channel'])
+
+    # train the network -> with early stopping the weights of the best epoch are restored
+    early_stopping = trial.get('early_stopping', {'patience' : None, 'min_delta' : 0, 'monitor' : 'loss'})
+    history = train_model(model, train_data_split, validation_data, device, trial['mini_batch_size'],trial['optimizer'],
+                          trial['criterion'], trial['n_epochs'], trial['eta'],trial['lambda_l2'],trial['alpha'], trial['beta'],
+                          patience = early_stopping['patience'], min_delta = early_stopping['min_delta'], 
+                          monitor = early_stopping['monitor'], telemetry = log)
+    
+    # train and test results 
+    test_loss, test_acc = compute_metrics(model, test_data, device)
+    
+    # a training stopped early repeats the metrics of its best epoch up to n_epochs
+    history = pad_history(history, trial['n_epochs'], early_stopping['monitor'], early_stopping['min_delta'])
+    
+    return torch.tensor(history), test_loss, test_acc
+
+###########################################################################################################################################
+
+def trial_description(trial):
+    
+    """ Description of a trial which determines its result -> key of the result cache (the label is only printed, the telemetry 
+    only logged) """
+    
+    return {name : value for name, value in trial.items() if name not in ['label', 'telemetry']}
+
+###########################################################################################################################################
+
+def init_worker(n_threads, cores, datasets):
+    
+    """
+    Initialize a worker process of run_trials : fixed number of intra-op threads and a single inter-op thread so that the workers do 
+    not oversubscribe the cores, and pin the process to its own set of cores if the platform allows it
+    
+    The datasets of the seeds built by the parent process (in shared memory) are used as the dataset cache of the worker
+    """
+    loader.dataset_cache.update(datasets)
+    torch.set_num_threads(n_threads)
+    torch.set_num_interop_threads(1)
+    
+    worker_cores = cores.get()
+    if worker_cores and hasattr(os, 'sched_setaffinity') :
+        os.sched_setaffinity(0, worker_cores)
+
+###########################################################################################################################################
+
+def run_trials(trials, n_workers=1, threads_per_worker=None, cache_dir=None):
+    
+    """
+    
+     General : Run a list of trials sequentially or fanned out over a pool of n_workers processes
+     
+               Each trial seeds itself (run_trial), the results are returned in the order of the trials whatever the order in which the 
+               workers complete them -> same results as the sequential run
+               
+               With a cache_dir each trial is keyed by the hash of its description (utils/cache.py) : the trials already in the cache 
+               are not run again and each result is stored as soon as its trial completes -> a search which died halfway or 
+               overlapping/neighbouring searches only run the new trials
+               
+     Input : 
+     
+         - trials : list of trial dictionnaries from make_trial
+         - n_workers : number of worker processes, 1 runs the trials in this process -> default 1, clamped to the number of cores 
+                       usable by the process since a worker without its own core only adds its start-up cost (1 core -> in process)
+         - threads_per_worker : number of intra-op threads of each worker -> default the number of cores divided by n_workers
+         - cache_dir : directory of the result cache, None to disable it -> default None
+         
+     Output : list of the results (history, test_loss, test_acc) of run_trial in the order of trials
+     
+     => the workers are spawned : the script calling the grid search must be protected by if __name__ == "__main__"
+     => the datasets of the seeds are dropped at the end (clear_dataset_cache)
+    """
+    results = [None] * len(trials)
+    keys = [trial_key(trial_description(trial)) for trial in trials] if cache_dir is not None else None
+    
+    # trials which are not in the cache
+    pending = []
+    for i in range(len(trials)) :
+        results[i] = load_result(cache_dir, keys[i]) if cache_dir is not None else None
+        if results[i] is None :
+            pending.append(i)
+    
+    def store(i, result) :
+        results[i] = result
+        if cache_dir is not None :
+            save_result(cache_dir, keys[i], result, trial_description(trials[i]))
+    
+    # no more workers than usable cores
+    available = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+    n_workers = min(n_workers, len(available))
+    
+    if n_workers <= 1 or len(pending) <= 1 :
+        for i in pending :
+            store(i, run_trial(trials[i]))
+        clear_dataset_cache()
+        return results
+    
+    # split the available cores between the workers
+    if threads_per_worker is None :
+        threads_per_worker = max(1, len(available) // n_workers)
+    
+    # build the datasets of every seed once in this process and share them with the workers
+    torch_state, random_state = torch.get_rng_state(), random.getstate()
+    for i in pending :
+        seeded_datasets(trials[i]['seed'], trials[i]['rotate'], trials[i]['translate'], trials[i]['swap_channel'])
+    torch.set_rng_state(torch_state)
+    random.setstate(random_state)
+    share_datasets()
+    
+    context = mp.get_context('spawn')
+    cores = context.Queue()
+    for w in range(n_workers) :
+        worker_cores = available[w * threads_per_worker:(w + 1) * threads_per_worker]
+        # no pinning if there are less cores than requested threads
+        cores.put(set(worker_cores) if len(worker_cores) == threads_per_worker else None)
+    
+    with ProcessPoolExecutor(n_workers, mp_context = context, initializer = init_worker, 
+                             initargs = (threads_per_worker, cores, loader.dataset_cache)) as pool :
+        futures = {pool.submit(run_trial, trials[i]) : i for i in pending}
+        # each result is stored at the position of its trial
+        for future in as_completed(futures) :
+            store(futures[future], future.result())
+    clear_dataset_cache()
+    
+    return results
+
+###########################################################################################################################################
+
+
 def grid_search_basic(lrs,drop_prob, hidden_layers, seeds,  mini_batch_size=100, optimizer = optim.Adam,criterion = nn.CrossEntropyLoss(),
-                      n_epochs=40, lambda_l2 = 0,alpha=0.5, beta=0.5, rotate = False,translate=False,swap_channel = False, GPU=False):
+                      n_epochs=40, lambda_l2 = 0,alpha=0.5, beta=0.5, rotate = False,translate=False,swap_channel = False, GPU=False,
+                      n_workers=1, threads_per_worker=None, cache_dir=None, patience=None, min_delta=0, monitor='loss',
+                      telemetry=None):
     
     """
     
@@ -37,6 +256,10 @@ def grid_search_basic(lrs,drop_prob, hidden_layers, seeds,  mini_batch_size=100,
          - seeds : list of seeds for statistics 
          -> mini_batch_size,optimizer, criterion, n_epochs, eta, lambda_2, alpha, beta see training.py
          -> rotate,translate and swap_channels -> data augmentation see loader.py 
+         -> n_workers, threads_per_worker, cache_dir -> parallel execution and result cache of the trials see run_trials
+         -> patience, min_delta, monitor -> early stopping of each trial see training.py
+         -> telemetry : path of the JSON-lines log of the per-epoch telemetry of the trials (see utils/telemetry.py), the time of
+            the trials run by the search is summarized per parameter combination at the end, None to disable it -> default None
         
      Ouput :
          
@@ -55,55 +278,40 @@ def grid_search_basic(lrs,drop_prob, hidden_layers, seeds,  mini_batch_size=100,
     test_losses = torch.empty(len(lrs),len(drop_prob), len(hidden_layers), len(seeds))
     test_accuracies = torch.empty(len(lrs),len (drop_prob), len(hidden_layers), len(seeds))
     
-    # iterate over the parameter combiantion for each seed in seeds
+    # telemetry of the trials of this search
+    search = {'path' : telemetry, 'search' : new_run_id()} if telemetry is not None else None
+    
+    # list the trials (parameter combination and seed) with their position in train_results
+    trials = []
+    indices = []
     for idz,eta in enumerate(lrs) :
         for idx,prob in enumerate(drop_prob):
             for idy,nb_hidden in enumerate(hidden_layers) :
                 for n, seed in enumerate(seeds):
-                    print('lr : {:.4f} , prob : {:.2f}, nb_hidden : {:d} (n= {:d})'.format(eta,prob, nb_hidden, n))
-
-                    # set the pytorch seeds
-                    torch.manual_seed(seed)
-                    torch.cuda.manual_seed(seed)
-                    
-                    #set the random seed 
-                    random.seed(0)
-
-                    # create the dataset 
-                    data = PairSetMNIST()
-                    train_data = Training_set(data)
-                    test_data = Test_set(data)
-                    train_data_split =Training_set_split(train_data,rotate,translate,swap_channel)
-                    validation_data= Validation_set(train_data)
-
-                    # create the network
-                    model = Net2C(nb_hidden, prob)
-
-                    if GPU and cuda.is_available():
-                        device = torch.device('cuda')
-                    else:
-                        device = torch.device('cpu')
-
-                    model =model.to(device)
-
-                    # train the network
-                    train_losses, train_acc, valid_losses, valid_acc = train_model(model, train_data_split, validation_data, device, 
-                                                                                   mini_batch_size,optimizer,criterion,n_epochs, 
-                                                                                   eta,lambda_l2,alpha, beta)
-
-                    # store train and test results 
-                    train_results[idz,idx,idy,n,] = torch.tensor([train_losses, train_acc, valid_losses, valid_acc])
-                    test_loss, test_acc = compute_metrics(model, test_data, device)
-                    test_losses[idz,idx,idy,n] = test_loss
-                    test_accuracies[idz,idx,idy,n] = test_acc
+                    label = 'lr : {:.4f} , prob : {:.2f}, nb_hidden : {:d} (n= {:d})'.format(eta,prob, nb_hidden, n)
+                    indices.append((idz,idx,idy,n))
+                    trials.append(make_trial(Net2C, {'nb_hidden' : nb_hidden, 'dropout_prob' : prob}, seed, eta, label, 
+                                             mini_batch_size, optimizer, criterion, n_epochs, lambda_l2, alpha, beta, 
+                                             rotate, translate, swap_channel, GPU, patience, min_delta, monitor, 
+                                             search))
+    
+    # run the trials (in parallel if n_workers > 1) and store the train and test results at the position of each trial
+    for index, (history, test_loss, test_acc) in zip(indices, run_trials(trials, n_workers, threads_per_worker, cache_dir)) :
+        train_results[index] = history
+        test_losses[index] = test_loss
+        test_accuracies[index] = test_acc
+    
+    # time spent per parameter combination
+    if telemetry is not None :
+        print_summary(summarize(telemetry, search['search'], by = ('net_type', 'eta', 'parameters')))
     
     # compute the validation mean accuracy and standard deviation of the accuracy
-    validation_grid_mean_acc = torch.mean(train_results[:,:,:,:,3,39], dim= 3)
-    validation_grid_std_acc = torch.std(train_results[:,:,:,:,3,39], dim= 3)
+    validation_grid_mean_acc = torch.mean(train_results[:,:,:,:,3,-1], dim= 3)
+    validation_grid_std_acc = torch.std(train_results[:,:,:,:,3,-1], dim= 3)
     
     # compute thetest mean accuracy and standard deviation of the accuracy
-    train_grid_mean_acc = torch.mean(train_results[:,:,:,:,1,39], dim= 3)
-    train_grid_std_acc = torch.std(train_results[:,:,:,:,1,39], dim= 3)
+    train_grid_mean_acc = torch.mean(train_results[:,:,:,:,1,-1], dim= 3)
+    train_grid_std_acc = torch.std(train_results[:,:,:,:,1,-1], dim= 3)
     
     # get the indices of the parameter with the highest mean validation accuracy
     idx = torch.where(validation_grid_mean_acc == validation_grid_mean_acc.max())
@@ -124,7 +332,9 @@ def grid_search_basic(lrs,drop_prob, hidden_layers, seeds,  mini_batch_size=100,
 ###########################################################################################################################################
 
 def grid_search_ws(lrs,drop_prob_ws, drop_prob_comp, seeds, mini_batch_size=100, optimizer = optim.Adam,criterion = nn.CrossEntropyLoss(), 
-                   n_epochs=40, lambda_l2 = 0,alpha=0.5, beta=0.5, rotate = False,translate=False, swap_channel = False, GPU=False) :
+                   n_epochs=40, lambda_l2 = 0,alpha=0.5, beta=0.5, rotate = False,translate=False, swap_channel = False, GPU=False,
+                   n_workers=1, threads_per_worker=None, cache_dir=None, patience=None, min_delta=0, monitor='loss',
+                   telemetry=None) :
     
     
     """
@@ -142,6 +352,10 @@ def grid_search_ws(lrs,drop_prob_ws, drop_prob_comp, seeds, mini_batch_size=100,
          - seeds : list of seeds for statistics 
          -> mini_batch_size,optimizer, criterion, n_epochs, eta, lambda_2, alpha, beta see training.py
          -> rotate,translate and swap_channels -> data augmentation see loader.py 
+         -> n_workers, threads_per_worker, cache_dir -> parallel execution and result cache of the trials see run_trials
+         -> patience, min_delta, monitor -> early stopping of each trial see training.py
+         -> telemetry : path of the JSON-lines log of the per-epoch telemetry of the trials (see utils/telemetry.py), the time of
+            the trials run by the search is summarized per parameter combination at the end, None to disable it -> default None
         
      Ouput :
          
@@ -160,55 +374,40 @@ def grid_search_ws(lrs,drop_prob_ws, drop_prob_comp, seeds, mini_batch_size=100,
     test_losses = torch.empty(len(lrs),len(drop_prob_ws), len(drop_prob_comp), len(seeds))
     test_accuracies = torch.empty(len(lrs),len (drop_prob_ws), len(drop_prob_comp), len(seeds))
     
-    # iterate over the parameter combiantion for each seed in seeds
+    # telemetry of the trials of this search
+    search = {'path' : telemetry, 'search' : new_run_id()} if telemetry is not None else None
+    
+    # list the trials (parameter combination and seed) with their position in train_results
+    trials = []
+    indices = []
     for idz, eta in enumerate(lrs) :
         for idx,prob_ws in enumerate(drop_prob_ws):
             for idy,prob_comp in enumerate(drop_prob_comp) :
                 for n, seed in enumerate(seeds):
-                    print('lr : {:.4f} , prob_ws : {:.2f}, prob_comp : {:.2f} (n= {:d})'.format(eta,prob_ws, prob_comp, n))
-
-                    # set seed
-                    torch.manual_seed(seed)
-                    torch.cuda.manual_seed(seed)
-                    
-                    #set the random seed 
-                    random.seed(0)
-
-                    # create the data
-                    data = PairSetMNIST()
-                    train_data = Training_set(data)
-                    test_data = Test_set(data)
-                    train_data_split =Training_set_split(train_data,rotate,translate,swap_channel)
-                    validation_data= Validation_set(train_data)
-
-                    # create the network
-                    model = LeNet_sharing(dropout_ws = prob_ws,dropout_comp = prob_comp)
-
-                    if GPU and cuda.is_available():
-                        device = torch.device('cuda')
-                    else:
-                        device = torch.device('cpu')
-
-                    model =model.to(device)
-
-                    # train the network
-                    train_losses, train_acc, valid_losses, valid_acc = train_model(model, train_data_split, validation_data, device, 
-                                                                                   mini_batch_size,optimizer,criterion,n_epochs, 
-                                                                                   eta,lambda_l2,alpha, beta)
-
-                    # store train and test results 
-                    train_results[idz,idx,idy,n,] = torch.tensor([train_losses, train_acc, valid_losses, valid_acc])
-                    test_loss, test_acc = compute_metrics(model, test_data, device)
-                    test_losses[idz,idx,idy,n] = test_loss
-                    test_accuracies[idz,idx,idy,n] = test_acc
+                    label = 'lr : {:.4f} , prob_ws : {:.2f}, prob_comp : {:.2f} (n= {:d})'.format(eta,prob_ws, prob_comp, n)
+                    indices.append((idz,idx,idy,n))
+                    trials.append(make_trial(LeNet_sharing, {'dropout_ws' : prob_ws, 'dropout_comp' : prob_comp}, seed, eta, label, 
+                                             mini_batch_size, optimizer, criterion, n_epochs, lambda_l2, alpha, beta, 
+                                             rotate, translate, swap_channel, GPU, patience, min_delta, monitor, 
+                                             search))
+    
+    # run the trials (in parallel if n_workers > 1) and store the train and test results at the position of each trial
+    for index, (history, test_loss, test_acc) in zip(indices, run_trials(trials, n_workers, threads_per_worker, cache_dir)) :
+        train_results[index] = history
+        test_losses[index] = test_loss
+        test_accuracies[index] = test_acc
+    
+    # time spent per parameter combination
+    if telemetry is not None :
+        print_summary(summarize(telemetry, search['search'], by = ('net_type', 'eta', 'parameters')))
     
     # compute the validation mean accuracy and standard deviation of the accuracy
-    validation_grid_mean_acc = torch.mean(train_results[:,:,:,:,3,39], dim= 3)
-    validation_grid_std_acc = torch.std(train_results[:,:,:,:,3,39], dim= 3)
+    validation_grid_mean_acc = torch.mean(train_results[:,:,:,:,3,-1], dim= 3)
+    validation_grid_std_acc = torch.std(train_results[:,:,:,:,3,-1], dim= 3)
     
     # compute thetest mean accuracy and standard deviation of the accuracy
-    train_grid_mean_acc = torch.mean(train_results[:,:,:,:,1,39], dim= 3)
-    train_grid_std_acc = torch.std(train_results[:,:,:,:,1,39], dim= 3)
+    train_grid_mean_acc = torch.mean(train_results[:,:,:,:,1,-1], dim= 3)
+    train_grid_std_acc = torch.std(train_results[:,:,:,:,1,-1], dim= 3)
     
     # get the indices of the parameter with the highest mean validation accuracy
     idx = torch.where(validation_grid_mean_acc == validation_grid_mean_acc.max())
@@ -229,7 +428,9 @@ def grid_search_ws(lrs,drop_prob_ws, drop_prob_comp, seeds, mini_batch_size=100,
 ###########################################################################################################################################
 
 def grid_search_aux(lrs,drop_prob_aux, drop_prob_comp, seeds, mini_batch_size=100, optimizer = optim.Adam,criterion= nn.CrossEntropyLoss(),
-                    n_epochs=40,lambda_l2 = 0, alpha=0.5, beta=0.5,rotate=False,translate=False, swap_channel = False, GPU=False):
+                    n_epochs=40,lambda_l2 = 0, alpha=0.5, beta=0.5,rotate=False,translate=False, swap_channel = False, GPU=False,
+                    n_workers=1, threads_per_worker=None, cache_dir=None, patience=None, min_delta=0, monitor='loss',
+                    telemetry=None):
     
     
     """
@@ -247,6 +448,10 @@ def grid_search_aux(lrs,drop_prob_aux, drop_prob_comp, seeds, mini_batch_size=10
          - seeds : list of seeds for statistics 
          -> mini_batch_size,optimizer, criterion, n_epochs, eta, lambda_2, alpha, beta see training.py
          -> rotate,translate and swap_channels -> data augmentation see loader.py 
+         -> n_workers, threads_per_worker, cache_dir -> parallel execution and result cache of the trials see run_trials
+         -> patience, min_delta, monitor -> early stopping of each trial see training.py
+         -> telemetry : path of the JSON-lines log of the per-epoch telemetry of the trials (see utils/telemetry.py), the time of
+            the trials run by the search is summarized per parameter combination at the end, None to disable it -> default None
         
      Ouput :
          
@@ -265,56 +470,40 @@ def grid_search_aux(lrs,drop_prob_aux, drop_prob_comp, seeds, mini_batch_size=10
     test_losses = torch.empty(len(lrs),len(drop_prob_aux),len(drop_prob_comp),len(seeds))
     test_accuracies = torch.empty(len(lrs),len(drop_prob_aux),len(drop_prob_comp),len(seeds))
     
-    # iterate over the parameter combiantion for each seed in seeds
+    # telemetry of the trials of this search
+    search = {'path' : telemetry, 'search' : new_run_id()} if telemetry is not None else None
+    
+    # list the trials (parameter combination and seed) with their position in train_results
+    trials = []
+    indices = []
     for idz,eta in enumerate(lrs) :
         for idx,prob_aux in enumerate(drop_prob_aux):
             for idy,prob_comp in enumerate(drop_prob_comp) :
                 for n, seed in enumerate(seeds) :
-                    print(' lr : {:.4f}, prob aux : {:.2f}, prob comp : {:.2f} (n= {:d})'.format(eta,prob_aux, prob_comp, n))
-
-
-                    # set seed
-                    torch.manual_seed(seed)
-                    torch.cuda.manual_seed(seed)
-                    
-                    #set the random seed 
-                    random.seed(0)
-
-                    # create the data
-                    data = PairSetMNIST()
-                    train_data = Training_set(data)
-                    test_data = Test_set(data)
-                    train_data_split =Training_set_split(train_data,rotate,translate,swap_channel)
-                    validation_data= Validation_set(train_data)
-
-                    # create the network
-                    model = LeNet_sharing_aux(drop_prob_aux = prob_aux,drop_prob_comp = prob_comp)
-
-                    if GPU and cuda.is_available():
-                        device = torch.device('cuda')
-                    else:
-                        device = torch.device('cpu')
-
-                    model =model.to(device)
-
-                    # train the network
-                    train_losses, train_acc, valid_losses, valid_acc = train_model(model, train_data_split, validation_data, device, 
-                                                                                   mini_batch_size,optimizer,criterion,n_epochs, 
-                                                                                   eta,lambda_l2,alpha, beta)
-                    
-                    # store train and test results 
-                    train_results[idz,idx,idy,n,] = torch.tensor([train_losses, train_acc, valid_losses, valid_acc])
-                    test_loss, test_acc = compute_metrics(model, test_data, device)
-                    test_losses[idz,idx,idy,n] = test_loss
-                    test_accuracies[idz,idx,idy,n] = test_acc
+                    label = ' lr : {:.4f}, prob aux : {:.2f}, prob comp : {:.2f} (n= {:d})'.format(eta,prob_aux, prob_comp, n)
+                    indices.append((idz,idx,idy,n))
+                    trials.append(make_trial(LeNet_sharing_aux, {'drop_prob_aux' : prob_aux, 'drop_prob_comp' : prob_comp}, seed, eta,
+                                             label, mini_batch_size, optimizer, criterion, n_epochs, lambda_l2, alpha, beta, 
+                                             rotate, translate, swap_channel, GPU, patience, min_delta, monitor, 
+                                             search))
+    
+    # run the trials (in parallel if n_workers > 1) and store the train and test results at the position of each trial
+    for index, (history, test_loss, test_acc) in zip(indices, run_trials(trials, n_workers, threads_per_worker, cache_dir)) :
+        train_results[index] = history
+        test_losses[index] = test_loss
+        test_accuracies[index] = test_acc
+    
+    # time spent per parameter combination
+    if telemetry is not None :
+        print_summary(summarize(telemetry, search['search'], by = ('net_type', 'eta', 'parameters')))
     
     # compute the validation mean accuracy and standard deviation of the accuracy
-    validation_grid_mean_acc = torch.mean(train_results[:,:,:,:,3,39], dim= 3)
-    validation_grid_std_acc = torch.std(train_results[:,:,:,:,3,39], dim= 3)
+    validation_grid_mean_acc = torch.mean(train_results[:,:,:,:,3,-1], dim= 3)
+    validation_grid_std_acc = torch.std(train_results[:,:,:,:,3,-1], dim= 3)
     
     # compute thetest mean accuracy and standard deviation of the accuracy
-    train_grid_mean_acc = torch.mean(train_results[:,:,:,:,1,39], dim= 3)
-    train_grid_std_acc = torch.std(train_results[:,:,:,:,1,39], dim= 3)
+    train_grid_mean_acc = torch.mean(train_results[:,:,:,:,1,-1], dim= 3)
+    train_grid_std_acc = torch.std(train_results[:,:,:,:,1,-1], dim= 3)
     
     # get the indices of the parameter with the highest mean validation accuracy
     idx = torch.where(validation_grid_mean_acc == validation_grid_mean_acc.max())
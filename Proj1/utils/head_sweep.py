@@ -0,0 +1,199 @@
+import torch
+from torch import nn
+from torch import optim
+from utils.loader import Batch_iterator, seeded_datasets, clear_dataset_cache
+from utils.training import train_model
+from models.Factory import build_model
+import torch.cuda as cuda
+
+##############################################################################################################
+#       Two-stage tuning of the comparison head (fc3-fc5) of LeNet_sharing_aux / LeNet_sharing (fc3-fc4)     #
+#   The trunk is trained once per seed, the head configurations are trained on its cached digit logits      #
+##############################################################################################################
+
+def extract_features(model, Data, device, mini_batch_size = 1000):
+
+    """
+    Concatenated outputs of the shared CNN (trunk) on the two channels of the pairs of a dataset, in evaluation mode
+
+    Input :
+
+        - model : a trained network with a trunk (LeNet_sharing_aux, LeNet_sharing)
+        - Data : Training_set_split, Validation_set or Test_set -> the augmentation of a Training_set_split is drawn once
+
+    Output : Nx20 features (digit logits of the first and of the second channel) and the N binary targets
+    """
+    model.eval()
+    features, targets = [], []
+
+    with torch.no_grad() :
+        for input_, target_, classes_ in Batch_iterator(Data, mini_batch_size, shuffle = False) :
+            input_ = input_.to(device)
+            x = model.trunk(input_[:, 0:1]) # Nx10
+            y = model.trunk(input_[:, 1:2]) # Nx10
+            features.append(torch.cat([x, y], 1))
+            targets.append(target_.to(device))
+
+    return torch.cat(features, 0), torch.cat(targets, 0)
+
+##############################################################################################################
+
+def trunk_features(Net, seed, mini_batch_size=100, optimizer = optim.Adam, criterion = nn.CrossEntropyLoss(), n_epochs=40,
+                   lambda_l2=0, alpha=0.5, beta=0.5, rotate=False, translate=False, swap_channel=False, GPU=False):
+
+    """
+    Train the whole network of a <Nets> dictionnary on one seed (same procedure as run_trial) and cache the features of its trunk
+
+    Output : dictionnary {'train', 'valid', 'test'} of the (features, targets) of each set
+    """
+    torch.manual_seed(seed)
+    torch.cuda.manual_seed(seed)
+    train_data_split, validation_data, test_data = seeded_datasets(seed, rotate, translate, swap_channel)
+
+    if GPU and cuda.is_available():
+        device = torch.device('cuda')
+    else:
+        device = torch.device('cpu')
+
+    augmented = (rotate == True or translate == True or swap_channel == True)
+    eta = Net['learning rate augm'] if (Net['net_type'] == 'LeNet_sharing_aux' and augmented) else Net['learning rate']
+    model = build_model(Net, augmented).to(device)
+    train_model(model, train_data_split, validation_data, device, mini_batch_size, optimizer, criterion, n_epochs, eta, lambda_l2,
+                alpha, beta)
+
+    return {'train' : extract_features(model, train_data_split, device), 'valid' : extract_features(model, validation_data, device),
+            'test' : extract_features(model, test_data, device)}
+
+##############################################################################################################
+
+def head_metrics(model, features, target, mini_batch_size=100, criterion = nn.CrossEntropyLoss()):
+
+    """ Loss and accuracy of the head of a model on cached features, accumulated per minibatch as in compute_metrics """
+
+    model.eval()
+    loss = 0
+    nb_errors = 0
+    with torch.no_grad() :
+        for b in range(0, features.size(0), mini_batch_size) :
+            output = model.head(features[b:b + mini_batch_size])
+            loss += criterion(output, target[b:b + mini_batch_size]).item()
+            nb_errors += (output.argmax(1) != target[b:b + mini_batch_size]).sum().item()
+
+    return loss / features.size(0), 100 * (1 - nb_errors / features.size(0))
+
+##############################################################################################################
+
+def train_head(model, features, mini_batch_size=100, optimizer = optim.Adam, criterion = nn.CrossEntropyLoss(), n_epochs=40,
+               eta=1e-3, lambda_l2=0):
+
+    """
+    Train only the comparison head of a model (model.head_layers) on the cached features of its trunk
+
+    Input :
+
+        - model : initialized network whose head is trained, its trunk is not used
+        - features : dictionnary of the cached (features, targets) of the sets -> see trunk_features
+        -> mini_batch_size, optimizer, criterion, n_epochs, eta, lambda_l2 see training.py
+
+    Output : same as train_model -> lists of the train losses, train accuracy, validation losses and validation accuracy
+    """
+    train_acc = []
+    train_losses = []
+    valid_acc = []
+    valid_losses = []
+
+    train_features, train_target = features['train']
+    device = train_features.device
+    model = model.to(device)
+    parameters = [p for name in model.head_layers for p in getattr(model, name).parameters()]
+    optimizer = optimizer(parameters, lr = eta, weight_decay = lambda_l2)
+
+    for e in range(n_epochs):
+        epoch_loss = 0
+        epoch_errors = 0
+        model.train(True)
+        order = torch.randperm(train_features.size(0), device = device)
+        for b in range(0, train_features.size(0), mini_batch_size) :
+            index = order[b:b + mini_batch_size]
+            target_ = train_target[index]
+            out = model.head(train_features[index])
+            loss = criterion(out, target_)
+
+            epoch_loss += loss.detach()
+            epoch_errors += (out.detach().argmax(1) != target_).sum()
+
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+
+        train_losses.append(epoch_loss.item() / train_features.size(0))
+        train_acc.append(100 * (1 - epoch_errors.item() / train_features.size(0)))
+        val_loss, val_acc = head_metrics(model, *features['valid'], mini_batch_size, criterion)
+        valid_losses.append(val_loss)
+        valid_acc.append(val_acc)
+
+    return train_losses, train_acc, valid_losses, valid_acc
+
+##############################################################################################################
+
+def sweep_head(Net, configs, seeds, mini_batch_size=100, optimizer = optim.Adam, criterion = nn.CrossEntropyLoss(), n_epochs=40,
+               trunk_epochs=40, lambda_l2=0, alpha=0.5, beta=0.5, rotate=False, translate=False, swap_channel=False, GPU=False):
+
+    """
+
+     General : Two-stage search on the parameters of the comparison head of a network
+
+               1) the whole network of the dictionnary Net is trained once per seed for trunk_epochs epochs and the 20 concatenated digit
+                  logits of its trunk are cached for the train, validation and test sets (trunk_features)
+               2) for each configuration and seed a new head is initialized (same seed) and trained on the cached features (train_head)
+                  -> the trunk is not trained again, a configuration only costs the training of the small FC layers
+
+               The score of a configuration is its mean validation accuracy at the last epoch over the seeds as in the grid searches.
+               The trunk is frozen with the parameters of Net -> the best head should be confirmed by a full training (evaluate_model)
+
+     Input :
+
+         - Net : network dictionnary of the <Nets> class with a trunk and a head (LeNet_sharing_aux, LeNet_sharing)
+         - configs : list of configurations -> dictionnaries with the learning rate 'lr' of the head and the keys of Net used by
+                     build_model for the head (e.g. 'drop_prob_comp', 'hidden_layers_comp'), see grid_configs
+         - seeds : list of seeds, each seed has its own data and trunk
+         - n_epochs : number of epochs of the training of each head -> default 40
+         - trunk_epochs : number of epochs of the training of the whole network -> default 40
+         -> mini_batch_size,optimizer, criterion, lambda_2, alpha, beta see training.py
+         -> rotate,translate and swap_channels -> data augmentation see loader.py
+
+     Output :
+
+         - best : the configuration with the highest mean validation accuracy
+         - results : dictionnary -> 'configs', 'scores' (mean validation accuracy of each configuration), 'train_results'
+                     (configs x seeds x 4 x n_epochs history), 'test_losses' and 'test_accuracies' (configs x seeds)
+    """
+    assert hasattr(Net['net'], 'head_layers'), "the network should have a trunk and a comparison head"
+    augmented = (rotate == True or translate == True or swap_channel == True)
+
+    train_results = torch.empty(len(configs), len(seeds), 4, n_epochs)
+    test_losses = torch.empty(len(configs), len(seeds))
+    test_accuracies = torch.empty(len(configs), len(seeds))
+
+    for n, seed in enumerate(seeds) :
+        print('Seed {:d} : training the trunk'.format(n))
+        features = trunk_features(Net, seed, mini_batch_size, optimizer, criterion, trunk_epochs, lambda_l2, alpha, beta, rotate,
+                                  translate, swap_channel, GPU)
+
+        for c, config in enumerate(configs) :
+            torch.manual_seed(seed)
+            model = build_model({**Net, **{name : value for name, value in config.items() if name != 'lr'}}, augmented)
+            train_results[c, n] = torch.tensor(train_head(model, features, mini_batch_size, optimizer, criterion, n_epochs,
+                                                          config['lr'], lambda_l2))
+            test_losses[c, n], test_accuracies[c, n] = head_metrics(model, *features['test'], mini_batch_size, criterion)
+    clear_dataset_cache()
+
+    scores = train_results[:, :, 3, -1].mean(1)
+    best = configs[scores.argmax().item()]
+    for config, score in zip(configs, scores) :
+        print('{} -> mean validation accuracy {:.2f}%'.format(', '.join('{} : {}'.format(name, value) for name, value in config.items()),
+                                                             score.item()))
+    print('Best head : {}'.format(best))
+
+    return best, {'configs' : configs, 'scores' : scores, 'train_results' : train_results, 'test_losses' : test_losses,
+                  'test_accuracies' : test_accuracies}
@@ -0,0 +1,126 @@
+import torch 
+from torch import nn 
+from collections import OrderedDict
+
+##############################################################################################################
+
+class Pair_inference :
+    """
+     General : Inference on pairs of digits with a cache of the output of the shared CNN for each digit image
+     
+         Many pairs share the same digit images but the forward of the model recomputes both passes of the shared CNN for every 
+         pair. Here the shared CNN (trunk) is computed once per unique image of a pool and cached, only the small FC layers of the 
+         binary classification (head) are run for each pair
+         
+         -> comparing all the pairs of n images costs n trunk passes instead of n^2
+         
+     Input : 
+     
+         - model : a trained model with a trunk and a head (LeNet_sharing_aux, Google_Net or LeNet_sharing)
+         - device : device on which the model runs -> default cpu
+         - cache_size : maximal number of cached digit outputs, the least recently used ones are evicted -> default 100000
+         - mini_batch_size : batch size of the trunk passes -> default 1000
+         
+     Functions :
+     
+         1) embed : the Px10 trunk outputs of images identified by keys, computed only for images which are not cached
+         2) predict : Mx10, Mx10, Mx2 outputs of the model for M pairs given as indices in a pool of images
+         3) predict_all_pairs : outputs for all the n^2 ordered pairs of n images
+         
+     => the cache is indexed by the keys of the images given by the caller (e.g. indices in MNIST) -> without keys each unique image 
+        of the pool is still computed once per call but nothing is cached, since an index in a pool does not identify an image
+        across pools
+     => the cache is cleared when the parameters or buffers of the model change (training, load_state_dict)
+    """
+    
+    # constructor
+    def __init__(self, model, device = torch.device('cpu'), cache_size = 100000, mini_batch_size = 1000) :
+        
+        assert hasattr(model, 'trunk') and hasattr(model, 'head'), "the model should have a shared trunk and a comparison head"
+        
+        self.model = model
+        self.device = device
+        self.cache_size = cache_size
+        self.mini_batch_size = mini_batch_size
+        self.cache = OrderedDict()
+        self.version = self.parameters_version()
+        
+    def clear(self) :
+        
+        self.cache.clear()
+        
+    def parameters_version(self) :
+        
+        # storage and in-place version counter of each parameter and buffer -> changed by an optimizer step or load_state_dict
+        return tuple((tensor.data_ptr(), tensor._version) for tensor in list(self.model.parameters()) + list(self.model.buffers()))
+        
+    def embed(self, images, keys = None) :
+        
+        # images : Px1x14x14 or Px14x14, keys : P hashable identifiers of the images, None to compute them without the cache
+        version = self.parameters_version()
+        if version != self.version :
+            # the cached outputs are the ones of other weights
+            self.clear()
+            self.version = version
+        
+        embeddings = [None] * images.size(0)
+        missing = []
+        for i in range(images.size(0)) :
+            if keys is not None and keys[i] in self.cache :
+                key = keys[i]
+                # most recently used at the end
+                self.cache.move_to_end(key)
+                embeddings[i] = self.cache[key]
+            else :
+                missing.append(i)
+        
+        if len(missing) > 0 :
+            training = self.model.training
+            self.model.eval()
+            with torch.no_grad() :
+                missing_images = images[torch.tensor(missing)].view(-1, 1, images.size(-2), images.size(-1))
+                for b in range(0, len(missing), self.mini_batch_size) :
+                    batch = missing_images[b:b + self.mini_batch_size].to(self.device)
+                    output = self.model.trunk(batch).cpu()
+                    for i, embedding in zip(missing[b:b + self.mini_batch_size], output) :
+                        embeddings[i] = embedding
+                        if keys is not None :
+                            self.cache[keys[i]] = embedding
+            self.model.train(training)
+            
+            # least recently used outputs are evicted
+            while len(self.cache) > self.cache_size :
+                self.cache.popitem(last = False)
+        
+        return torch.stack(embeddings)
+    
+    def predict(self, images, pairs, keys = None) :
+        
+        # images : pool of Px1x14x14 images, pairs : Mx2 indices in the pool, keys : P identifiers of the images -> default None, the 
+        # unique images of the pairs are computed once without the cache
+        unique, inverse = pairs.unique(return_inverse = True)
+        if keys is None :
+            unique_keys = None
+        else :
+            keys = keys.tolist() if torch.is_tensor(keys) else keys
+            unique_keys = [keys[i] for i in unique.tolist()]
+        
+        embeddings = self.embed(images[unique], unique_keys) # Ux10
+        x = embeddings[inverse[:, 0]] # Mx10
+        y = embeddings[inverse[:, 1]] # Mx10
+        
+        training = self.model.training
+        self.model.eval()
+        with torch.no_grad() :
+            z = self.model.head(torch.cat([x, y], 1).to(self.device)).cpu() # Mx2
+        self.model.train(training)
+        
+        return x, y, z
+    
+    def predict_all_pairs(self, images, keys = None) :
+        
+        # all the ordered pairs (i,j) of the n images -> n^2 outputs for n trunk passes
+        n = images.size(0)
+        pairs = torch.cartesian_prod(torch.arange(n), torch.arange(n))
+        
+        return pairs, self.predict(images, pairs, keys)
@@ -1,6 +1,7 @@
 import torch
 import numpy as np
 import random
+from torch.nn import functional as F
 import utils.dlc_practical_prologue as prologue
 from torch.utils.data import Dataset, DataLoader
 
@@ -9,13 +10,73 @@ from torch.utils.data import Dataset, DataLoader
 def load():
     '''Load the data in the format required by the project from the prologue file given
     
+        The 14x14 images are memory-mapped from the cache prepared once by the prologue (see prepare_pair_cache) -> no network 
+        access and no re-pooling of MNIST after the first call
+    
         Returns : tuple
         
         tuple[0]: train
         tuple[1]:target
         tuple[2]: classes
     '''
-    return prologue.generate_pair_sets(1000)
+    return prologue.generate_cached_pair_sets(1000)
+
+def load_indices(nb = 1000):
+    '''Load the pairs as indices into the shared base images instead of copying the images of each pair
+    
+        Returns : tuple
+        
+        tuple[0]: train_images -> Nx1x14x14 read-only base images (memory-mapped)
+        tuple[1]: train_pairs -> nbx2 indices of the two digits of each pair in train_images
+        tuple[2]: train_target
+        tuple[3]: train_classes
+        tuple[4:8]: same for the test set
+        
+        The base images are the same tensors at every call of a process -> the datasets of every seed reference a single copy
+    '''
+    (train_images, train_pairs, train_target, train_classes, 
+     test_images, test_pairs, test_target, test_classes) = prologue.generate_cached_pair_indices(nb)
+    
+    train_images = base_images.setdefault('train', train_images)
+    test_images = base_images.setdefault('test', test_images)
+    
+    return train_images, train_pairs, train_target, train_classes, test_images, test_pairs, test_target, test_classes
+
+# base images of the train and test sets shared by all the pairs of the process
+base_images = {}
+
+##########################################################################################################################################
+
+def pair_statistics(images, pairs):
+    """
+     Mean and standard deviation of the pixels of all the pairs, computed from the base images weighted by the number of times
+     each image appears in pairs -> identical to input.mean() and input.std() of the materialized pairs without creating them
+    """
+    flat = images.reshape(images.size(0), -1)
+    counts = torch.bincount(pairs.reshape(-1), minlength = images.size(0))
+    used = counts.nonzero().squeeze(1)
+    weights = counts[used].double()
+    used_images = flat[used].double()
+    
+    n = weights.sum() * flat.size(1)
+    mean = (weights * used_images.sum(1)).sum() / n
+    squares = (weights * used_images.pow(2).sum(1)).sum()
+    std = ((squares - n * mean * mean) / (n - 1)).sqrt()
+    
+    return mean.float(), std.float()
+
+def gather_pairs(images, pairs, mean, std):
+    """
+     Build the normalized two-channels images of the given pairs from the shared base images
+     
+     Input : 
+         - images : Nx1x14x14 base images
+         - pairs : (...x2) indices in images
+         - mean, std : statistics used to normalize the pairs
+         
+     Output : (...x2x14x14) normalized pairs
+    """
+    return images[pairs].squeeze(-3).sub(mean).div(std)
 
 ##########################################################################################################################################
 
@@ -24,43 +85,61 @@ class PairSetMNIST(Dataset):
     """
      A class that inherite from Dataset of pytorch to automatically handle batches and shuffling of the data when passed to a dataloader
      
-     Load the train and test data from load()
+     Load the train and test pairs from load_indices()
      
      Initialize the classes attribut with the train and test data :
       
-         - train_input : 1000x2x14x14 (two-channels images)
+         - train_images : Nx1x14x14 base images shared by all the pairs (read-only, never copied)
+         - train_pairs : 1000x2 indices in train_images of the digits of each pair
          - train_target : 1000x1 (target -> digit in the first channel lesser or equal to the one in the second channel)
          - train_classes :  1000x2 contain the label of each digit in the pair of digit
+         - train_mean, train_std : statistics of the pairs used to normalize them
+         -> train_input : 1000x2x14x14 (two-channels images) gathered on demand
          
-         - test_input : 1000x2x14x14 (two-channels images)
-         - test_target : 1000x1 (target -> digit in the first channel lesser or equal to the one in the second channel)
-         - test_classes :  1000x2 contain the label of each digit in the pair of digit
+         - same attributes for the test set
      
      => This class will be needed as an input of the other classes to separate this dataset in specific datasets : train,validation and 
         test on which we can call a data loader from pytorch
+     => The pairs are only indices -> memory is proportional to the number of pairs and the base images can be shared by the workers 
+        of a data loader without copy
     """
     
     # constructor
-    def __init__(self) :
+    def __init__(self, nb = 1000) :
             
-        train_input, train_target, train_classes, test_input, test_target,test_classes=load()
-        
-        train_input = train_input.sub(train_input.mean()).div(train_input.std())
+        (train_images, train_pairs, train_target, train_classes, 
+         test_images, test_pairs, test_target, test_classes) = load_indices(nb)
         
         # Training set
-        self.train_input  = train_input
+        self.train_images = train_images
+        self.train_pairs = train_pairs
         self.train_target  = train_target
         self.train_classes = train_classes
+        self.train_mean, self.train_std = pair_statistics(train_images, train_pairs)
         
         #Test set 
-        self.test_input  = test_input.sub(test_input.mean()).div(test_input.std())
+        self.test_images = test_images
+        self.test_pairs = test_pairs
         self.test_target = test_target
         self.test_classes = test_classes
+        self.test_mean, self.test_std = pair_statistics(test_images, test_pairs)
+    
+    @property
+    def train_input(self) :
+        
+        return gather_pairs(self.train_images, self.train_pairs, self.train_mean, self.train_std)
+    
+    @property
+    def test_input(self) :
+        
+        return gather_pairs(self.test_images, self.test_pairs, self.test_mean, self.test_std)
        
     # iterator             
     def __getitem__(self, index ):
         
-        return self.train_input[index], self.train_target[index], self.train_classes[index], self.test_input[index],                       self.test_target[index],self.test_classes[index]
+        return gather_pairs(self.train_images, self.train_pairs[index], self.train_mean, self.train_std), self.train_target[index], \
+               self.train_classes[index], gather_pairs(self.test_images, self.test_pairs[index], self.test_mean, self.test_std), \
+               self.test_target[index],self.test_classes[index]
 
 #################################################################################################################################
 
@@ -75,15 +154,23 @@ class Test_set(Dataset) :
     # constructor
     def __init__(self,PairSetMNIST) :
         
-        self.len = PairSetMNIST.test_input.shape[0]
-        self.test_input  = PairSetMNIST.test_input
+        self.len = PairSetMNIST.test_pairs.shape[0]
+        self.test_images = PairSetMNIST.test_images
+        self.test_pairs = PairSetMNIST.test_pairs
         self.test_target  = PairSetMNIST.test_target
         self.test_classes = PairSetMNIST.test_classes
+        self.test_mean, self.test_std = PairSetMNIST.test_mean, PairSetMNIST.test_std
+    
+    @property
+    def test_input(self) :
+        
+        return gather_pairs(self.test_images, self.test_pairs, self.test_mean, self.test_std)
        
     # iterator          
     def __getitem__(self, index):
         
-        return self.test_input[index], self.test_target[index], self.test_classes[index]
+        return gather_pairs(self.test_images, self.test_pairs[index], self.test_mean, self.test_std), self.test_target[index], \
+               self.test_classes[index]
     
     
     def __len__(self):
@@ -100,7 +187,7 @@ class Training_set (Dataset) :
      
     Only keep the train set in the attribut of the class defined as in PairSetMNIST
     
-    Randomly split the indices of the train_input tensor :
+    Randomly split the indices of the train pairs :
         
         - train_idx -> 0.8 of the training pair
         - valid_idx -> 0.2 of the training pair
@@ -110,23 +197,31 @@ class Training_set (Dataset) :
     
     def __init__(self,PairSetMNIST) : 
         
-        self.len = PairSetMNIST.train_input.shape[0]
-        self.train_input =  PairSetMNIST.train_input
+        self.len = PairSetMNIST.train_pairs.shape[0]
+        self.train_images = PairSetMNIST.train_images
+        self.train_pairs = PairSetMNIST.train_pairs
         self.train_target  = PairSetMNIST.train_target
         self.train_classes = PairSetMNIST.train_classes
+        self.train_mean, self.train_std = PairSetMNIST.train_mean, PairSetMNIST.train_std
             
-        idx = list(range(len(PairSetMNIST.train_input)))
+        idx = list(range(self.len))
         random.shuffle(idx)
-        split = int(np.floor(0.2 * len(PairSetMNIST.train_input)))
+        split = int(np.floor(0.2 * self.len))
         train_idx = idx[split:]
         valid_idx = idx[:split]
             
         self.train_idx = train_idx
         self.valid_idx = valid_idx
+    
+    @property
+    def train_input(self) :
+        
+        return gather_pairs(self.train_images, self.train_pairs, self.train_mean, self.train_std)
             
     def __getitem__(self,index) : 
         
-        return self.train_input[index], self.train_target[index], self.train_classes[index]
+        return gather_pairs(self.train_images, self.train_pairs[index], self.train_mean, self.train_std), self.train_target[index], \
+               self.train_classes[index]
     
     def __len__(self):
 
@@ -134,6 +229,52 @@ class Training_set (Dataset) :
 
 ########################################################################################################################
             
+def augment_pairs(input_, target, classes, rotate, translate, swap_channel, generator = None):
+    """
+     Random data augmentation of a minibatch of pairs -> one transform sampled per example and applied with vectorized tensor 
+     operations over the whole minibatch
+     
+     Input :
+         - input_ : Bx2x14x14 normalized pairs
+         - target : B binary targets
+         - classes : Bx2 classes of the two digits
+         - rotate : if true rotate the pair by 0, 90, 180 or 270 degrees, the 6 and 9 digits are never rotated
+         - translate : if true keep the pair or translate it by one pixel upward, downward, to the left or to the right, the pixels
+                       left at the boundary are filled with the background value
+         - swap_channel : if true swap the two channels with probability 0.5 and recompute the target
+         - generator : torch.Generator of the random transforms, None for the global one -> default None
+         
+     Output : augmented input_, target, classes and the B mask of the swapped pairs (all false without swap_channel)
+    """
+    n = input_.size(0)
+    rows = torch.arange(n).view(-1, 1)
+    channels = torch.arange(2)
+    
+    if rotate :
+        # same rotation for the two channels of a pair, except for the 6 and 9 which keep their orientation
+        k = torch.randint(4, (n, 1), generator = generator) * ((classes != 6) & (classes != 9)).long() # Bx2
+        rotations = torch.stack([input_.rot90(r, [2, 3]) for r in range(4)]) # 4xBx2x14x14
+        input_ = rotations[k, rows, channels]
+        
+    if translate :
+        # pad with the background and take the 14x14 window at the offset of the translation :
+        # none, upward, downward, to the left, to the right
+        background = input_[0, 0, 0, 0].item()
+        padded = F.pad(input_, (1, 1, 1, 1), value = background) # Bx2x16x16
+        windows = torch.stack([padded[:, :, i:i + 14, j:j + 14] for i, j in ((1, 1), (2, 1), (0, 1), (1, 2), (1, 0))])
+        input_ = windows[torch.randint(5, (n,), generator = generator), rows.view(-1)]
+        
+    swap = torch.zeros(n, dtype = torch.bool)
+    if swap_channel :
+        swap = torch.rand(n, generator = generator) < 0.5
+        input_ = torch.where(swap.view(-1, 1, 1, 1), input_.flip(1), input_)
+        classes = torch.where(swap.view(-1, 1), classes.flip(1), classes)
+        target = (classes[:, 0] <= classes[:, 1]).long()
+        
+    return input_, target, classes, swap
+
+########################################################################################################################
+
 class Training_set_split(Dataset) :
     """
     A class that inherite from Dataset of pytorch to automatically handle batches and shuffling of the data when passed to a dataloader
@@ -149,84 +290,58 @@ class Training_set_split(Dataset) :
                        -> by one pixel to the right
                        -> by one pixel to the left
         - swap_channels : if True swap the channels 
+        - draws : number of times each pair is drawn in an epoch -> default 1
+        - with_swap : if true __getitem__ also returns the mask of the pairs whose channels were swapped by the augmentation (e.g. to 
+                      exchange cached outputs of the original pairs) -> default False
+        - generator : torch.Generator of the augmentation (attribute), None for the global one -> default None
         
-        => data augmentation on the training set
+        => data augmentation on the training set : done lazily at batch time by augment_pairs with a random transform per example, 
+           the set only stores the indices of the pairs in the shared base images -> memory stays at 1x the dataset
+        => pass a list or tensor of indices to __getitem__ (e.g. with a BatchSampler) to augment a whole minibatch at once
     """
     
     # Constructor
-    def __init__(self,Training_set,rotate,translate,swap_channel) :
-        
-        train_input =  Training_set.train_input[Training_set.train_idx]
-        train_target  = Training_set.train_target[Training_set.train_idx]
-        train_classes = Training_set.train_classes[Training_set.train_idx]
-        
-        #Data augmentation
-        if (rotate == True) :
-            # find indices of 6 and 9 digits not to rotate them
-            indices_9 = (train_classes == 9)
-            index_9 = indices_9.nonzero()
-            indices_6 = (train_classes == 6)
-            index_6 = indices_6.nonzero()
-            
-            # rotate the images
-            empty_images90= torch.rot90(train_input,1,[2,3])
-            empty_images180= torch.rot90(train_input,2,[2,3])
-            empty_images270= torch.rot90(train_input,3,[2,3])
-            
-            # replace the rotated 6 and 9 by the original 
-            empty_images90[index_9[:,0],index_9[:,1]] = train_input[index_9[:,0],index_9[:,1]]
-            empty_images90[index_6[:,0],index_6[:,1]] = train_input[index_6[:,0],index_6[:,1]]
-            empty_images180[index_9[:,0],index_9[:,1]] = train_input[index_9[:,0],index_9[:,1]]
-            empty_images180[index_6[:,0],index_6[:,1]] = train_input[index_6[:,0],index_6[:,1]]
-            empty_images270[index_9[:,0],index_9[:,1]] = train_input[index_9[:,0],index_9[:,1]]
-            empty_images270[index_6[:,0],index_6[:,1]] = train_input[index_6[:,0],index_6[:,1]]
-            
-            # Concatenate the rotated images to the data
-            train_input = torch.cat((train_input,empty_images90,empty_images180,empty_images270),dim=0)
-            train_classes = torch.cat((train_classes,train_classes, train_classes,train_classes), dim=0)
-            train_target = torch.cat((train_target,train_target,train_target,train_target),dim=0)
-              
-        if (translate == True) :
-            # get the value of the background pixel to set the pixel value  at the boundary in the opposite of the direction of translation
-            background = train_input[0,0,0,0]
-            # initialize tensors where to put the translated images
-            upward = torch.zeros(800,2,14,14)
-            downward = torch.zeros(800,2,14,14)
-            left = torch.zeros(800,2,14,14)
-            right = torch.zeros(800,2,14,14)
-            #translate images
-            upward[:,:,:-1,:] = train_input[:800,:,1:,:]
-            downward[:,:,1:,:] = train_input[:800,:,:-1,:]
-            left[:,:,:,:-1] = train_input[:800,:,:,1:]
-            right[:,:,:,1:] = train_input[:800,:,:,:-1]
-            #add the background value to the boundary
-            upward[:,:,13,:] = background
-            downward[:,:,0,:] = background
-            left[:,:,:,13] = background
-            right[:,:,:,0] = background
-            
-            #concatenate the translated images
-            train_input = torch.cat((train_input,upward,downward,left,right),dim=0)
-            train_classes = torch.cat((train_classes, train_classes[:800],train_classes[:800],train_classes[:800],train_classes[:800]), dim=0)
-            train_target = torch.cat((train_target,train_target[:800],train_target[:800],train_target[:800],train_target[:800]),dim=0)
-            
-        if (swap_channel==True):
-            
-            # swap the channels by using the flip function from pytorch
-            train_input = torch.cat((train_input, train_input.flip(1)), dim=0)
-            train_classes = torch.cat((train_classes, train_classes.flip(1)), dim=0)
-            train_target = torch.cat((train_target, (train_classes.flip(1)[:,0] <= train_classes.flip(1)[:,1]).long()),dim=0)
+    def __init__(self,Training_set,rotate,translate,swap_channel, draws = 1, with_swap = False) :
+        
+        train_idx = torch.tensor(Training_set.train_idx, dtype = torch.long)
         
         # training 
-        self.len = train_input.shape[0]
-        self.train_input =  train_input
-        self.train_target  = train_target
-        self.train_classes = train_classes
+        self.nb_pairs = len(train_idx)
+        self.len = self.nb_pairs * draws
+        self.train_images = Training_set.train_images
+        self.train_pairs = Training_set.train_pairs[train_idx]
+        self.train_mean, self.train_std = Training_set.train_mean, Training_set.train_std
+        self.train_target  = Training_set.train_target[train_idx]
+        self.train_classes = Training_set.train_classes[train_idx]
+        
+        # data augmentation
+        self.rotate = rotate
+        self.translate = translate
+        self.swap_channel = swap_channel
+        self.with_swap = with_swap
+        self.generator = None
+    
+    @property
+    def train_input(self) :
+        
+        return gather_pairs(self.train_images, self.train_pairs, self.train_mean, self.train_std)
     
     # iterator
     def __getitem__(self,index) : 
         
-        return self.train_input[index], self.train_target[index], self.train_classes[index]
+        index = torch.as_tensor(index)
+        single = (index.dim() == 0)
+        index = index.view(-1) % self.nb_pairs
+        
+        input_ = gather_pairs(self.train_images, self.train_pairs[index], self.train_mean, self.train_std)
+        input_, target, classes, swap = augment_pairs(input_, self.train_target[index], self.train_classes[index], self.rotate, 
+                                                      self.translate, self.swap_channel, self.generator)
+        if self.with_swap :
+            return (input_[0], target[0], classes[0], swap[0]) if single else (input_, target, classes, swap)
+        if single :
+            return input_[0], target[0], classes[0]
+        
+        return input_, target, classes
     
     def __len__(self):
 
@@ -244,20 +359,155 @@ class Validation_set(Dataset) :
     # Constructor
     def __init__(self,Training_set) :
         
-        self.len = len(Training_set.valid_idx)
-        self.valid_input =  Training_set.train_input[Training_set.valid_idx]
-        self.valid_target  = Training_set.train_target[Training_set.valid_idx]
-        self.valid_classes = Training_set.train_classes[Training_set.valid_idx]
+        valid_idx = torch.tensor(Training_set.valid_idx, dtype = torch.long)
+        self.len = len(valid_idx)
+        self.valid_images = Training_set.train_images
+        self.valid_pairs = Training_set.train_pairs[valid_idx]
+        self.valid_mean, self.valid_std = Training_set.train_mean, Training_set.train_std
+        self.valid_target  = Training_set.train_target[valid_idx]
+        self.valid_classes = Training_set.train_classes[valid_idx]
+    
+    @property
+    def valid_input(self) :
+        
+        return gather_pairs(self.valid_images, self.valid_pairs, self.valid_mean, self.valid_std)
     
     # iterator 
     def __getitem__(self,index) : 
         
-        return self.valid_input[index], self.valid_target[index], self.valid_classes[index]
+        return gather_pairs(self.valid_images, self.valid_pairs[index], self.valid_mean, self.valid_std), self.valid_target[index], \
+               self.valid_classes[index]
     
     def __len__(self):
 
         return self.len
+
+###########################################################################################################################
+
+class Batch_iterator :
+    """
+    Fast in-memory replacement of the pytorch DataLoader for the datasets of this file
+    
+    The DataLoader calls __getitem__ once per sample and collates the samples of each batch, here the data already sits in 
+    contiguous tensors -> shuffle the indices with a single randperm per epoch and gather each batch with one index
+    
+    Input : Data -> any dataset of this file (its __getitem__ accepts a tensor of indices)
+    
+    Parameters :
+        
+        - mini_batch_size : number of samples per batch -> default 100
+        - shuffle : if true draw a new order of the samples at each epoch -> default True
+        - drop_last : if true drop the last incomplete batch -> default False
+        - pin_memory : if true and cuda is available copy the batches in pinned buffers allocated once and reused at each batch -> 
+                       default False
+        - with_indices : if true also yield the indices of the samples of each batch in Data (e.g. to look up cached values) -> 
+                         default False
+        - generator : torch.Generator of the order of the samples, None for the global one -> default None
+        
+    Output : iterator over the batches of Data (e.g. input, target, classes) followed by the indices if with_indices
+    """
+    
+    # Constructor
+    def __init__(self, Data, mini_batch_size = 100, shuffle = True, drop_last = False, pin_memory = False, with_indices = False, 
+                 generator = None) :
         
+        self.Data = Data
+        self.mini_batch_size = mini_batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.with_indices = with_indices
+        self.generator = generator
         
+        # two sets of pinned buffers used alternatively, each one is reused once its copy to the device is done
+        self.buffers = [None, None]
+        self.events = [None, None]
     
-        
\ No newline at end of file
+    def __len__(self) :
+        
+        if self.drop_last :
+            return len(self.Data) // self.mini_batch_size
+        return (len(self.Data) + self.mini_batch_size - 1) // self.mini_batch_size
+    
+    def _pin(self, batch, slot) :
+        
+        if self.buffers[slot] is None :
+            self.buffers[slot] = [torch.empty((self.mini_batch_size,) + tuple(t.shape[1:]), dtype = t.dtype, pin_memory = True) 
+                                  for t in batch]
+        # wait for the previous copy from this buffer to the device
+        if self.events[slot] is not None :
+            self.events[slot].synchronize()
+        
+        return tuple(buffer[:t.shape[0]].copy_(t) for buffer, t in zip(self.buffers[slot], batch))
+    
+    # iterator
+    def __iter__(self) :
+        
+        n = len(self.Data)
+        order = torch.randperm(n, generator = self.generator) if self.shuffle else torch.arange(n)
+        
+        for b in range(len(self)) :
+            index = order[b * self.mini_batch_size:(b + 1) * self.mini_batch_size]
+            batch = self.Data[index]
+            
+            if self.pin_memory :
+                slot = b % 2
+                batch = self._pin(batch, slot)
+                yield batch + (index,) if self.with_indices else batch
+                # the consumer has queued the copy of the batch to the device
+                self.events[slot] = torch.cuda.Event()
+                self.events[slot].record()
+            else :
+                yield batch + (index,) if self.with_indices else batch
+
+###########################################################################################################################
+
+# datasets of each (seed, rotate, translate, swap_channel) built by seeded_datasets
+dataset_cache = {}
+
+def seeded_datasets(seed, rotate = False, translate = False, swap_channel = False):
+    """
+     Training (Training_set_split), validation and test sets of a seed built once and reused by every trial with the same seed and 
+     augmentation flags (e.g. all the parameter combinations of a grid search)
+     
+         The sets are built as in the grid searches (torch.manual_seed(seed) and random.seed(0) then PairSetMNIST, Training_set, ...)
+         and the torch and python random states reached after building them are restored at every call -> the initialization of the 
+         network and the batches which follow are the same as if the sets had been built again
+         
+         The sets only hold indices into the shared base images and must not be modified
+     
+     Output : train_data_split, validation_data, test_data
+    """
+    key = (seed, rotate, translate, swap_channel)
+    
+    if key not in dataset_cache :
+        torch.manual_seed(seed)
+        random.seed(0)
+        data = PairSetMNIST()
+        train_data = Training_set(data)
+        datasets = (Training_set_split(train_data, rotate, translate, swap_channel), Validation_set(train_data), Test_set(data))
+        dataset_cache[key] = (datasets, torch.get_rng_state(), random.getstate())
+    
+    datasets, torch_state, random_state = dataset_cache[key]
+    torch.set_rng_state(torch_state)
+    random.setstate(random_state)
+    
+    return datasets
+
+def clear_dataset_cache():
+    """
+     Drop the datasets built by seeded_datasets -> called at the end of the searches and evaluations (run_trials, evaluate_model, 
+     sweep_head) so that a long-lived process does not keep one set of datasets per seed ever used
+    """
+    dataset_cache.clear()
+
+def share_datasets():
+    """
+     Move the tensors of the cached datasets to shared memory so that they are sent to worker processes as handles instead of copies, 
+     the base images referenced by every dataset are moved (and sent) once
+    """
+    for datasets, _, _ in dataset_cache.values() :
+        for dataset in datasets :
+            for value in vars(dataset).values() :
+                if torch.is_tensor(value) :
+                    value.share_memory_()
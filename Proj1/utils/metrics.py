@@ -5,6 +5,8 @@ from torch.nn import functional as F
 from torch import optim
 import torch.utils.data as dt
 from torch.utils.data import Dataset, DataLoader
+from utils.loader import Batch_iterator
+from utils.performance import cpu_perf_settings, to_cpu_perf, autocast
 import torch.cuda as cuda
 
 
@@ -47,7 +49,7 @@ def compute_nb_errors(y_pred, target):
 
 ##############################################################################################################
 
-def compute_metrics(model, Data, device, mini_batch_size=100, criterion = nn.CrossEntropyLoss()):
+def compute_metrics(model, Data, device, mini_batch_size=100, criterion = nn.CrossEntropyLoss(), cpu_perf=False):
     
     """
     Function to calculate prediction accuracy and loss of a model on a data
@@ -56,6 +58,8 @@ def compute_metrics(model, Data, device, mini_batch_size=100, criterion = nn.Cro
     
         - model : an instance of a neural network class
         - data : Dataset class from pytorch with the data : input,target,class
+        - cpu_perf : CPU execution mode (channels_last inputs, bfloat16 autocast) as in train_model -> default False, the threads and
+                     the memory format of the model are set once by setup_cpu_perf (train_model) and not at each call
         
     Output :
     
@@ -63,8 +67,9 @@ def compute_metrics(model, Data, device, mini_batch_size=100, criterion = nn.Cro
         - loss of the model given the criterion
     
     """
-    # data loader from pytorch feed with the data
-    data_loader = DataLoader(Data, batch_size=mini_batch_size, shuffle=True)
+    # batch iterator feed with the data -> indexed by whole minibatches of indices, no need to shuffle for evaluation
+    data_loader = Batch_iterator(Data, mini_batch_size, shuffle=False)
+    perf = cpu_perf_settings(cpu_perf if device.type == 'cpu' else False)
     model.eval()
     test_loss = 0
     nb_errors = 0
@@ -75,15 +80,18 @@ def compute_metrics(model, Data, device, mini_batch_size=100, criterion = nn.Cro
             
             input_, target_, classes_ = data
 
-            input_ = input_.to(device)
+            input_ = to_cpu_perf(input_.to(device), perf)
             target_ = target_.to(device)
             classes_ = classes_.to(device)
             
             # check which kind of net it is 
-            if (model.__class__.__name__ == 'LeNet_sharing_aux' or model.__class__.__name__ == 'Google_Net' ) :
-                _, _, output = model(input_) 
-            else :
+            with autocast(perf) :
                 output = model(input_)
+            # check if the net has auxiliary outputs -> from the output since the exported and quantized copies of 
+            # LeNet_sharing_aux and Google_Net are not instances of their class
+            if isinstance(output, tuple) :
+                _, _, output = output
+            output = output.float()
             
             # compute loss and the number of erros on the batch and add the loss to the overall loss on the data
             batch_loss = criterion(output, target_)
@@ -0,0 +1,139 @@
+import os
+import torch
+import warnings
+import functools
+import contextlib
+from torch import nn
+
+##############################################################################################################
+#                     CPU execution mode of train_model and compute_metrics (cpu_perf option)                #
+##############################################################################################################
+
+@functools.lru_cache(maxsize = None)
+def physical_cores():
+
+    """ Number of physical cores available to the process (hyper-threads not counted), from /proc/cpuinfo on Linux -> read once
+    on the first call """
+
+    available = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    cores = set()
+    try :
+        with open('/proc/cpuinfo') as cpuinfo :
+            physical_id = None
+            for line in cpuinfo :
+                name, _, value = line.partition(':')
+                if name.strip() == 'physical id' :
+                    physical_id = value.strip()
+                elif name.strip() == 'core id' :
+                    cores.add((physical_id, value.strip()))
+    except OSError :
+        pass
+
+    return max(1, min(len(cores), available)) if cores else max(1, available or 1)
+
+##############################################################################################################
+
+# default settings used when cpu_perf = True -> one intra-op thread per physical core (hyper-threads slow down the convolutions)
+# and a single inter-op thread since the nets have no parallel branches worth scheduling apart. 'physical' is resolved by 
+# cpu_perf_settings so that the cores are only counted when the option is used and not at import
+CPU_PERF_DEFAULT = {'channels_last' : True, 'bf16' : True, 'intra_op_threads' : 'physical', 'inter_op_threads' : 1}
+
+##############################################################################################################
+
+def cpu_perf_settings(cpu_perf):
+
+    """
+    Return the settings dictionnary of the cpu_perf option
+
+    Input :
+
+        - cpu_perf : False/None (default execution), True (CPU_PERF_DEFAULT) or a dictionnary overriding some keys of CPU_PERF_DEFAULT
+                     -> channels_last : convert the model and the inputs to the channels_last memory format
+                     -> bf16 : run the forward passes under CPU bfloat16 autocast
+                     -> intra_op_threads / inter_op_threads : number of threads of torch (default 'physical' -> number of 
+                        physical cores / 1), None to keep the current value
+
+    Output : dictionnary of settings or None if cpu_perf is disabled
+    """
+    if not cpu_perf :
+        return None
+
+    settings = dict(CPU_PERF_DEFAULT)
+    if isinstance(cpu_perf, dict) :
+        settings.update(cpu_perf)
+    if settings['intra_op_threads'] == 'physical' :
+        settings['intra_op_threads'] = physical_cores()
+
+    return settings
+
+##############################################################################################################
+
+def set_threads(intra_op_threads = None, inter_op_threads = None):
+
+    """
+    Set the intra-op and inter-op number of threads of torch, None keeps the current value
+
+        The inter-op threads can only be set once before any inter-op parallel work -> a warning is raised if torch refuses the
+        value and the current number of inter-op threads is kept
+    """
+    if intra_op_threads is not None and intra_op_threads != torch.get_num_threads() :
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads is not None and inter_op_threads != torch.get_num_interop_threads() :
+        try :
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError as error :
+            warnings.warn('cpu_perf : {:d} inter-op threads kept instead of {:d} ({})'.format(torch.get_num_interop_threads(),
+                          inter_op_threads, error), RuntimeWarning)
+
+##############################################################################################################
+
+def setup_cpu_perf(model, cpu_perf):
+
+    """
+    Prepare the CPU execution mode : set the number of threads and convert the model to channels_last
+
+        Called once per model (train_model, compare_cpu_perf), compute_metrics only uses the settings of a prepared model
+
+    Output : settings dictionnary of the cpu_perf option (None if disabled)
+    """
+    settings = cpu_perf_settings(cpu_perf)
+
+    if settings is not None :
+        set_threads(settings['intra_op_threads'], settings['inter_op_threads'])
+        if settings['channels_last'] :
+            model.to(memory_format = torch.channels_last)
+
+    return settings
+
+##############################################################################################################
+
+def to_cpu_perf(input_, settings):
+
+    """ Convert an input batch to the memory format of the cpu_perf settings """
+
+    if settings is not None and settings['channels_last'] :
+        return input_.contiguous(memory_format = torch.channels_last)
+
+    return input_
+
+##############################################################################################################
+
+def autocast(settings):
+
+    """ CPU bfloat16 autocast context if enabled in the cpu_perf settings, null context otherwise """
+
+    if settings is not None and settings['bf16'] :
+        return torch.autocast('cpu', dtype = torch.bfloat16)
+
+    return contextlib.nullcontext()
+
+##############################################################################################################
+
+def to_float(output):
+
+    """ Cast the output(s) of a model computed under autocast back to float32 before the loss """
+
+    if isinstance(output, tuple) :
+        return tuple(o.float() for o in output)
+
+    return output.float()
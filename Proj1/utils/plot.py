@@ -27,13 +27,18 @@ def learning_curve(tr_losses, tr_accuracies, valid_losses, valid_accuracies):
     fig, ax1 = plt.subplots()
     ax1.set_xlabel('Epochs')
     ax1.set_ylabel('Normalized loss [loss/data size]')
+    # the validation is not evaluated at every epoch with eval_every > 1 (nan) -> only plot the evaluated epochs
+    valid_epochs = [e for e, loss in enumerate(valid_losses) if not np.isnan(loss)]
+    valid_losses = [valid_losses[e] for e in valid_epochs]
+    valid_accuracies = [valid_accuracies[e] for e in valid_epochs]
+    
     a1, = ax1.plot(tr_losses, 'g', linewidth=2, label = 'Train loss')
-    a2, = ax1.plot(valid_losses, 'r', linewidth=2, label = 'Validation loss')
+    a2, = ax1.plot(valid_epochs, valid_losses, 'r', linewidth=2, label = 'Validation loss')
     ax2 = ax1.twinx()
     
     ax2.set_ylabel('Accuracy [%]')
     b1, = ax2.plot(tr_accuracies, 'g--', linewidth=2, label = 'Train acc')
-    b2, = ax2.plot(valid_accuracies, 'r--', linewidth=2, label = 'Validation acc')
+    b2, = ax2.plot(valid_epochs, valid_accuracies, 'r--', linewidth=2, label = 'Validation acc')
     
     t = [a1, a2, b1, b2]
     ax1.legend(t, [t_.get_label() for t_ in t], loc = 'best', fontsize='small')
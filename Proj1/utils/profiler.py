@@ -0,0 +1,212 @@
+import json
+import time
+import torch
+from utils.benchmark import layer_flops
+
+##############################################################################################################
+#            Per-layer forward / backward profiler of the networks of the <Nets> class (module hooks)         #
+##############################################################################################################
+
+def output_bytes(output):
+
+    """ Bytes of the tensors of a module output (tensor or tuple of tensors) """
+
+    if torch.is_tensor(output) :
+        return output.numel() * output.element_size()
+    if isinstance(output, (list, tuple)) :
+        return sum(output_bytes(item) for item in output)
+
+    return 0
+
+##############################################################################################################
+
+class Layer_profiler :
+    """
+    Forward and backward hooks on every submodule of a model recording the time of each call
+
+        A submodule called several times per forward (e.g. conv1 and conv2 of LeNet_sharing_aux, called once per channel, or the
+        conv_block of Auxiliary_loss) accumulates all its calls. The times are inclusive -> the time of a block (conv_block,
+        Inception_block) contains the time of its layers. FLOPs (Conv2d and Linear, see layer_flops) are summed from the layers to
+        the blocks which contain them.
+
+    Input :
+
+        - model : an instance of a neural network class
+        - synchronize : wait for the GPU at each hook so that the times are the ones of the layers -> default true on GPU
+
+    Functions :
+
+        1) attach / detach : register / remove the hooks
+        2) reset : clear the statistics and the trace events
+        3) statistics : per-pass statistics of each submodule over n_passes forward (and backward) passes
+    """
+
+    # constructor
+    def __init__(self, model, synchronize = None) :
+
+        self.model = model
+        self.synchronize = synchronize if synchronize is not None else next(model.parameters()).is_cuda
+        self.names = {module : (name or model.__class__.__name__) for name, module in model.named_modules()}
+        self.handles = []
+        self.reset()
+
+    def reset(self) :
+
+        self.stats = {name : {'type' : module.__class__.__name__, 'calls' : 0, 'forward' : 0., 'backward' : 0., 'flops' : 0,
+                              'bytes' : 0, 'params' : sum(p.numel() for p in module.parameters()),
+                              'leaf' : len(list(module.children())) == 0} for module, name in self.names.items()}
+        self.events = []
+        self.starts = {}
+        self.origin = time.perf_counter()
+
+    def _now(self) :
+
+        if self.synchronize :
+            torch.cuda.synchronize()
+
+        return time.perf_counter()
+
+    def _start(self, module, phase) :
+
+        self.starts.setdefault((module, phase), []).append(self._now())
+
+    def _stop(self, module, phase) :
+
+        end = self._now()
+        start = self.starts[(module, phase)].pop()
+        name = self.names[module]
+        self.stats[name][phase] += end - start
+        self.events.append({'name' : name, 'cat' : phase, 'ph' : 'X', 'pid' : 0, 'tid' : 0 if phase == 'forward' else 1,
+                            'ts' : 1e6 * (start - self.origin), 'dur' : 1e6 * (end - start)})
+
+        return name
+
+    def attach(self) :
+
+        def forward_pre(module, input_) :
+            self._start(module, 'forward')
+
+        def forward(module, input_, output) :
+            name = self._stop(module, 'forward')
+            self.stats[name]['calls'] += 1
+            self.stats[name]['bytes'] += output_bytes(output)
+            self.stats[name]['flops'] += layer_flops(module, input_, output)
+
+        def backward_pre(module, grad_output) :
+            self._start(module, 'backward')
+
+        def backward(module, grad_input, grad_output) :
+            self._stop(module, 'backward')
+
+        for module in self.names :
+            self.handles += [module.register_forward_pre_hook(forward_pre), module.register_forward_hook(forward),
+                             module.register_full_backward_pre_hook(backward_pre), module.register_full_backward_hook(backward)]
+
+        return self
+
+    def detach(self) :
+
+        for handle in self.handles :
+            handle.remove()
+        self.handles = []
+
+    def statistics(self, n_passes = 1) :
+
+        """ Per-pass statistics -> calls, forward and backward time (s), FLOPs (summed from the layers to their blocks), bytes of the
+        outputs, number of parameters and whether the submodule is a layer (leaf) """
+
+        stats = {name : dict(values) for name, values in self.stats.items()}
+        root = self.names[self.model]
+        for name, values in self.stats.items() :
+            if values['leaf'] and values['flops'] :
+                # blocks containing the layer, the model itself included
+                parents = [name[:i] for i in range(len(name)) if name[i] == '.'] + ([root] if name != root else [])
+                for parent in parents :
+                    stats[parent]['flops'] += values['flops']
+        for values in stats.values() :
+            for key in ['calls', 'forward', 'backward', 'flops', 'bytes'] :
+                values[key] = values[key] / n_passes
+
+        return stats
+
+##############################################################################################################
+
+def profile_model(model, input_, n_iter = 5, n_warmup = 2, backward = True):
+
+    """
+    Profile every submodule of a model on a representative batch
+
+    Input :
+
+        - model : an instance of a neural network class, profiled in its current mode (train mode for the backward pass)
+        - input_ : input batch of the model (e.g. Nx2x14x14 pairs)
+        - n_iter : number of profiled passes -> default 5
+        - n_warmup : number of passes before profiling -> default 2
+        - backward : if true profile forward + backward of the sum of the outputs as in time_forward, the gradient of the input is
+                     also computed -> default True
+
+    Output :
+
+        - per-pass statistics of each submodule (see Layer_profiler.statistics)
+        - Chrome trace events of the last profiled pass (see write_chrome_trace)
+    """
+    profiler = Layer_profiler(model)
+    # the gradient of the input is computed so that the backward hooks of the first layers (and of the model) fire at the end of their
+    # backward pass and not as soon as the gradient of their output is known
+    if backward :
+        input_ = input_.detach().clone().requires_grad_()
+
+    def step() :
+        if backward :
+            output = model(input_)
+            output = output if isinstance(output, tuple) else (output,)
+            sum(o.sum() for o in output).backward()
+        else :
+            with torch.no_grad() :
+                model(input_)
+
+    for _ in range(n_warmup) :
+        step()
+
+    profiler.attach()
+    try :
+        for i in range(n_iter) :
+            # only the events of the last pass are kept for the trace
+            events = len(profiler.events)
+            step()
+        trace = profiler.events[events:]
+    finally :
+        profiler.detach()
+    model.zero_grad()
+
+    return profiler.statistics(n_iter), trace
+
+##############################################################################################################
+
+def print_profile(stats, sort = 'forward', leaves_only = False, top = None):
+
+    """
+    Print the per-layer statistics sorted by decreasing sort ('forward', 'backward', 'flops', 'bytes', 'params')
+
+        - leaves_only : only print the layers (no blocks) -> default False
+        - top : number of lines printed, None for all of them -> default None
+    """
+    rows = [(name, values) for name, values in stats.items() if values['leaf'] or not leaves_only]
+    rows = sorted(rows, key = lambda row : -row[1][sort])[:top]
+    total = max(values['forward'] + values['backward'] for values in stats.values())
+
+    print('{:<40} {:<20} {:>5} {:>12} {:>13} {:>7} {:>10} {:>10} {:>13}'.format('module', 'type', 'calls', 'forward [ms]', 'backward [ms]',
+          '% time', 'MFLOPs', 'params', 'activ. [MB]'))
+    for name, values in rows :
+        print('{:<40} {:<20} {:>5.0f} {:>12.3f} {:>13.3f} {:>7.1f} {:>10.2f} {:>10d} {:>13.3f}'.format(name[:40], values['type'][:20],
+              values['calls'], 1e3 * values['forward'], 1e3 * values['backward'],
+              100 * (values['forward'] + values['backward']) / total, values['flops'] / 1e6, values['params'], values['bytes'] / 2**20))
+
+##############################################################################################################
+
+def write_chrome_trace(events, path):
+
+    """ Write trace events in the Chrome trace format (chrome://tracing, Perfetto) -> forward passes on thread 0, backward on 1 """
+
+    with open(path, 'w') as trace :
+        json.dump({'traceEvents' : events, 'displayTimeUnit' : 'ms'}, trace)
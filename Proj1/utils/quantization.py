@@ -0,0 +1,109 @@
+import torch
+import copy
+from torch import nn
+from torch.ao.quantization import QConfigMapping, get_default_qconfig, quantize_dynamic
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+from utils.loader import Batch_iterator
+from utils.metrics import compute_metrics
+from utils.export import fold_batch_norm
+from utils.benchmark import time_forward
+
+##############################################################################################################
+
+def calibrate(model, calibration_data, mini_batch_size = 100, n_batches = None):
+
+    """
+    Run a prepared (observed) model on the calibration data to record the ranges of the activations
+
+    Input :
+
+        - model : model prepared for static quantization
+        - calibration_data : Dataset with the data : input, target, classes -> e.g. Validation_set
+        - mini_batch_size : batch size of the calibration passes -> default 100
+        - n_batches : number of calibration batches, None for the whole data -> default None
+    """
+    with torch.no_grad() :
+        for i, (input_, _, _) in enumerate(Batch_iterator(calibration_data, mini_batch_size, shuffle = False)) :
+            if n_batches is not None and i >= n_batches :
+                break
+            model(input_)
+
+##############################################################################################################
+
+def quantize_model(model, calibration_data, mini_batch_size = 100, n_batches = None, backend = 'x86'):
+
+    """
+     General : Return an int8 copy of a trained model for CPU inference
+
+         1) batch norm folded into the convolutions (fold_batch_norm)
+         2) static quantization of the convolutional trunk (FX graph mode) : int8 weights and activations, the activation ranges
+            are calibrated on calibration_data
+         3) dynamic quantization of the nn.Linear layers (e.g. Auxiliary_loss.fc1 2048x1024) : int8 weights, the activations are
+            quantized on the fly per batch
+
+     Input :
+
+         - model : a trained model of the <Nets> registry, it is not modified
+         - calibration_data : Dataset used to calibrate the static quantization -> e.g. Validation_set, never the test set
+         - mini_batch_size : batch size of the calibration passes -> default 100
+         - n_batches : number of calibration batches, None for the whole data -> default None
+         - backend : quantized engine of torch ('x86', 'fbgemm', 'qnnpack', 'onednn') -> default 'x86'
+
+     Output : the quantized model (evaluation mode, CPU only) with the same outputs as the model
+    """
+    torch.backends.quantized.engine = backend
+    float_model = fold_batch_norm(model).cpu()
+
+    # static quantization of everything except the linear layers which are quantized dynamically
+    qconfig_mapping = QConfigMapping().set_global(get_default_qconfig(backend)).set_object_type(nn.Linear, None)
+    example = (next(iter(Batch_iterator(calibration_data, mini_batch_size, shuffle = False)))[0],)
+    prepared = prepare_fx(float_model, qconfig_mapping, example)
+    calibrate(prepared, calibration_data, mini_batch_size, n_batches)
+    quantized = convert_fx(prepared)
+
+    return quantize_dynamic(quantized, {nn.Linear}, dtype = torch.qint8)
+
+##############################################################################################################
+
+def model_size(model):
+
+    """ Return the size in bytes of the state_dict of a model (packed int8 weights included) """
+
+    size = 0
+    for value in model.state_dict().values() :
+        if torch.is_tensor(value) :
+            size += value.numel() * value.element_size()
+        elif isinstance(value, tuple) :
+            # packed parameters of the dynamically quantized linear layers -> (weight, bias)
+            size += sum(v.numel() * v.element_size() for v in value if torch.is_tensor(v))
+
+    return size
+
+##############################################################################################################
+
+def compare_quantized(model, quantized, test_data, mini_batch_size = 100, n_iter = 20):
+
+    """
+    Test accuracy, latency and size of a float model and its quantized copy side by side
+
+    Input :
+
+        - model : the trained float model
+        - quantized : the model returned by quantize_model
+        - test_data : Dataset on which the accuracies are computed -> e.g. Test_set
+        - mini_batch_size : batch size of the evaluation and of the timed forward passes -> default 100
+        - n_iter : number of timed forward passes -> default 20
+
+    Output : dictionnary {'float' : {...}, 'int8' : {...}} with the test loss, the test accuracy, the forward time in seconds and
+             the size in bytes of each model
+    """
+    device = torch.device('cpu')
+    input_ = next(iter(Batch_iterator(test_data, mini_batch_size, shuffle = False)))[0]
+    model = copy.deepcopy(model).cpu().eval()
+
+    results = {}
+    for name, m in [('float', model), ('int8', quantized)] :
+        loss, acc = compute_metrics(m, test_data, device, mini_batch_size)
+        results[name] = {'loss' : loss, 'accuracy' : acc, 'forward' : time_forward(m, input_, n_iter), 'size' : model_size(m)}
+
+    return results
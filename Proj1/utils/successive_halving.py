@@ -0,0 +1,195 @@
+import torch
+import math
+import random
+import itertools
+from torch import nn
+from torch import optim
+from utils.grid_search import make_trial, run_trials
+from utils.telemetry import new_run_id, summarize, print_summary
+
+
+def halving_schedule(n_configs, n_seeds, min_epochs=5, max_epochs=40, min_seeds=2, reduction_factor=3, n_rungs=None):
+
+    """
+
+     General : Budget of each rung of a successive halving
+
+               The number of configurations is divided by reduction_factor after each rung (by default until at most reduction_factor
+               remain), the number of epochs and of seeds grow geometrically from (min_epochs, min_seeds) at the first rung to
+               (max_epochs, n_seeds) at the last one
+
+     Input :
+
+         - n_configs : number of configurations of the first rung
+         - n_seeds : number of seeds of the last rung
+         - min_epochs, max_epochs : number of epochs of the first and of the last rung -> default 5 and 40
+         - min_seeds : number of seeds of the first rung -> default 2
+         - reduction_factor : fraction 1/reduction_factor of the configurations promoted at each rung -> default 3
+         - n_rungs : number of rungs, None to halve until at most reduction_factor configurations remain -> default None
+
+     Output : list of (number of configurations, number of epochs, number of seeds) of each rung
+    """
+    if n_rungs is None :
+        n_rungs = max(1, math.ceil(math.log(n_configs) / math.log(reduction_factor) - 1e-9))
+    min_seeds = min(min_seeds, n_seeds)
+
+    schedule = []
+    for k in range(n_rungs) :
+        ratio = k / (n_rungs - 1) if n_rungs > 1 else 1
+        epochs = int(round(min_epochs * (max_epochs / min_epochs) ** ratio))
+        seeds = int(round(min_seeds * (n_seeds / min_seeds) ** ratio))
+        schedule.append((math.ceil(n_configs / reduction_factor ** k), epochs, seeds))
+
+    return schedule
+
+###########################################################################################################################################
+
+def successive_halving(net, configs, seeds, mini_batch_size=100, optimizer = optim.Adam, criterion = nn.CrossEntropyLoss(),
+                       min_epochs=5, max_epochs=40, min_seeds=2, reduction_factor=3, lambda_l2 = 0, alpha=0.5, beta=0.5, 
+                       rotate = False, translate=False, swap_channel = False, GPU=False, n_workers=1, threads_per_worker=None,
+                       cache_dir=None, n_rungs=None, patience=None, min_delta=0, monitor='loss', telemetry=None):
+
+    """
+
+     General : Successive halving over a list of configurations of a network
+
+               All the configurations start on a small budget of epochs and seeds, only the top 1/reduction_factor by mean validation
+               accuracy at the last epoch of the history of train_model are promoted to the next rung with a larger budget
+               (halving_schedule). The last rung is trained on max_epochs and all the seeds as in the grid searches
+               -> the clearly bad configurations after a few epochs do not consume the full budget
+
+     Input :
+
+         - net : network class (Net2C, LeNet_sharing, LeNet_sharing_aux)
+         - configs : list of configurations -> dictionnaries with the learning rate 'lr' and the parameters of the constructor of net
+         - seeds : list of seeds of the last rung, the first rungs use the first seeds of the list
+         -> min_epochs, max_epochs, min_seeds, reduction_factor, n_rungs see halving_schedule
+         -> mini_batch_size,optimizer, criterion, lambda_2, alpha, beta see training.py
+         -> rotate,translate and swap_channels -> data augmentation see loader.py
+         -> n_workers, threads_per_worker, cache_dir -> parallel execution and result cache of the trials see run_trials in grid_search.py
+         -> patience, min_delta, monitor -> early stopping of each trial see training.py
+         -> telemetry : path of the JSON-lines log of the per-epoch telemetry of the trials, summarized per rung and configuration at
+            the end (see utils/telemetry.py) -> default None
+
+     Output :
+
+         - best : the configuration with the highest mean validation accuracy at the last rung
+         - rungs : list of dictionnaries of each rung -> 'epochs', 'seeds', 'configs' and 'scores' (mean validation accuracy of each
+                   configuration) and 'results' (history, test_loss, test_acc of each trial)
+    """
+    rungs = []
+    search = {'path' : telemetry, 'search' : new_run_id()} if telemetry is not None else None
+
+    for n_configs, n_epochs, n_seeds in halving_schedule(len(configs), len(seeds), min_epochs, max_epochs, min_seeds,
+                                                         reduction_factor, n_rungs) :
+        # configurations promoted by the previous rung
+        configs = configs[:n_configs]
+
+        trials = []
+        for config in configs :
+            parameters = {name : value for name, value in config.items() if name != 'lr'}
+            for n, seed in enumerate(seeds[:n_seeds]) :
+                label = '{} | epochs : {:d} (n= {:d})'.format(', '.join('{} : {}'.format(name, value) for name, value in config.items()),
+                                                              n_epochs, n)
+                trials.append(make_trial(net, parameters, seed, config['lr'], label, mini_batch_size, optimizer, criterion, n_epochs,
+                                         lambda_l2, alpha, beta, rotate, translate, swap_channel, GPU, patience, min_delta, monitor,
+                                         search))
+
+        results = run_trials(trials, n_workers, threads_per_worker, cache_dir)
+
+        # mean validation accuracy at the last epoch over the seeds of each configuration
+        scores = torch.tensor([result[0][3, -1].item() for result in results]).view(len(configs), n_seeds).mean(1)
+        rungs.append({'epochs' : n_epochs, 'seeds' : n_seeds, 'configs' : configs, 'scores' : scores, 'results' : results})
+
+        # sort the configurations by decreasing score (stable -> ties keep the order of the grid)
+        order = sorted(range(len(configs)), key = lambda i : -scores[i].item())
+        configs = [configs[i] for i in order]
+
+        print('Rung {:d} : {:d} configurations, {:d} epochs, {:d} seeds -> best mean validation accuracy {:.2f}%'.format(len(rungs) - 1,
+              len(order), n_epochs, n_seeds, scores.max().item()))
+
+    # time spent per rung and configuration
+    if telemetry is not None :
+        print_summary(summarize(telemetry, search['search'], by = ('n_epochs', 'eta', 'parameters')))
+    
+    return configs[0], rungs
+
+###########################################################################################################################################
+
+def hyperband(net, configs, seeds, min_epochs=5, max_epochs=40, min_seeds=2, reduction_factor=3, sampling_seed=0, **kwargs):
+
+    """
+
+     General : Hyperband -> several successive halving brackets trading the number of configurations against their first budget
+
+               Bracket s (s = s_max, ..., 0) has s + 1 rungs and draws about reduction_factor^s configurations from configs (without
+               replacement, with a fixed sampling seed). s_max is large enough for the first bracket to start with every configuration
+               (reduction_factor^s_max >= len(configs)) and for the budgets to span min_epochs to max_epochs. The first budget of the
+               brackets grows geometrically from min_epochs (bracket s_max) to max_epochs (bracket 0), every bracket ends on
+               max_epochs and all the seeds and the best configuration over the brackets is returned
+               -> hedges against configurations which only become good after many epochs (learning rate, dropout)
+
+     Input :
+
+         - sampling_seed : seed of the draw of the configurations of each bracket -> default 0
+         -> net, configs, seeds, min_epochs, max_epochs, min_seeds, reduction_factor, kwargs see successive_halving
+
+     Output :
+
+         - best : the configuration with the highest mean validation accuracy at the last rung of its bracket
+         - brackets : list of the rungs of each bracket (see successive_halving)
+    """
+    # enough brackets to cover the grid and the ratio of the budgets
+    s_max = max(0, int(math.ceil(math.log(len(configs)) / math.log(reduction_factor) - 1e-9)),
+                int(math.floor(math.log(max_epochs / min_epochs) / math.log(reduction_factor) + 1e-9)))
+    sampler = random.Random(sampling_seed)
+
+    best, best_score, brackets = None, -float('inf'), []
+    for s in range(s_max, -1, -1) :
+        n_configs = min(len(configs), int(math.ceil((s_max + 1) / (s + 1) * reduction_factor ** s)))
+        # keep the grid order of the drawn configurations
+        drawn = sorted(sampler.sample(range(len(configs)), n_configs))
+        first_epochs = int(round(min_epochs * (max_epochs / min_epochs) ** ((s_max - s) / s_max))) if s_max > 0 else max_epochs
+
+        bracket_best, rungs = successive_halving(net, [configs[i] for i in drawn], seeds, min_epochs = first_epochs,
+                                                 max_epochs = max_epochs, min_seeds = min_seeds, reduction_factor = reduction_factor,
+                                                 n_rungs = s + 1, **kwargs)
+        brackets.append(rungs)
+
+        score = rungs[-1]['scores'].max().item()
+        if score > best_score :
+            best, best_score = bracket_best, score
+
+    return best, brackets
+
+###########################################################################################################################################
+
+def grid_configs(lrs, **parameters):
+
+    """ List of the configurations of a grid -> every combination of the learning rates lrs and of the lists of parameters """
+
+    names = list(parameters)
+
+    return [dict(zip(['lr'] + names, values)) for values in itertools.product(lrs, *[parameters[name] for name in names])]
+
+###########################################################################################################################################
+
+def tune(net, configs, seeds, search='halving', mini_batch_size=100, optimizer = optim.Adam, criterion = nn.CrossEntropyLoss(),
+         n_epochs=40, min_epochs=5, min_seeds=2, reduction_factor=3, lambda_l2 = 0, alpha=0.5, beta=0.5, rotate = False, 
+         translate=False, swap_channel = False, GPU=False, n_workers=1, threads_per_worker=None, cache_dir=None, patience=None,
+         min_delta=0, monitor='loss', telemetry=None):
+
+    """
+    Tune a network with successive halving (search = 'halving') or hyperband (search = 'hyperband') -> called by the Tune_* functions
+    of the <Nets> class, n_epochs is the budget of the last rung
+
+    Output : the best configuration and the rungs (list of the rungs of each bracket for hyperband)
+    """
+    assert search in ['halving', 'hyperband'], "search should be 'halving' or 'hyperband'"
+    tuner = successive_halving if search == 'halving' else hyperband
+
+    return tuner(net, configs, seeds, mini_batch_size = mini_batch_size, optimizer = optimizer, criterion = criterion,
+                 min_epochs = min_epochs, max_epochs = n_epochs, min_seeds = min_seeds, reduction_factor = reduction_factor,
+                 lambda_l2 = lambda_l2, alpha = alpha, beta = beta, rotate = rotate, translate = translate, swap_channel = swap_channel,
+                 GPU = GPU, n_workers = n_workers, threads_per_worker = threads_per_worker, cache_dir = cache_dir, patience = patience,
+                 min_delta = min_delta, monitor = monitor, telemetry = telemetry)
@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import uuid
+import resource
+import sys
+from utils.cache import describe
+
+##############################################################################################################
+#          Per-epoch performance telemetry of train_model -> append-only JSON-lines log and summaries        #
+##############################################################################################################
+
+def peak_rss():
+
+    """ Peak resident set size of the process in MB (ru_maxrss is in KB on Linux and in bytes on macOS) """
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return rss / 2 ** 20 if sys.platform == 'darwin' else rss / 2 ** 10
+
+##############################################################################################################
+
+def new_run_id():
+
+    """ Identifier of a grid search or of an evaluation -> groups the records of its trainings in a shared log """
+
+    return uuid.uuid4().hex[:12]
+
+##############################################################################################################
+
+class Telemetry_log :
+    """
+    Append-only JSON-lines log of the epochs of one training
+
+        Each record is one line with the identifiers of the run (e.g. search id, net type, seed, learning rate, parameters) followed
+        by the values of the epoch, written with a single append -> several processes of a grid search can share the same log
+
+    Input :
+
+        - path : path of the log
+        - run : identifiers of the training added to each record, with a new 'run' identifier of the training
+
+    Functions :
+
+        1) record : append the record of an epoch
+    """
+
+    # constructor
+    def __init__(self, path, **run) :
+
+        self.path = path
+        self.run = {'run' : new_run_id(), **run}
+
+    def record(self, **values) :
+
+        line = json.dumps({**self.run, **values, 'time' : time.time()}, default = describe)
+        with open(self.path, 'a') as log :
+            log.write(line + '\n')
+
+##############################################################################################################
+
+def read_log(path, search = None):
+
+    """ Records of a log, only those of the run identifier search if given -> no records if nothing was logged yet """
+
+    records = []
+    if not os.path.exists(path) :
+        return records
+    with open(path) as log :
+        for line in log :
+            if line.strip() :
+                record = json.loads(line)
+                if search is None or record.get('search') == search :
+                    records.append(record)
+
+    return records
+
+##############################################################################################################
+
+def summarize(path, search = None, by = ('net_type',)):
+
+    """
+    Aggregate the records of a log per group of identifiers
+
+    Input :
+
+        - path : path of the log
+        - search : run identifier of the records to aggregate, None for all of them -> default None
+        - by : identifiers defining the groups (e.g. ('net_type',), ('net_type', 'eta', 'parameters')) -> default ('net_type',)
+
+    Output : dictionnary {group : totals} -> number of trainings and epochs, total time of the train, data loading, compute,
+             train evaluation and validation phases (s), samples per second of the train phase and peak RSS (MB)
+    """
+    summary = {}
+    for record in read_log(path, search) :
+        group = ', '.join('{} : {}'.format(name, json.dumps(record.get(name), sort_keys = True)) for name in by)
+        totals = summary.setdefault(group, {'runs' : set(), 'epochs' : 0, 'train_time' : 0., 'data_time' : 0., 'compute_time' : 0.,
+                                            'train_eval_time' : 0., 'valid_time' : 0., 'samples' : 0, 'peak_rss' : 0.})
+        totals['runs'].add(record['run'])
+        totals['epochs'] += 1
+        for name in ['train_time', 'data_time', 'compute_time', 'train_eval_time', 'valid_time', 'samples'] :
+            totals[name] += record[name]
+        totals['peak_rss'] = max(totals['peak_rss'], record['peak_rss'])
+
+    for totals in summary.values() :
+        totals['runs'] = len(totals['runs'])
+        totals['samples_per_sec'] = totals['samples'] / totals['train_time'] if totals['train_time'] > 0 else float('nan')
+
+    return summary
+
+##############################################################################################################
+
+def print_summary(summary):
+
+    """ Print the summary of a log, one line per group """
+
+    print('{:>5} {:>7} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}  {}'.format('runs', 'epochs', 'train(s)', 'data(s)', 'compute(s)',
+          'tr_eval(s)', 'valid(s)', 'samples/s', 'RSS(MB)', 'group'))
+    for group, totals in summary.items() :
+        print('{:>5d} {:>7d} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.0f} {:>10.0f}  {}'.format(totals['runs'], 
+              totals['epochs'], totals['train_time'], totals['data_time'], totals['compute_time'], totals['train_eval_time'],
+              totals['valid_time'], totals['samples_per_sec'], totals['peak_rss'], group))
@@ -3,14 +3,20 @@ from torch import nn
 from torch.nn import functional as F
 from torch import optim
 from utils.metrics import compute_metrics
-from torch.utils.data import Dataset, DataLoader
+from utils.loader import Batch_iterator
+from utils.performance import setup_cpu_perf, to_cpu_perf, autocast, to_float
+from utils.checkpoint import Checkpoint_writer, load_checkpoint, rng_state, set_rng_state
+from utils.telemetry import peak_rss
+import time
 
 
 # General training function for already initialized model
 
 
 def train_model(model, train_data, validation_data, device, mini_batch_size=100, optimizer = optim.Adam,
-                criterion = nn.CrossEntropyLoss(), n_epochs=40, eta=1e-3,lambda_l2=0, alpha=0.5, beta=0.5):
+                criterion = nn.CrossEntropyLoss(), n_epochs=40, eta=1e-3,lambda_l2=0, alpha=0.5, beta=0.5, eval_every=1,
+                exact_train_metrics=False, cpu_perf=False, patience=None, min_delta=0, monitor='loss',
+                checkpoint=None, checkpoint_every=1, telemetry=None):
     
     """
     Train  a neural network model and record train/validation history
@@ -29,13 +35,33 @@ def train_model(model, train_data, validation_data, device, mini_batch_size=100,
         - lambda_l2 : weight penalty term (weight decay) -> default 0
         - alpha : weight term  of the binary loss in the overall loss-> default 0.5
         - beta : weight term  of the auxiliary loss in the overall loss-> default 0.5
+        - eval_every : evaluate the validation set every eval_every epochs, the last epoch is always evaluated -> default 1
+        - exact_train_metrics : if true re-evaluate the whole train set in evaluation mode when the validation is evaluated (nan at the 
+                                other epochs as for the validation, so that a history never mixes the two kinds of metrics), 
+                                otherwise the train loss and accuracy are accumulated during the optimization pass at no extra cost 
+                                (on the training mode outputs, e.g. with dropout) -> default False
+        - cpu_perf : CPU execution mode (see utils/performance.py) -> True or a dictionnary of settings to convert the model and the 
+                     inputs to channels_last, run the forward passes under bfloat16 autocast and set the number of threads, 
+                     ignored on GPU -> default False
+        - patience : early stopping -> stop when the monitored validation metric has not improved for patience epochs, the weights of 
+                     the best epoch are kept in memory and restored at the end, None to always run n_epochs -> default None
+        - min_delta : minimum change of the monitored metric counted as an improvement -> default 0
+        - monitor : validation metric of the early stopping, 'loss' or 'accuracy' -> default 'loss'
+        - checkpoint : path of the checkpoint of the training -> the model, the optimizer, the random states, the histories and the early 
+                       stopping state are saved every checkpoint_every epochs by a background thread (utils/checkpoint.py) and the 
+                       training resumes from the checkpoint if it exists, None to disable it -> default None
+        - checkpoint_every : number of epochs between two checkpoints, the last epoch is always saved -> default 1
+        - telemetry : Telemetry_log (utils/telemetry.py) receiving a record per epoch -> wall time of the train, train evaluation and 
+                      validation phases, data loading (batch gathering/augmentation and copy to the device) versus compute time, 
+                      samples per second and peak RSS, None to disable it -> default None
     
     Output :
     
-        - List of the train accuracy at each epoch
-        - List of the train losses at each epoch
-        - List of the validation accuracy at each epoch
-        - List of the validation loss at each epoch
+        - List of the train accuracy at each epoch -> nan at the epochs which are not evaluated with exact_train_metrics
+        - List of the train losses at each epoch -> nan at the epochs which are not evaluated with exact_train_metrics
+        - List of the validation accuracy at each epoch -> nan at the epochs which are not evaluated
+        - List of the validation loss at each epoch -> nan at the epochs which are not evaluated
+        -> with early stopping the lists only cover the epochs which were run (see pad_history)
     
     """
     # Accuracy and loss history of the train and validation data
@@ -44,28 +70,58 @@ def train_model(model, train_data, validation_data, device, mini_batch_size=100,
     valid_acc = []
     valid_losses = []
     
+    # CPU execution mode -> threads and channels_last model, settings None if disabled
+    perf = setup_cpu_perf(model, cpu_perf if device.type == 'cpu' else False)
+    
     # optimizer class initialized with the parameters passed in the constructor
     optimizer = optimizer(model.parameters(), lr = eta, weight_decay = lambda_l2)
-    # data loader 
-    train_loader = DataLoader(train_data, batch_size=mini_batch_size, shuffle=True)
+    # batch iterator -> the dataset is indexed by whole minibatches of indices so that augmentation is vectorized over the batch
+    train_loader = Batch_iterator(train_data, mini_batch_size, shuffle=True, pin_memory=(device.type == 'cuda'))
+    
+    # early stopping -> best monitored value, its epoch and a copy of the weights of this epoch
+    assert monitor in ['loss', 'accuracy'], "monitor should be 'loss' or 'accuracy'"
+    best, best_epoch, best_state = None, 0, None
     
-    for e in range(n_epochs):
+    # resume from the last checkpoint -> same weights, optimizer, random states and histories as at the end of its epoch
+    start, stop = 0, False
+    state = load_checkpoint(checkpoint)
+    if state is not None :
+        model.load_state_dict(state['model'])
+        optimizer.load_state_dict(state['optimizer'])
+        train_losses, train_acc, valid_losses, valid_acc = state['history']
+        best, best_epoch, best_state = state['early_stopping']
+        set_rng_state(state['rng'])
+        start, stop = state['epoch'] + 1, state['stopped']
+    writer = Checkpoint_writer() if checkpoint is not None else None
+    
+    for e in range(start if not stop else n_epochs, n_epochs):
+        # running loss (binary output) and number of errors on the train set
         epoch_loss = 0
+        epoch_errors = 0
         # set the model to train mode
         model.train(True)
+        # data loading and compute time of the epoch
+        data_time, compute_time = 0, 0
+        start_time = mark = time.perf_counter()
         for i, data in enumerate(train_loader, 0):
             
             # get the data from the batch
             input_, target_, classes_ = data
 
-            input_ = input_.to(device)
-            target_ = target_.to(device)
-            classes_ = classes_.to(device)
+            input_ = to_cpu_perf(input_.to(device, non_blocking=True), perf)
+            target_ = target_.to(device, non_blocking=True)
+            classes_ = classes_.to(device, non_blocking=True)
+            loaded = time.perf_counter()
+            data_time += loaded - mark
+            
+            # get model output -> under bfloat16 autocast in CPU execution mode, the losses are computed in float32
+            with autocast(perf) :
+                output = model(input_)
+            output = to_float(output) if perf is not None else output
             
             # check the name of the model to know if the output contain auxiliary loss 
             if (model.__class__.__name__ == 'LeNet_sharing_aux' or  model.__class__.__name__ == 'Google_Net') :
-                # get model output
-                class_1, class_2, out = model(input_)
+                class_1, class_2, out = output
                 # compute the different losses
                 aux_loss1 = criterion(class_1, classes_[:,0])
                 aux_loss2 = criterion(class_2, classes_[:,1])
@@ -73,24 +129,54 @@ def train_model(model, train_data, validation_data, device, mini_batch_size=100,
                 # Overall loss to minimize
                 net_loss = (alpha * (out_loss) + beta * (aux_loss1 + aux_loss2) ) 
             else :
-                # get the model output
-                out = model(input_)
+                out = output
                 # Compute the overall loss to minimize
                 net_loss  = criterion(out, target_)
+                out_loss = net_loss
 
-            # overral loss on the batch
-            epoch_loss += net_loss
+            # loss of the binary output and number of errors on the batch
+            epoch_loss += out_loss.detach()
+            epoch_errors += (out.detach().argmax(1) != target_).sum()
             
             # backward 
             optimizer.zero_grad()
             net_loss.backward()
             # gradient step
             optimizer.step()
+            
+            # the asynchronous GPU work is only waited for when the telemetry is recorded
+            if telemetry is not None and device.type == 'cuda' :
+                torch.cuda.synchronize()
+            mark = time.perf_counter()
+            compute_time += mark - loaded
+        train_time = mark - start_time
+        
+        # evaluate the validation set every eval_every epochs and at the last epoch
+        evaluate = ((e + 1) % eval_every == 0) or (e == n_epochs - 1)
         
-        # compute the loss and accuracy on the whole batch for the training for the epoch
-        tr_loss, tr_acc = compute_metrics(model, train_data, device)
+        # loss and accuracy on the train set for the epoch -> normalized as in compute_metrics
+        mark = time.perf_counter()
+        if exact_train_metrics and evaluate :
+            tr_loss, tr_acc = compute_metrics(model, train_data, device, cpu_perf=cpu_perf)
+        elif exact_train_metrics :
+            tr_loss, tr_acc = float('nan'), float('nan')
+        else :
+            tr_loss = epoch_loss.item() / train_data.len
+            tr_acc = 100 * (1 - epoch_errors.item() / train_data.len)
+        train_eval_time = time.perf_counter() - mark
         # compute the loss and accuracy on the validation set for the epoch
-        val_loss, val_acc = compute_metrics(model, validation_data, device)
+        mark = time.perf_counter()
+        if evaluate :
+            val_loss, val_acc = compute_metrics(model, validation_data, device, cpu_perf=cpu_perf)
+        else :
+            val_loss, val_acc = float('nan'), float('nan')
+        valid_time = time.perf_counter() - mark
+        
+        if telemetry is not None :
+            telemetry.record(epoch = e, train_time = train_time, data_time = data_time, compute_time = compute_time, 
+                             train_eval_time = train_eval_time, valid_time = valid_time, samples = train_data.len, 
+                             samples_per_sec = train_data.len / train_time, peak_rss = peak_rss(), train_loss = tr_loss, 
+                             train_acc = tr_acc, valid_loss = val_loss, valid_acc = val_acc)
         
         # Save the metrics in the list
         train_losses.append(tr_loss)
@@ -98,4 +184,74 @@ def train_model(model, train_data, validation_data, device, mini_batch_size=100,
         valid_acc.append(val_acc)
         valid_losses.append(val_loss)
         
+        # early stopping on the evaluated epochs
+        if patience is not None and evaluate :
+            value = val_loss if monitor == 'loss' else val_acc
+            if improved(value, best, monitor, min_delta) :
+                best, best_epoch = value, e
+                best_state = {name : tensor.detach().clone() for name, tensor in model.state_dict().items()}
+            elif e - best_epoch >= patience :
+                stop = True
+        
+        # checkpoint of the epoch written in the background
+        if writer is not None and ((e + 1) % checkpoint_every == 0 or e == n_epochs - 1 or stop) :
+            writer.save({'epoch' : e, 'stopped' : stop, 'model' : model.state_dict(), 'optimizer' : optimizer.state_dict(), 
+                         'history' : [train_losses, train_acc, valid_losses, valid_acc], 
+                         'early_stopping' : [best, best_epoch, best_state], 'rng' : rng_state()}, checkpoint)
+        if stop :
+            break
+    
+    # wait for the last checkpoint
+    if writer is not None :
+        writer.close()
+    
+    # restore the weights of the best epoch
+    if best_state is not None :
+        model.load_state_dict(best_state)
+        
+    return train_losses, train_acc, valid_losses, valid_acc
+
+##############################################################################################################
+
+def improved(value, best, monitor='loss', min_delta=0):
+    
+    """ True if a validation metric improves on the best one by more than min_delta -> lower loss or higher accuracy """
+    
+    if best is None :
+        return True
+    
+    return value < best - min_delta if monitor == 'loss' else value > best + min_delta
+
+##############################################################################################################
+
+def pad_history(history, n_epochs, monitor='loss', min_delta=0, eval_every=1):
+    
+    """
+    Extend the history of a training stopped early to n_epochs epochs
+    
+        The epochs after the stop repeat the metrics of the best epoch (replayed with the rule of train_model), whose weights were 
+        restored -> fixed size (4,n_epochs) results whose last epoch describes the returned model
+    
+    Input : 
+        
+        - history : train losses, train accuracy, validation losses and validation accuracy lists returned by train_model
+        -> n_epochs, monitor, min_delta, eval_every see train_model
+        
+    Output : the four lists of length n_epochs
+    """
+    train_losses, train_acc, valid_losses, valid_acc = [list(metric) for metric in history]
+    if len(train_losses) == n_epochs :
+        return train_losses, train_acc, valid_losses, valid_acc
+    
+    best, best_epoch = None, len(train_losses) - 1
+    for e in range(len(train_losses)) :
+        if (e + 1) % eval_every != 0 :
+            continue
+        value = valid_losses[e] if monitor == 'loss' else valid_acc[e]
+        if improved(value, best, monitor, min_delta) :
+            best, best_epoch = value, e
+    
+    for metric in [train_losses, train_acc, valid_losses, valid_acc] :
+        metric.extend([metric[best_epoch]] * (n_epochs - len(metric)))
+    
     return train_losses, train_acc, valid_losses, valid_acc
\ No newline at end of file